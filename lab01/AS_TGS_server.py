@@ -3,20 +3,20 @@
 import logging
 import time
 from _thread import start_new_thread
-import traceback
-from sys import stderr
 from os import urandom
 
 # local library crypto
 import run_node
 from run_node import servers_config_data, nodes_config_data, config, KEY_CHARSET, SENTINEL
 from run_node import PKca
-from crypto import KeyManager, DES
+from crypto import KeyManager, DES, CharacterEncoder
+import modes
+from hmac import SimpleHmacEncoder, UnexpectedMac, MODE_RFC2104, MAC_SIZE, compare_digest
 import rsa
 from node import Node
 from client import Client
-from server import Server
-from ticket import receive_ticket
+from server import PoolServer
+from ticket import receive_ticket, check_authenticator, ReplayedAuthenticator
 
 
 # debug modes
@@ -32,6 +32,10 @@ ID_pki = 'ID-Server'
 # services provided
 MEMO_REQ = 'memo'
 
+# session resumption request, and its refusal
+RESUME_REQ = 'resume'
+RESUME_FAILED = 'resume failed'
+
 # the service data requested
 MEMO_DATA = 'take cis3319 class this morning'
 
@@ -43,6 +47,8 @@ ASTGS = servers_config_data[SECTION]
 CAUTH = servers_config_data['CertificateAuthority']
 # load node data
 NODE = nodes_config_data[SECTION]
+# load the number of clients served at once, and waiting
+MAX_WORKERS, BACKLOG = (config[SECTION][key] for key in 'max_workers, backlog'.split(', '))
 
 # size for DES keys
 DES_KEY_SIZE = 8
@@ -64,31 +70,6 @@ def serveApplication(client_data, cauth_data, atgs_data):
     respondKerberos(client_data, atgs_data)
 
 
-def clientRegistrationThread(atgsServer, callback, callback_args):
-    old_tb = None
-    print(end=EXIT_INSTRUCTION, flush=True)
-    # loop indefinitely
-    while True:
-        try:
-            print()
-            print()
-            callback(*callback_args)
-
-            # repeat the exit instruction
-            print(end=EXIT_INSTRUCTION, flush=True)
-            # accept next connection
-            atgsServer.acceptNextConnection()
-        except Exception as e:
-            tb = traceback.format_exc()
-            # don't repeat the trackback
-            if (tb != old_tb):
-                print(file=stderr)
-                logging.error(tb)
-            old_tb = tb
-            print(end=EXIT_INSTRUCTION, flush=True)
-    # end while True
-
-
 #######################################################################
 # PKI-based authentication
 #######################################################################
@@ -108,14 +89,23 @@ def requestCertificate(client_data, cauth_data, atgs_data):
         # close the node
         caClient.close()
 
+    # the Kerberos keys are shared by all clients, so find them once
+    DES_tgs, DES_v = kerberos_keys()
+    # resumption tickets are sealed with keys known only to this run
+    # of the server, so restarting it revokes them all
+    sealer_res = TicketSealer()
+
     AD_c = f'{atgs_data.addr}:{atgs_data.port}'
     logging.info(f'{client_data.connecting_status} {AD_c} . . .')
-    atgsServer = Server(atgs_data.addr, atgs_data.port)
+    # serve each client registration on the worker pool
+    atgsServer = PoolServer(atgs_data.addr, atgs_data.port,
+        (lambda client: clientRegistrationCallback(client,
+            PKs, SKs, Cert_s, sealer_res, atgs_data.charset, AD_c, DES_tgs, DES_v)),
+        MAX_WORKERS, BACKLOG)
 
     # listen for new client registrations
-    start_new_thread(clientRegistrationThread,
-        (atgsServer, clientRegistrationCallback,
-            (atgsServer, PKs, SKs, Cert_s, atgs_data.charset, AD_c)))
+    print(end=EXIT_INSTRUCTION, flush=True)
+    start_new_thread(atgsServer.serve_forever, ())
 
     while True:
         # TODO: your code here
@@ -129,17 +119,14 @@ def requestCertificate(client_data, cauth_data, atgs_data):
     atgsServer.close()
 
 
-def clientRegistrationCallback(atgsServer, PKs, SKs, Cert_s, charset, AD_c):
+def clientRegistrationCallback(atgsServer, PKs, SKs, Cert_s, sealer_res, charset, AD_c, DES_tgs, DES_v):
     print('###############################################################')
     print('# PKI-based authentication')
     print('###############################################################')
 
     # (b) client registration: to obtain session key for further
-    # communication
-    receive_public_key_certificate_request(atgsServer)
-    send_public_key_certificate(atgsServer, PKs, Cert_s)
-    DES_tmp2, ID_c = receive_registration_information(atgsServer, SKs)
-    DES_sess = send_session_key(atgsServer, DES_tmp2, ID_c)
+    # communication, or (b') its resumption by a returning client
+    DES_sess = register_client(atgsServer, PKs, SKs, Cert_s, sealer_res)
 
     # (c) service request: to obtain application data
     req = receive_service_data_request(atgsServer, DES_sess)
@@ -149,8 +136,7 @@ def clientRegistrationCallback(atgsServer, PKs, SKs, Cert_s, charset, AD_c):
     send_service_data(atgsServer, DES_sess)
 
     # DES_sess is the key DES_c for the Kerberos
-    # get the other keys too
-    DES_tgs, DES_v = kerberos_keys()
+    # with the shared keys DES_tgs, DES_v
 
     # repeat exit message while waiting for kerberos
     print(end=EXIT_INSTRUCTION)
@@ -171,7 +157,7 @@ def register_with_certificate_authority(client):
     # create the registration
     plain_cert_registration = f'{K_tmpl_str}||{ID_pki}||{TS1}'
     # encode the registration
-    cipher_cert_registration = rsa.encode(*PKca, plain_cert_registration)
+    cipher_cert_registration = rsa.encrypt(PKca, plain_cert_registration)
     print(f'(a1) S encoded: {cipher_cert_registration}')
     print(f'(a1) S generated: {K_tmpl_byts}')
     print()
@@ -199,11 +185,35 @@ def receive_certificate(client, DES_tmpl):
     return (PKs, SKs, Cert_s_cipher)
 
 
+def register_client(server, PKs, SKs, Cert_s, sealer_res):
+    '''
+    Serves a client registration.  A returning client presenting a good
+    resumption ticket gets a new session key in one round trip, without
+    any RSA; otherwise the full PKI handshake is run.
+    @param sealer_res: TicketSealer = seals the resumption tickets
+    @return the session cipher DES_sess
+    '''
+    msg = receive_public_key_certificate_request(server)
+    if (msg.startswith(f'{RESUME_REQ}||')):
+        DES_sess = resume_session(server, msg, sealer_res)
+        if (DES_sess is not None):
+            return DES_sess
+        # the client falls back to the full handshake
+        receive_public_key_certificate_request(server)
+    # end if (msg.startswith(f'{RESUME_REQ}||'))
+    send_public_key_certificate(server, PKs, Cert_s)
+    DES_tmp2, ID_c = receive_registration_information(server, SKs)
+    return send_session_key(server, DES_tmp2, ID_c, sealer_res)
+# end def register_client(server, PKs, SKs, Cert_s, sealer_res)
+
+
 def receive_public_key_certificate_request(server):
     # (3Rx): C -> S:     ID_s||TS3
+    # or (3'Rx) for a resumption
     msg = run_node.recv_blocking(server).decode(KEY_CHARSET)
     print(f'(b3) S Received: {msg}')
     print()
+    return msg
 
 def send_public_key_certificate(server, PKs, Cert_s):
     # (4Tx): S -> C:    PKs||Cert_s||TS4
@@ -225,7 +235,7 @@ def receive_registration_information(server, SKs):
     cipher_msg = run_node.recv_blocking(server).decode(KEY_CHARSET)
     print(f'(b5) S Received: {cipher_msg}')
     # decode the registration
-    plain_msg = rsa.decode(*SKs, cipher_msg)
+    plain_msg = rsa.decrypt(SKs, cipher_msg)
     # split it into its fields
     K_tmp2_str, ID_c, IP_c, Port_c, TS5 = plain_msg.split('||')
     # encode the key, and create its DES object
@@ -236,20 +246,138 @@ def receive_registration_information(server, SKs):
     return (DES_tmp2, ID_c)
 
 
-def send_session_key(server, DES_tmp2, ID_c):
-    # (6Tx) S -> C:     DES[K_tmp2][K_sess||Lifetime_sess||ID_c||TS6]
+def send_session_key(server, DES_tmp2, ID_c, sealer_res):
+    # (6Tx) S -> C:     DES[K_tmp2][K_sess||Lifetime_sess||ID_c||TS6||Ticket_res]
+    # s.t. Ticket_res = DES[K_res][K_sess||ID_c||expiry]
+    DES_sess, plain_session_key_msg = create_session_key(ID_c, sealer_res)
+    cipher_session_key_msg = DES_tmp2.encrypt(plain_session_key_msg)
+    print(f'(b6) S encrypted: {cipher_session_key_msg}')
+    print()
+    server.send(cipher_session_key_msg)
+    return DES_sess
+
+
+def create_session_key(ID_c, sealer_res):
+    '''
+    Creates a session key, and the message giving it to the client with
+    its resumption ticket.
+    @return (DES_sess, K_sess||Lifetime_sess||ID_c||TS||Ticket_res)
+    '''
     # create session key
     K_sess_byts = KeyManager().generate_key()
     K_sess_str = K_sess_byts.decode(KEY_CHARSET)
-    # create its DES object
-    DES_sess = DES(K_sess_byts)
+    # create its session cipher object
+    DES_sess = run_node.SessionCipher(K_sess_byts)
     # get a time stamp
-    TS6 = time.time()
-    # assemble the session key message
-    plain_session_key_msg = f'{K_sess_str}||{Lifetimes[SESS]}||{ID_c}||{TS6}'
-    cipher_session_key_msg = DES_tmp2.encrypt(plain_session_key_msg)
-    print(f'(b6) S encrypted: {cipher_session_key_msg}')
+    TS = time.time()
+    # seal the key in a ticket for resuming the session later
+    Ticket_res = create_resumption_ticket(sealer_res, K_sess_byts, ID_c, (TS + Lifetimes[SESS]))
     print(f'(b6) S generated: {K_sess_byts}')
+    # assemble the session key message
+    return (DES_sess, f'{K_sess_str}||{Lifetimes[SESS]}||{ID_c}||{TS}||{Ticket_res}')
+
+
+def create_resumption_ticket(sealer_res, K_sess_byts, ID_c, expiry):
+    '''
+    Seals a session key in a resumption ticket, opaque to the client.
+    @param sealer_res: TicketSealer = seals the resumption tickets
+    @param K_sess_byts: bytes = the session key
+    @param ID_c: str = the client registered
+    @param expiry: float = time until which the session may be resumed
+    @return Ticket_res = sealed K_sess||ID_c||expiry, in hexadecimal
+            as the ciphertext may hold the separator
+    '''
+    return sealer_res.seal(f'{K_sess_byts.hex()}||{ID_c}||{expiry}').hex()
+
+
+def open_resumption_ticket(sealer_res, Ticket_res):
+    '''
+    Opens a resumption ticket.
+    @return (K_sess_byts, ID_c, expiry) sealed in it
+    @raise ValueError if it is malformed
+    @raise UnexpectedMac if it was not sealed by sealer_res, or was
+            altered
+    '''
+    plain_ticket = sealer_res.open(bytes.fromhex(Ticket_res)).rstrip('\0')
+    K_sess_hex, ID_c, expiry = plain_ticket.split('||')
+    return (bytes.fromhex(K_sess_hex), ID_c, float(expiry))
+
+
+class TicketSealer:
+    '''
+    Seals tickets readable and writable only by this server: encrypt
+    then MAC.  The ticket is DES in CBC mode under a random IV, followed
+    by HMAC-SHA256 of the IV and ciphertext under a separate key, so
+    any change to it, such as splicing blocks of 2 tickets, is refused
+    before decryption.
+    '''
+
+    def __init__(self, K_enc: bytes=None, K_mac: bytes=None):
+        '''
+        Initializes the sealer.
+        @param K_enc: bytes = the DES key (default random)
+        @param K_mac: bytes = the HMAC key (default random)
+        '''
+        if (K_enc is None):
+            K_enc = KeyManager().generate_key()
+        if (K_mac is None):
+            K_mac = KeyManager().generate_key()
+        self.des = DES(K_enc)
+        self.mac = SimpleHmacEncoder(CharacterEncoder(), K_mac, MODE_RFC2104)
+
+    def seal(self, plain: str) -> bytes:
+        '''
+        @param plain: str = to seal
+        @return IV||DES-CBC[K_enc][plain]||HMAC[K_mac][IV||ciphertext]
+        '''
+        cipher = modes.encryptor(self.des, modes.CBC)
+        body = b''.join((cipher.iv, cipher.update(plain.encode('utf-8')), cipher.finalize()))
+        return (body + self.mac.hmac(body))
+
+    def open(self, sealed: bytes) -> str:
+        '''
+        @param sealed: bytes = sealed by seal
+        @return the plain string, with its 0 padding
+        @raise UnexpectedMac if the MAC does not match
+        '''
+        # at least the IV and 1 block
+        if (len(sealed) < (2*modes.BLOCK_SIZE + MAC_SIZE)):
+            raise UnexpectedMac('sealed ticket too short')
+        body, theo_mac = (sealed[:-MAC_SIZE], sealed[-MAC_SIZE:])
+        # check the MAC before any decryption
+        if (not(compare_digest(theo_mac, self.mac.hmac(body)))):
+            raise UnexpectedMac('sealed ticket was altered')
+        iv, ciphertext = (body[:modes.BLOCK_SIZE], body[modes.BLOCK_SIZE:])
+        cipher = modes.decryptor(self.des, modes.CBC, iv)
+        return b''.join((cipher.update(ciphertext), cipher.finalize())).decode('utf-8')
+# end class TicketSealer
+
+
+def resume_session(server, msg, sealer_res):
+    # (3'Rx) C -> S:    resume||Ticket_res||Authenticator_c
+    # s.t. Authenticator_c = DES[K_sess][ID_c||AD_c||TS3]
+    # (4'Tx) S -> C:    DES[K_sess][K_sess'||Lifetime_sess||ID_c||TS4||Ticket_res']
+    # or resume failed, if the ticket or authenticator is bad
+    try:
+        REQ, Ticket_res, Authenticator_hex = msg.split('||')
+        K_sess_byts, ID_c, expiry = open_resumption_ticket(sealer_res, Ticket_res)
+        if (time.time() >= expiry):
+            raise ResumptionRefused(f'session of {ID_c} expired at {expiry}')
+        DES_sess_old = run_node.SessionCipher(K_sess_byts)
+        # only the holder of K_sess can make the authenticator, once
+        Authenticator_c = bytes.fromhex(Authenticator_hex).decode(KEY_CHARSET)
+        ID_c_auth, AD_c, TS3 = check_authenticator(DES_sess_old, Authenticator_c)
+        if (ID_c_auth != ID_c):
+            raise ResumptionRefused(f'ticket of {ID_c} presented by {ID_c_auth}')
+    except (ValueError, UnexpectedMac, ResumptionRefused, ReplayedAuthenticator) as e:
+        logging.warning(f'(b4) S refused resumption: {e}')
+        server.send(RESUME_FAILED.encode(KEY_CHARSET))
+        return None
+    # end try
+    print(f'(b3) S resuming session of: {ID_c}')
+    DES_sess, plain_session_key_msg = create_session_key(ID_c, sealer_res)
+    cipher_session_key_msg = DES_sess_old.encrypt(plain_session_key_msg)
+    print(f'(b4) S encrypted: {cipher_session_key_msg}')
     print()
     server.send(cipher_session_key_msg)
     return DES_sess
@@ -287,6 +415,13 @@ class BadRequest(Exception):
     '''
 
 
+class ResumptionRefused(Exception):
+    '''
+    Thrown when a resumption ticket has expired, or was presented by
+    another client.
+    '''
+
+
 #######################################################################
 # Kerberos
 #######################################################################
@@ -298,15 +433,19 @@ def respondKerberos(node_data, server_data):
     # create the Kerberos server
     AD_c = f'{server_data.addr}:{server_data.port}'
     logging.info(f'{node_data.connecting_status} {AD_c} . . .')
-    server = Server(server_data.addr, server_data.port)
-
     # read the default client key
-    DES_c = DES(KeyManager.read_key(config['kerberos_keys']['Kc_file']))
+    DES_c = DES.for_key(KeyManager.read_key(config['kerberos_keys']['Kc_file']))
     # get the other keys too
     DES_tgs, DES_v = kerberos_keys()
 
-    # listen for new client registrations
-    start_new_thread(clientRegistrationThread, (server, server_data.charset, DES_c, DES_tgs, DES_v, AD_c))
+    # serve each client on the worker pool
+    server = PoolServer(server_data.addr, server_data.port,
+        (lambda client: kerberosCallback(client,
+            server_data.charset, DES_c, DES_tgs, DES_v, AD_c)),
+        MAX_WORKERS, BACKLOG)
+
+    # listen for new clients
+    start_new_thread(server.serve_forever, ())
 
     while True:
         # TODO: your code here
@@ -333,8 +472,8 @@ def kerberosCallback(server, charset, DES_c, DES_tgs, DES_v, AD_c):
 
 def kerberos_keys():
     # read each key
-    # and create DES for Ktgs and Kv
-    DES_tgs, DES_v = (DES(KeyManager.read_key(config['kerberos_keys'][file]))
+    # and find the cached DES for Ktgs and Kv
+    DES_tgs, DES_v = (DES.for_key(KeyManager.read_key(config['kerberos_keys'][file]))
         for file in 'K_tgs_file, Kv_file'.split(', '))
     return (DES_tgs, DES_v)
 
@@ -353,8 +492,9 @@ def serve_ticket_granting(server, charset, DES_tgs, DES_v, AD_c):
     if (not(sgt_request)):
         return
     # split the service-granting ticket request
-    # Authenticator_c is not needed
-    ID_v, _, DES_c_tgs, ID_c = sgt_request
+    ID_v, Authenticator_c, DES_c_tgs, ID_c = sgt_request
+    # refuse a replayed authenticator
+    check_authenticator(DES_c_tgs, Authenticator_c)
     # send the service-granting ticket
     send_service_granting_ticket(server, DES_c_tgs, DES_v, ID_c, AD_c, ID_v)
 # end def serve_ticket_granting(server, charset, DES_tgs, DES_v, AD_c)
@@ -403,8 +543,8 @@ def send_service_granting_ticket(server, DES_c_tgs, DES_v, ID_c, AD_c, ID_v):
 
 def create_ticket(server, des_next_server, ID_c, AD_c, server_ID, fail_timestamp, Lifetime):
     # Ticket = E(K_next_dest
-    # create a random key
-    K_c_next_server_byts = urandom(DES_KEY_SIZE)
+    # create a random key for the session cipher
+    K_c_next_server_byts = urandom(run_node.SessionCipher.KEY_SIZE)
     K_c_next_server_chars = K_c_next_server_byts.decode(KEY_CHARSET)
     # get a time stamp
     TS = time.time()
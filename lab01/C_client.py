@@ -1,9 +1,13 @@
 
 # standard libraries
+import json
 import logging
+import os
+import tempfile
 import time
 from _thread import start_new_thread
 import traceback
+from collections import namedtuple
 from sys import stderr
 
 # local library crypto
@@ -13,8 +17,9 @@ from run_node import PKca
 from crypto import KeyManager, DES
 import rsa
 from client import Client
+from cache import LruCache
 from ticket import TICKET_EXPIRED
-from AS_TGS_server import ID_ker as ID_tgs, ID_pki as ID_s, MEMO_REQ
+from AS_TGS_server import ID_ker as ID_tgs, ID_pki as ID_s, MEMO_REQ, RESUME_REQ, RESUME_FAILED
 from V_server import ID as ID_v
 
 
@@ -31,6 +36,13 @@ V_SERVER, AS_TGS_SERVER, CERTIFICATE_AUTHORITY = (
     servers_config_data[server] for server in 'V_server, AS_TGS_server, CertificateAuthority'.split(', '))
 # load client data
 CLIENT = nodes_config_data[SECTION]
+# load the number of verified certificates to keep, and the file
+# whereto to save them (None to keep them in memory only)
+CERT_CACHE_SIZE, CERT_CACHE_FILE = (config[SECTION][key]
+    for key in 'cert_cache_size, cert_cache_file'.split(', '))
+# load the file whereto to save the resumption ticket (None to keep it
+# in memory only)
+RESUMPTION_FILE = config[SECTION]['resumption_file']
 
 
 #######################################################################
@@ -81,13 +93,21 @@ def requestServers(client_data, cauth_data, atgs_data, v_server_data):
 # end def requestServers()
 
 
-def requestClientRegistrationService(client):
-    # (b) client registration: to obtain session key for further
-    # communication
-    request_server_public_key_certificate(client)
-    PKs, Cert_s = send_public_key_certificate(client)
-    DES_tmp2 = send_registration_information(client, Cert_s, PKs)
-    DES_sess = receive_session_key(client, DES_tmp2)
+def requestClientRegistrationService(client, store=None):
+    # the resumption ticket from an earlier session, if any
+    if (store is None):
+        store = resumption_store
+    # (b') session resumption: to obtain a new session key in one round
+    # trip, skipping the registration
+    DES_sess = resume_session(client, store)
+    if (DES_sess is None):
+        # (b) client registration: to obtain session key for further
+        # communication
+        request_server_public_key_certificate(client)
+        PKs, Cert_s = send_public_key_certificate(client)
+        DES_tmp2 = send_registration_information(client, Cert_s, PKs)
+        DES_sess = receive_session_key(client, DES_tmp2, store)
+    # end if (DES_sess is None)
 
     # (c) service request: to obtain application data
     request_service_data(client, DES_sess)
@@ -134,7 +154,7 @@ def send_registration_information(client, Cert_s, PKs):
     # create the registration information
     plain_registration_info = f'{K_tmp2_str}||{ID_pki}||{client.node.addr}||{client.node.port}||{TS5}'
     # encode the registration inormation using PKs
-    cipher_registration_info = rsa.encode(*PKs, plain_registration_info)
+    cipher_registration_info = rsa.encrypt(PKs, plain_registration_info)
     print(f'(b5) C sending: {plain_registration_info}')
     print(f'(b5) C encoded: {cipher_registration_info}')
     print(f'(b5) C generated: {K_tmp2_byts}')
@@ -147,36 +167,257 @@ def send_registration_information(client, Cert_s, PKs):
 def validate_certificate(Cert_s, PKs):
     # note: Cert_s = Sign[SKca][ID_s||ID_ca||PKs]
     # verify the PKs and Cert_s
-    # first decode Cert_s
-    plain_Cert_s = rsa.decode(*PKca, Cert_s)
-    # split the certificate
-    ID_s_rx, ID_ca, PKs_rx_str = plain_Cert_s.split('||')
+    # first decode Cert_s, unless verified before
+    ID_s_rx, ID_ca, PKs_rx = verify_certificate(Cert_s, PKca)
     # compare the 2 ID_s values
     if (ID_s_rx != ID_s):
         raise IncorrectServerIdentity(f'expected: {ID_s};  certificate gave: {ID_s_rx}')
     # compare the two public keys
-    PKs_rx = rsa.str2key(PKs_rx_str)
     if (PKs_rx != PKs):
         raise IncorrectPublicKey(f'expected: {PKs};  server {ID_s} gave: {PKs_rx}')
 
 
-def receive_session_key(client, DES_tmp2):
-    # (6Rx) S -> C:     DES[K_tmp2][K_sess||Lifetime_sess||ID_c||TS6]
+def verify_certificate(Cert_s, PKca, cache=None):
+    '''
+    Verifies the certificate with the CA public key, and parses it.  The
+    result is kept in the cache of verified certificates, so a
+    certificate seen before, even before a restart, is not decoded
+    again.
+    @param Cert_s: str = the signed certificate
+    @param PKca: RsaKey = public key of the certificate authority
+    @param cache: CertificateCache = cache of verified certificates
+            (default certificate_cache)
+    @return (ID_s, ID_ca, PKs) from the certificate
+    '''
+    if (cache is None):
+        cache = certificate_cache
+    key = (Cert_s, rsa.key2str(PKca))
+    certificate = cache.get(key)
+    if (certificate is not None):
+        return certificate
+    # verify the signature of Cert_s
+    plain_Cert_s = rsa.verify_message(PKca, Cert_s)
+    # split the certificate
+    ID_s_rx, ID_ca, PKs_rx_str = plain_Cert_s.split('||')
+    certificate = (ID_s_rx, ID_ca, rsa.str2key(PKs_rx_str))
+    cache.put(key, certificate)
+    cache.save()
+    return certificate
+
+
+class CertificateCache(LruCache):
+    '''
+    A size-bounded cache of verified certificates, mapping
+    (Cert_s, PKca string) to the parsed (ID_s, ID_ca, PKs).  It may be
+    saved to a file, which is trusted as the key files are.
+    '''
+
+    def __init__(self, maxsize: int, path: str=None):
+        '''
+        Initializes the cache, loading the certificates saved in path.
+        @param maxsize: int = maximum number of certificates to keep
+        @param path: str = file whereto to save the certificates, or
+                None to keep them in memory only
+        '''
+        super().__init__(maxsize)
+        self.path = path
+        if ((path is not None) and os.path.exists(path)):
+            self.load()
+
+    def load(self):
+        '''
+        Adds the certificates saved in the file, least recently used
+        first.  An unreadable file is ignored.
+        '''
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+            for Cert_s, PKca_str, ID_s_rx, ID_ca, PKs_str in entries:
+                self.put((Cert_s, PKca_str), (ID_s_rx, ID_ca, rsa.str2key(PKs_str)))
+        except (OSError, ValueError) as e:
+            logging.warning(f'ignoring certificate cache {self.path}: {e}')
+
+    def save(self):
+        '''
+        Saves the certificates to the file, if any, replacing it at once.
+        '''
+        if (self.path is None):
+            return
+        with self.lock:
+            entries = [(Cert_s, PKca_str, ID_s_rx, ID_ca, rsa.key2str(PKs))
+                for ((Cert_s, PKca_str), (ID_s_rx, ID_ca, PKs)) in self.entries.items()]
+        save_json(self.path, entries)
+# end class CertificateCache
+
+
+def save_json(path: str, obj):
+    '''
+    Writes obj as JSON to path, replacing it at once.  The file is
+    readable and writable only by its owner.
+    @param path: str = the file to replace
+    @param obj = a JSON serializable object
+    '''
+    # a unique temporary file beside path, so concurrent saves do not
+    # collide, and the replacement stays on one file system;
+    # NamedTemporaryFile creates it with mode 0600
+    with tempfile.NamedTemporaryFile('w', dir=(os.path.dirname(path) or '.'),
+            prefix=f'{os.path.basename(path)}.', suffix='.tmp', delete=False) as f:
+        tmp_path = f.name
+        try:
+            json.dump(obj, f)
+        except BaseException:
+            f.close()
+            os.unlink(tmp_path)
+            raise
+    try:
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+# end def save_json(path: str, obj)
+
+
+# the verified certificates, kept across runs
+certificate_cache = CertificateCache(CERT_CACHE_SIZE, CERT_CACHE_FILE)
+
+
+def receive_session_key(client, DES_tmp2, store):
+    # (6Rx) S -> C:     DES[K_tmp2][K_sess||Lifetime_sess||ID_c||TS6||Ticket_res]
     # receive the message
     cipher_msg = run_node.recv_blocking(client)
     print(f'(b6) C Received: {cipher_msg}')
     # decrypt the registration
     plain_msg = DES_tmp2.decrypt(cipher_msg)
-    # split it into its fields
-    K_sess_str, Lifetime_sess, IP_c, TS6 = plain_msg.split('||')
+    return parse_session_key(plain_msg, store)
+
+
+def parse_session_key(plain_msg, store):
+    '''
+    Parses a session key message, and stores its resumption ticket.
+    @param plain_msg: str = K_sess||Lifetime_sess||ID_c||TS||Ticket_res
+    @param store: ResumptionStore = whereto to keep the ticket
+    @return the session cipher DES_sess
+    '''
+    # split it into its fields, from the right as only the key may
+    # hold the separator
+    K_sess_str, Lifetime_sess, IP_c, TS, Ticket_res = plain_msg.rstrip('\0').rsplit('||', 4)
     # encode the key, and create its DES object
     K_sess_byts = K_sess_str.encode(KEY_CHARSET)
-    DES_sess = DES(K_sess_byts)
+    DES_sess = run_node.SessionCipher(K_sess_byts)
     print(f'(b6) S found key: {K_sess_byts}')
     print()
+    store.put(ResumptionTicket(Ticket_res, K_sess_byts, (float(TS) + float(Lifetime_sess))))
     return DES_sess
 
 
+def resume_session(client, store):
+    # (3'Tx) C -> S:    resume||Ticket_res||Authenticator_c
+    # s.t. Authenticator_c = DES[K_sess][ID_c||AD_c||TS3]
+    # (4'Rx) S -> C:    DES[K_sess][K_sess'||Lifetime_sess||ID_c||TS4||Ticket_res']
+    # or resume failed
+    # stop if there is no session to resume
+    ticket = store.get()
+    if (ticket is None):
+        return None
+    DES_sess_old = run_node.SessionCipher(ticket.K_sess)
+    # get a time stamp
+    TS3 = time.time()
+    # create the authenticator
+    plain_Authenticator_c = f'{ID_pki}||{client.node.addr}:{client.node.port}||{TS3}'
+    cipher_Authenticator_c = DES_sess_old.encrypt(plain_Authenticator_c)
+    # send the ticket and authenticator, both in hexadecimal
+    plain_resumption = f'{RESUME_REQ}||{ticket.Ticket_res}||{cipher_Authenticator_c.hex()}'
+    print(f'(b3) C sending: {plain_resumption}')
+    print()
+    client.send(plain_resumption.encode(KEY_CHARSET))
+    # receive the new session key
+    cipher_msg = run_node.recv_blocking(client)
+    print(f'(b4) C Received: {cipher_msg}')
+    if (cipher_msg == RESUME_FAILED.encode(KEY_CHARSET)):
+        # forget the ticket, and register again
+        store.clear()
+        return None
+    return parse_session_key(DES_sess_old.decrypt(cipher_msg), store)
+
+
+# a resumption ticket, with the session key sealed in it and its expiry
+ResumptionTicket = namedtuple('ResumptionTicket', ('Ticket_res', 'K_sess', 'expiry'))
+
+
+class ResumptionStore:
+    '''
+    Keeps the latest resumption ticket until it expires.  It may be
+    saved to a file, which holds the session key, so is trusted as the
+    key files are.
+    '''
+
+    def __init__(self, path: str=None, clock: 'Callable[[], float]'=time.time):
+        '''
+        Initializes the store, loading the ticket saved in path.
+        @param path: str = file whereto to save the ticket, or None to
+                keep it in memory only
+        @param clock = returns the current time, as for expiry times
+        '''
+        self.path = path
+        self.clock = clock
+        self.ticket = None
+        if ((path is not None) and os.path.exists(path)):
+            self.load()
+
+    def get(self) -> ResumptionTicket:
+        '''
+        @return the ticket, or None if there is none or it has expired
+        '''
+        ticket = self.ticket
+        if ((ticket is None) or (self.clock() >= ticket.expiry)):
+            return None
+        return ticket
+
+    def put(self, ticket: ResumptionTicket):
+        '''
+        Stores ticket, replacing any earlier one.
+        '''
+        self.ticket = ticket
+        self.save()
+
+    def clear(self):
+        '''
+        Forgets the ticket.
+        '''
+        self.put(None)
+
+    def load(self):
+        '''
+        Loads the ticket saved in the file.  An unreadable file is
+        ignored.
+        '''
+        try:
+            with open(self.path, 'r') as f:
+                entry = json.load(f)
+            if (entry is not None):
+                Ticket_res, K_sess_hex, expiry = entry
+                self.ticket = ResumptionTicket(Ticket_res, bytes.fromhex(K_sess_hex), float(expiry))
+        except (OSError, ValueError, TypeError) as e:
+            logging.warning(f'ignoring resumption ticket {self.path}: {e}')
+
+    def save(self):
+        '''
+        Saves the ticket to the file, if any, replacing it at once.
+        '''
+        if (self.path is None):
+            return
+        ticket = self.ticket
+        entry = (None if (ticket is None)
+            else (ticket.Ticket_res, ticket.K_sess.hex(), ticket.expiry))
+        # the session key is secret, so only the owner may read it
+        save_json(self.path, entry)
+# end class ResumptionStore
+
+
+# the resumption ticket, kept across runs
+resumption_store = ResumptionStore(RESUMPTION_FILE)
+
+
 def request_service_data(client, DES_sess):
     # (7Tx) C -> S:     DES[K_sess][req||TS7]
     # get a time stamp
@@ -224,7 +465,7 @@ def mainRequestKerberos(atgsClient, connecting_status, atgs_data):
     Runs Kerberos with the default key DES_c.
     '''
     # read the key and create DES for C/AS
-    DES_c = DES(KeyManager.read_key(config['kerberos_keys']['Kc_file']))
+    DES_c = DES.for_key(KeyManager.read_key(config['kerberos_keys']['Kc_file']))
 
 
 def request_kerberos(atgsClient, connecting_status, atgs_data, DES_c, AD_c_tsg, v_server_data):
@@ -293,8 +534,8 @@ def receive_ticket_granting_ticket(client, DES_c):
     print()
     # split the message
     K_c_tgs, ID_tgs, TS2, Lifetime2, Ticket_tgs = msg_chars.split('||')
-    # create DES for K_c_tgs
-    DES_c_tgs = DES(K_c_tgs.encode(KEY_CHARSET))
+    # create the session cipher for K_c_tgs
+    DES_c_tgs = run_node.SessionCipher(K_c_tgs.encode(KEY_CHARSET))
     return (DES_c_tgs, Ticket_tgs)
 # end def receive_ticket_granting_ticket(client)
 
@@ -347,8 +588,8 @@ def parse_service_granting_ticket(sgt):
     # (4Rx) TGS -> C:   E(K_c_tgs, [K_c_v || ID_v || TS4 || Ticket_v])
     # split the message
     K_c_v, ID_v, TS4, Ticket_v = sgt.split('||')
-    # create DES for K_c_v
-    DES_c_v = DES(K_c_v.encode(KEY_CHARSET))
+    # create the session cipher for K_c_v
+    DES_c_v = run_node.SessionCipher(K_c_v.encode(KEY_CHARSET))
     return (DES_c_v, Ticket_v)
 # end def parse_service_granting_ticket(sgt)
 
@@ -3,7 +3,8 @@
 import logging
 import time
 from _thread import start_new_thread
-import traceback
+from queue import Queue, Empty, Full
+from threading import Lock, Event, Thread
 
 # local library crypto
 import run_node
@@ -12,7 +13,7 @@ from run_node import SKca
 from crypto import KeyManager, DES
 import rsa
 from node import Node
-from server import Server
+from server import PoolServer
 
 # ID for this node in PKI
 ID_pki = 'ID-CA'
@@ -23,38 +24,126 @@ SECTION = 'CertificateAuthority'
 SERVER = servers_config_data[SECTION]
 # load node data
 NODE = nodes_config_data[SECTION]
+# load the number of registrations served at once, and waiting,
+# and the number of key pairs to keep ready
+MAX_WORKERS, BACKLOG, KEY_POOL_SIZE = (config[SECTION][key]
+    for key in 'max_workers, backlog, key_pool_size'.split(', '))
+# load the size of the generated moduli (None for legacy keys)
+RSA_KEY_BITS = config[SECTION]['rsa_key_bits']
 
 # RSA(.) denotes RSA encryption with the specified public key
 # DES(.) means DES encryption with the specified DES key
 # Sign(.) is RSA signature generation with the specified private key
 
 
-def receiveThread(server):
-    old_tb = None
-    exit_instruction = f'Type "{SENTINEL}" to exit: '
-    print(end=exit_instruction, flush=True)
-    # loop indefinitely
-    while True:
+class KeyPairPool:
+    '''
+    A pool of ready RSA key pairs, refilled by a background thread, so
+    registrations do not wait for key selection.
+    '''
+
+    # seconds between checks for close while the pool is full
+    STOP_POLL_INTERVAL = 0.1
+
+    def __init__(self, size: int, key_bits: int=None):
+        '''
+        Creates the pool and starts refilling it.
+        @param size: int = number of key pairs to keep ready
+        @param key_bits: int = size of the moduli, or None for legacy
+                keys from rsa.selectKey
+        '''
+        self.size = size
+        self.key_bits = key_bits
+        self.pairs = Queue(maxsize=size)
+        # count the key pairs generated and taken for the metrics
+        self.lock = Lock()
+        self.n_generated = 0
+        self.n_taken = 0
+        # number taken while the pool was empty
+        self.n_misses = 0
+        # time spent generating, for the refill rate
+        self.refill_time = 0.0
+        # set by close to stop refilling
+        self.stopped = Event()
+        self.refill_thread = Thread(target=self.refill_forever, daemon=True)
+        self.refill_thread.start()
+
+    @staticmethod
+    def generate(key_bits: int=None) -> 'tuple[tuple, tuple, str, str]':
+        '''
+        Selects a key pair and converts it to strings for the
+        certificate.
+        @param key_bits: int = size of the modulus, or None for a legacy
+                key from rsa.selectKey
+        @return (PKs, SKs, PKs_str, SKs_str)
+        '''
+        if (key_bits is None):
+            PKs, SKs = rsa.split_key_pair(rsa.selectKey())
+        else:
+            PKs, SKs = rsa.generate_key_pair(key_bits)
+        return (PKs, SKs, rsa.key2str(PKs), rsa.key2str(SKs))
+
+    def refill_forever(self):
+        '''
+        Keeps the pool full, blocking while it is, until closed.
+        '''
+        while (not(self.stopped.is_set())):
+            start = time.perf_counter()
+            pair = KeyPairPool.generate(self.key_bits)
+            with self.lock:
+                self.n_generated += 1
+                self.refill_time += (time.perf_counter() - start)
+            # wait for room, checking now and then whether closed
+            while (not(self.stopped.is_set())):
+                try:
+                    self.pairs.put(pair, timeout=KeyPairPool.STOP_POLL_INTERVAL)
+                    break
+                except Full:
+                    pass
+            # end while (not(self.stopped.is_set()))
+        # end while (not(self.stopped.is_set()))
+
+    def close(self):
+        '''
+        Stops refilling, and waits for the key pair being generated, if
+        any.  Key pairs already in the pool can still be taken.
+        '''
+        self.stopped.set()
+        self.refill_thread.join()
+
+    def take(self) -> 'tuple[tuple, tuple, str, str]':
+        '''
+        Takes a ready key pair, or generates one if the pool is empty.
+        @return (PKs, SKs, PKs_str, SKs_str)
+        '''
         try:
-            print()
-            print()
-            # (a) application server registration to obtain its public/private
-            DES_tmpl, ID_s = receive_certificate_registration(server)
-            send_certificate(server, DES_tmpl, ID_s)
-
-            # repeat the exit instruction
-            print(end=exit_instruction, flush=True)
-            # accept next connection
-            server.acceptNextConnection()
-        except Exception as e:
-            tb = traceback.format_exc()
-            # don't repeat the trackback
-            if (tb != old_tb):
-                print(file=stderr)
-                logging.error(tb)
-            old_tb = tb
-            print(end=exit_instruction, flush=True)
-    # end while True
+            pair = self.pairs.get_nowait()
+        except Empty:
+            pair = KeyPairPool.generate(self.key_bits)
+            with self.lock:
+                self.n_misses += 1
+        with self.lock:
+            self.n_taken += 1
+        return pair
+
+    def metrics(self) -> 'dict[str, float]':
+        '''
+        @return the pool depth, refill rate in key pairs per second while
+            refilling, and the counts of key pairs generated, taken and
+            missed
+        '''
+        return { 'depth': self.pairs.qsize(), 'size': self.size,
+            'refill_per_second': (self.n_generated / self.refill_time if (self.refill_time) else 0.0),
+            'generated': self.n_generated, 'taken': self.n_taken,
+            'misses': self.n_misses }
+# end class KeyPairPool
+
+
+def serveRegistration(server, key_pool):
+    # (a) application server registration to obtain its public/private
+    DES_tmpl, ID_s = receive_certificate_registration(server)
+    send_certificate(server, DES_tmpl, ID_s, key_pool)
+    logging.info(f'key pool: {key_pool.metrics()}')
 
 
 def respondCertification(node_data, server_data):
@@ -64,9 +153,15 @@ def respondCertification(node_data, server_data):
     # create the Certificate Authority server
     AD_ca = f'{server_data.addr}:{server_data.port}'
     logging.info(f'{node_data.connecting_status} {AD_ca} . . .')
-    server = Server(server_data.addr, server_data.port)
+    # start generating key pairs before any registration
+    key_pool = KeyPairPool(KEY_POOL_SIZE, RSA_KEY_BITS)
+    # serve each registration on the worker pool
+    server = PoolServer(server_data.addr, server_data.port,
+        (lambda client: serveRegistration(client, key_pool)),
+        MAX_WORKERS, BACKLOG)
 
-    start_new_thread(receiveThread, (server,))
+    print(end=f'Type "{SENTINEL}" to exit: ', flush=True)
+    start_new_thread(server.serve_forever, ())
 
     while True:
         # TODO: your code here
@@ -76,8 +171,9 @@ def respondCertification(node_data, server_data):
         if msg_string == SENTINEL:
             break
 
-    # close the node
+    # close the node, and stop generating key pairs
     server.close()
+    key_pool.close()
 
 
 def receive_certificate_registration(server):
@@ -86,7 +182,7 @@ def receive_certificate_registration(server):
     cipher_msg = run_node.recv_blocking(server).decode(KEY_CHARSET)
     print(f'(a1) CA Received: {cipher_msg}')
     # decode the registration
-    plain_msg = rsa.decode(*SKca, cipher_msg)
+    plain_msg = rsa.decrypt(SKca, cipher_msg)
     # split it into its fields
     K_tmpl_str, ID_s, TS1 = plain_msg.split('||')
     # encode the key, and create its DES object
@@ -97,17 +193,14 @@ def receive_certificate_registration(server):
     return (DES_tmpl, ID_s)
 
 
-def send_certificate(server, DES_tmpl, ID_s):
+def send_certificate(server, DES_tmpl, ID_s, key_pool):
     # (2Tx) CA -> S:    DES[K_tmpl][PKs||SKs||Cert_s||ID_s||TS2] s.t.
     #       Cert_s = Sign[SKca][ID_s||ID_ca||PKs]
-    # select a key for Application server AS
-    key_s = rsa.selectKey()
-    PKs, SKs = rsa.split_key_pair(key_s)
-    # convert to strings
-    PKs_str, SKs_str = (rsa.key2str(k) for k in (PKs, SKs))
+    # take a ready key for Application server AS, already as strings
+    PKs, SKs, PKs_str, SKs_str = key_pool.take()
     # create the certificate Cert_s
     Cert_s_plain = f'{ID_s}||{ID_pki}||{PKs_str}'
-    Cert_s_cipher = rsa.encode(*SKca, Cert_s_plain)
+    Cert_s_cipher = rsa.sign_message(SKca, Cert_s_plain)
     # get a time stamp
     TS2 = time.time()
     # concatenate the message
@@ -1,15 +1,19 @@
 
 # standard libraries
+import asyncio
+import itertools
 import logging
+import time
 from sys import stderr
 from os import urandom
 
 # local library crypto
 import run_node
 from run_node import servers_config_data, nodes_config_data, config, KEY_CHARSET
-from crypto import KeyManager, DES
-from server import Server
-from ticket import receive_ticket
+from crypto import KeyManager, DES, CharacterEncoder
+from hmac import SimpleHmacEncoder, UnexpectedMac
+from async_node import AsyncServer, offload
+from ticket import parse_ticket, check_authenticator, ReplayedAuthenticator, TICKET_EXPIRED
 from AS_TGS_server import DES_KEY_SIZE
 
 # ID for this node
@@ -21,37 +25,218 @@ SECTION = 'V_server'
 SERVER = servers_config_data[SECTION]
 # load node data
 NODE = nodes_config_data[SECTION]
+# load the maximum number of sessions held at once
+MAX_SESSIONS = config[SECTION]['max_sessions']
 
 
 def main(node_data, server_data):
     # configure the logger
     logging.basicConfig(level=logging.INFO)
-    # create a node
-    logging.info(f'{node_data.connecting_status} {server_data.addr}:{server_data.port} . . .')
-    server = Server(server_data.addr, server_data.port)
+    # serve sessions until SENTINEL is input
+    asyncio.run(serve_sessions(node_data, server_data))
+# end def main(node_data, server_data)
 
+
+async def serve_sessions(node_data, server_data):
     # read the key and create DES for TGS/V
-    DES_v = DES(KeyManager.read_key(config['kerberos_keys']['Kv_file']))
-
-    # (c) client/server authentication exchange to obtain service
-    # check for service-granting ticket request with valid ticket
-    print('(c5) V acting . . .')
-    service_request = receive_ticket(server, server_data.charset, DES_v)
-    if (not(service_request)):
-        return
-    # split the service request
-    # there is no next server.  no need for ID_c
-    _, Authenticator_c, DES_c_v, _ = service_request
-    # get the timestamp and send it to client for authentication
-    TS5 = parse_authenticator(DES_c_v, Authenticator_c)
-    send_service(server, DES_c_v, TS5)
-
-    # encrypt and send user input, decrypt messages received
-    # use DES_c_v as the DES encrypter, not enc_key
-    run_node.run_node(server, DES_c_v, server_data.charset, node_data.prompt)
-    # close the node
-    server.close()
-# end def main(node_data, server_data)
+    DES_v = DES.for_key(KeyManager.read_key(config['kerberos_keys']['Kv_file']))
+    # create the HMAC encoder for the sessions
+    mac_key = KeyManager.read_key(run_node.MAC_FILE)
+    encoder = SimpleHmacEncoder(CharacterEncoder(server_data.charset), mac_key, run_node.HMAC_MODE)
+    manager = SessionManager(server_data.charset, DES_v, encoder, MAX_SESSIONS)
+
+    # create the server
+    logging.info(f'{node_data.connecting_status} {server_data.addr}:{server_data.port} . . .')
+    server = AsyncServer(server_data.addr, server_data.port, manager.serve,
+        backlog=MAX_SESSIONS)
+    await server.start()
+
+    # encrypt and send user input to every session
+    while True:
+        msg_string = await offload(input, node_data.prompt)
+        if (msg_string == run_node.SENTINEL):
+            break
+        await manager.broadcast(msg_string)
+    # end while True
+
+    logging.info(f'sessions: {manager.stats()}')
+    # close the server
+    await server.close()
+# end def serve_sessions(node_data, server_data)
+
+
+class Session:
+    '''
+    An authenticated client session, and its counters.
+    Slotted, since the manager may hold many idle sessions.
+    '''
+
+    __slots__ = ('session_id', 'node', 'ID_c', 'DES_c_v', 'encoder',
+        'start_time', 'last_active', 'n_received', 'n_sent',
+        'bytes_received', 'bytes_sent', 'n_bad_macs')
+
+    def __init__(self, session_id: int, node, ID_c: str, DES_c_v: DES, encoder: SimpleHmacEncoder):
+        '''
+        Initializes a session authenticated by its ticket.
+        @param session_id: int = unique number of the session
+        @param node: AsyncNode = connection to the client
+        @param ID_c: str = ID of the client in the ticket
+        @param DES_c_v: DES = cipher for the key shared with the client
+        @param encoder: SimpleHmacEncoder = MAC encoder for messages
+        '''
+        self.session_id = session_id
+        self.node = node
+        self.ID_c = ID_c
+        self.DES_c_v = DES_c_v
+        self.encoder = encoder
+        self.start_time = self.last_active = time.time()
+        self.n_received = self.n_sent = 0
+        self.bytes_received = self.bytes_sent = 0
+        self.n_bad_macs = 0
+
+    async def send(self, msg_string: str):
+        '''
+        Encrypts and sends a message to the client.
+        '''
+        cyp_bytes = self.DES_c_v.encrypt_into(msg_string, encode=self.encoder.encode)
+        await self.node.send(cyp_bytes)
+        self.n_sent += 1
+        self.bytes_sent += len(cyp_bytes)
+        self.last_active = time.time()
+
+    def stats(self) -> dict:
+        '''
+        @return the counters of this session
+        '''
+        return { 'ID_c': self.ID_c, 'addr': self.node.addr,
+            'age': (time.time() - self.start_time),
+            'idle': (time.time() - self.last_active),
+            'received': self.n_received, 'sent': self.n_sent,
+            'bytes_received': self.bytes_received,
+            'bytes_sent': self.bytes_sent, 'bad_macs': self.n_bad_macs }
+# end class Session
+
+
+class SessionManager:
+    '''
+    Authenticates clients by their service-granting tickets, and holds
+    their sessions, each with its own receive loop on the event loop.
+    '''
+
+    def __init__(self, charset: str, DES_v: DES, encoder: SimpleHmacEncoder, max_sessions: int):
+        '''
+        Initializes an empty session manager.
+        @param charset: str = character set of ticket messages
+        @param DES_v: DES = cipher for the key shared with the TGS
+        @param encoder: SimpleHmacEncoder = MAC encoder for messages;
+            the MAC key is the same for all clients, so the sessions
+            share it
+        @param max_sessions: int = maximum number of sessions held
+        '''
+        self.charset = charset
+        self.DES_v = DES_v
+        self.encoder = encoder
+        self.max_sessions = max_sessions
+        # the sessions held, by session_id
+        self.sessions = {}
+        # number of slots taken by sessions and handshakes in progress
+        self.n_reserved = 0
+        self.session_ids = itertools.count()
+        # counters over all sessions
+        self.n_accepted = 0
+        self.n_rejected = 0
+
+    async def serve(self, node):
+        '''
+        Authenticates the client on node, then receives its messages
+        until it disconnects.
+        @param node: AsyncNode = connection to the client
+        '''
+        # turn away clients beyond the limit before any DES work,
+        # counting the handshakes still in progress
+        if (self.n_reserved >= self.max_sessions):
+            self.n_rejected += 1
+            return
+        self.n_reserved += 1
+        try:
+            session = await self.authenticate(node)
+            if (session is None):
+                self.n_rejected += 1
+                return
+            self.n_accepted += 1
+            self.sessions[session.session_id] = session
+            try:
+                await self.receive_loop(session)
+            finally:
+                del self.sessions[session.session_id]
+        finally:
+            self.n_reserved -= 1
+
+    async def authenticate(self, node) -> 'Session':
+        '''
+        (c) client/server authentication exchange to obtain service
+        @return the new session, or None if the ticket has expired, the
+            authenticator is replayed, the request is malformed, or the
+            client disconnected first
+        '''
+        try:
+            # check for service-granting ticket request with valid ticket
+            msg_bytes = await node.recv_blocking()
+            # there is no next server.  no need for ID_c from the ticket
+            _, Authenticator_c, DES_c_v, ID_c, Ticket_validity = await offload(
+                parse_ticket, msg_bytes, self.charset, self.DES_v)
+            # filter out any expired ticket
+            if (not(Ticket_validity)):
+                await node.send(DES_c_v.encrypt(TICKET_EXPIRED))
+                return None
+            # get the timestamp and send it to client for authentication
+            TS5 = await offload(parse_authenticator, DES_c_v, Authenticator_c)
+        except (ReplayedAuthenticator, ValueError, IndexError, ConnectionError) as e:
+            # ValueError includes UnicodeDecodeError, from garbage
+            logging.warning(e)
+            return None
+        await node.send(service_message(DES_c_v, TS5))
+        return Session(next(self.session_ids), node, ID_c, DES_c_v, self.encoder)
+
+    async def receive_loop(self, session: Session):
+        '''
+        Decrypts and prints each message received in the session.
+        '''
+        while True:
+            msg_bytes = await session.node.recv()
+            # if no message, the client disconnected
+            if (msg_bytes is None):
+                return
+            session.n_received += 1
+            session.bytes_received += len(msg_bytes)
+            session.last_active = time.time()
+            try:
+                dec_string = await offload(session.DES_c_v.decrypt,
+                    msg_bytes, session.encoder.decode)
+            except UnexpectedMac as e:
+                session.n_bad_macs += 1
+                logging.warning(f'session {session.session_id}: {e}')
+                continue
+            print(f'[{session.session_id}] {session.ID_c}: {dec_string}')
+        # end while True
+
+    async def broadcast(self, msg_string: str):
+        '''
+        Sends a message to every session.
+        '''
+        sessions = tuple(self.sessions.values())
+        await asyncio.gather(*(session.send(msg_string) for session in sessions),
+            return_exceptions=True)
+
+    def stats(self) -> dict:
+        '''
+        @return the counters over all sessions, and of each session
+        '''
+        return { 'active': len(self.sessions), 'accepted': self.n_accepted,
+            'rejected': self.n_rejected,
+            'sessions': { session_id: session.stats()
+                for session_id, session in self.sessions.items() } }
+# end class SessionManager
 
 
 def receive_service_request(server, charset, DES_v):
@@ -74,9 +259,9 @@ def receive_service_request(server, charset, DES_v):
     plain_Ticket_v = DES_v.decrypt(cipher_Ticket_v_byts)
     # split the ticket
     K_c_v, ID_c, AD_c, ID_v, TS4_str, Lifetime4_str = plain_Ticket_v.split('||')
-    # create DES for K_c_v
+    # create the session cipher for K_c_v
     # (may be used to encrypt the result of validation)
-    DES_c_v = DES(K_c_v.encode(KEY_CHARSET))
+    DES_c_v = run_node.SessionCipher.for_key(K_c_v.encode(KEY_CHARSET))
 
     # parse timestamps
     TS4, Lifetime4 = (float(ts.rstrip('\0')) for ts in (TS4_str, Lifetime4_str))
@@ -97,30 +282,25 @@ def receive_service_request(server, charset, DES_v):
 
 
 def parse_authenticator(DES_c_v, Authenticator_c):
-    # decrypt Authenticator_c
-    # 1st encode Authenticator_c to the key charset
-    # this includes 0 bytes
-    cipher_Authenticator_c_byts_untrim = Authenticator_c.encode(KEY_CHARSET)
-    # trim last 0 bytes
-    cipher_Authenticator_c_byts = bytes.rstrip(cipher_Authenticator_c_byts_untrim, b'\x00')
-    # decrypt Authenticator_c
-    plain_Authenticator_c = DES_c_v.decrypt(cipher_Authenticator_c_byts)
-    # split Authenticator_c
-    ID_c, AD_c, TS5_str = plain_Authenticator_c.split('||')
-    # parse the timestamp TS5
-    TS5 = float(TS5_str.rstrip('\0'))
+    # decrypt Authenticator_c, refusing any replay
+    ID_c, AD_c, TS5 = check_authenticator(DES_c_v, Authenticator_c)
     return TS5
 # end def parse_authenticator(DES_c_v, Authenticator_c)
 
 
 def send_service(server, DES_c_v, TS5):
     # send a message for successful authentication
-    plain_success = f'{TS5 + 1}'
-    cipher_success = DES_c_v.encrypt(plain_success)
-    server.send(cipher_success)
+    server.send(service_message(DES_c_v, TS5))
 # end def send_service(server, DES_c_v, TS5)
 
 
+def service_message(DES_c_v, TS5):
+    # the message for successful authentication
+    plain_success = f'{TS5 + 1}'
+    return DES_c_v.encrypt(plain_success)
+# end def service_message(DES_c_v, TS5)
+
+
 # run the server until SENTINEL is given
 if __name__ == '__main__':
     main(NODE, SERVER)
@@ -0,0 +1,223 @@
+# standard libraries
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+# local library node
+from node import Node, check_frame_len
+
+# executor for blocking and CPU-bound work (DES, RSA, input)
+# (None until first use)
+executor = None
+# guards creating the executor
+executor_lock = Lock()
+# number of executor threads (None for the default)
+EXECUTOR_WORKERS = None
+
+
+async def offload(func: 'Callable', *args):
+    '''
+    Runs func(*args) in the executor, so the event loop keeps serving
+    other connections meanwhile.
+
+    The executor is a thread pool, since the work offloaded updates
+    state shared with the loop (the ticket and replay caches), which a
+    process pool would not see.  For blocking I/O it frees the loop
+    entirely.  Pure-Python DES and RSA hold the GIL, so they still
+    share one CPU with the loop: the loop gets the GIL back at each
+    switch interval (sys.getswitchinterval(), 5 ms), so it is slowed
+    but never stalled by a long handshake.  CPU parallelism comes from
+    the process pools of crypto and rsa, which large messages use
+    (DES.PARALLEL_MIN_BYTES, rsa.PARALLEL_MIN_BLOCKS).
+    @return the result of func(*args)
+    '''
+    global executor
+    if (executor is None):
+        with executor_lock:
+            if (executor is None):
+                executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, func, *args)
+
+
+class AsyncNode:
+    '''
+    A simple asyncio stream node, with the same send/recv semantics and
+    message framing as node.Node.
+    '''
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, buffer_size=1024):
+        '''
+        Initializes the node on a connected stream.
+        @param reader: asyncio.StreamReader = the incoming stream
+        @param writer: asyncio.StreamWriter = the outgoing stream
+        @param buffer_size: int = default buffer size for receiving
+                messages
+        '''
+        self.reader = reader
+        self.writer = writer
+        self.buffer_size = buffer_size
+        # address of the peer, as (host, port)
+        self.addr = writer.get_extra_info('peername')
+
+    async def send(self, msg_bytes: bytes):
+        '''
+        Sends the message given by `msg_bytes` through the stream as
+        one frame.
+        @param msg_bytes: bytes = message to send
+        @raise FrameTooLarge if it is longer than Node.MAX_FRAME
+        '''
+        check_frame_len(len(msg_bytes))
+        self.writer.write(b''.join((Node.HEADER.pack(len(msg_bytes)), msg_bytes)))
+        # wait for room in the buffer if the peer is slow
+        await self.writer.drain()
+
+    async def recv(self, buffer_size=None) -> bytes:
+        '''
+        Receives the next message from the stream.
+        @param buffer_size: int? = unused, kept for node.Node
+                compatibility (the stream reader buffers itself)
+        @return the message received (possibly empty), or None at the
+                end of stream
+        @raise FrameTooLarge if the peer announces a message longer
+                than Node.MAX_FRAME
+        '''
+        try:
+            header = await self.reader.readexactly(Node.HEADER.size)
+        except asyncio.IncompleteReadError as e:
+            # no header at all means a clean end of stream
+            if (not(e.partial)):
+                return None
+            raise ConnectionResetError('connection closed mid-message') from e
+        msg_len, = Node.HEADER.unpack(header)
+        check_frame_len(msg_len)
+        try:
+            return await self.reader.readexactly(msg_len)
+        except asyncio.IncompleteReadError as e:
+            raise ConnectionResetError('connection closed mid-message') from e
+
+    async def recv_blocking(self) -> bytes:
+        '''
+        Receives the next message, like run_node.recv_blocking.
+        @raise ConnectionResetError if the stream ends first
+        '''
+        msg_bytes = await self.recv()
+        if (msg_bytes is None):
+            raise ConnectionResetError(f'connection closed by {self.addr}')
+        return msg_bytes
+
+    async def close(self):
+        '''
+        Closes the stream.
+        '''
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    def abort(self):
+        '''
+        Drops the connection at once, discarding any unsent data.  A
+        pending recv then returns None, as at EOF.
+        '''
+        self.writer.transport.abort()
+# end class AsyncNode
+
+
+class AsyncServer:
+    '''
+    A simple asyncio socket server.  Unlike server.Server, it accepts
+    connections continuously, serving each with its own coroutine on
+    one event loop.
+    '''
+
+    # the maximum number of pending connections
+    BACKLOG = 1024
+
+    def __init__(self, addr: str, port: int, handler: 'Callable[[AsyncNode], Awaitable]', buffer_size=1024, backlog=None):
+        '''
+        Allocates space for the server.  Call start to listen.
+        @param addr: str = address whereat to listen (without port)
+        @param port: int = port of address whereat to listen
+        @param handler = coroutine function called with the AsyncNode
+                of each connection; the node is closed after it returns
+        @param buffer_size: int = default buffer size for receiving
+                messages
+        @param backlog: int = maximum number of pending connections
+        '''
+        self.addr = addr
+        self.port = port
+        self.handler = handler
+        self.buffer_size = buffer_size
+        self.backlog = (AsyncServer.BACKLOG if (backlog is None) else backlog)
+        self.server = None
+        # number of connections currently being served, and their nodes
+        self.n_active = 0
+        self.nodes = set()
+
+    async def start(self):
+        '''
+        Starts listening.  If port is 0, the port chosen by the system
+        is stored in self.port.
+        '''
+        self.server = await asyncio.start_server(self.serve_connection,
+            self.addr, self.port, backlog=self.backlog)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        '''
+        Serves one connection with the handler.
+        '''
+        node = AsyncNode(reader, writer, self.buffer_size)
+        self.n_active += 1
+        self.nodes.add(node)
+        try:
+            await self.handler(node)
+        finally:
+            self.n_active -= 1
+            self.nodes.discard(node)
+            await node.close()
+
+    async def serve_forever(self):
+        '''
+        Starts listening if needed, and serves until cancelled.
+        '''
+        if (self.server is None):
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        '''
+        Stops listening, drops the connections still being served, and
+        waits for their handlers to return.
+        '''
+        if (self.server is not None):
+            self.server.close()
+            # since Python 3.12.1, wait_closed also waits for every
+            # connection, so end them rather than wait for the clients
+            for node in tuple(self.nodes):
+                node.abort()
+            await self.server.wait_closed()
+# end class AsyncServer
+
+
+class AsyncClient(AsyncNode):
+    '''
+    A simple asyncio socket client.
+    '''
+
+    @staticmethod
+    async def connect(addr: str, port: int, buffer_size=1024) -> 'AsyncClient':
+        '''
+        Connects to the given address and port.
+        @param addr: str = address whereto to connect (without port)
+        @param port: int = port of address whereto to connect
+        @param buffer_size: int = default buffer size for receiving
+                messages
+        @return the connected client
+        '''
+        reader, writer = await asyncio.open_connection(addr, port)
+        return AsyncClient(reader, writer, buffer_size)
+# end class AsyncClient
@@ -0,0 +1,443 @@
+'''
+Microbenchmarks for the crypto primitives.
+
+Each benchmark times the current implementation against the original
+one it replaced, and prints the speedup.
+Run with: python bench.py
+'''
+
+# standard libraries
+import contextlib
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from os import urandom
+from timeit import repeat
+
+# local library crypto
+import crypto
+import rsa
+
+# number of repeats per timing; the best is kept
+N_REPEATS = 3
+
+
+def best_time(func, *args, number=1) -> float:
+    '''
+    Times func(*args), keeping the best of N_REPEATS runs.
+    @return seconds per call
+    '''
+    return (min(repeat(lambda: func(*args), number=number, repeat=N_REPEATS)) / number)
+
+def report(name: str, legacy_time: float, current_time: float):
+    print(f'{name}: legacy {legacy_time:.3g} s, current {current_time:.3g} s,'
+        f' speedup {(legacy_time / current_time):.1f}x')
+
+
+#######################################################################
+# byte/bit conversion
+#######################################################################
+
+def legacy_bitize(byts: bytes) -> 'list[int]':
+    # the original nested loop
+    bits = []
+    for byt in byts:
+        for i in range(8,0,-1):
+            shift = (byt >> (i - 1))
+            bits.append(shift & 1)
+    return bits
+
+def legacy_debitize(bits: 'list[int]') -> bytes:
+    # the original exponentiation per bit
+    quo, rem = divmod(len(bits), 8)
+    if rem != 0:
+        raise ValueError('bits length is not a multiple of 8')
+    byts = [sum(b*2**(7-i) for (i, b) in enumerate(bits[8*k : 8*(k+1)])) for k in range(0, quo)]
+    return bytes(byts)
+
+def bench_bit_conversion(n_bytes: int=(1 << 20)):
+    byts = urandom(n_bytes)
+    bits = crypto.bitize(byts)
+    assert (bits == legacy_bitize(byts))
+    assert (crypto.debitize(bits) == legacy_debitize(bits) == byts)
+    print(f'# byte/bit conversion of {n_bytes} bytes')
+    legacy_time = best_time(legacy_bitize, byts)
+    report('bitize', legacy_time, best_time(crypto.bitize, byts))
+    # building a list of one int per bit is a floor for any bitize
+    floor_time = best_time(list, bytes(bits))
+    print(f'bitize: building the result list alone takes {floor_time:.3g} s,'
+        f' bounding the speedup at {(legacy_time / floor_time):.1f}x')
+    report('debitize', best_time(legacy_debitize, bits), best_time(crypto.debitize, bits))
+    report('bit2hex', best_time(lambda b: legacy_debitize(b).hex(), bits), best_time(crypto.bit2hex, bits))
+    # a single DES block
+    block = byts[:8]
+    block_bits = bits[:64]
+    report('bitize (8 bytes)', best_time(legacy_bitize, block, number=10000),
+        best_time(crypto.bitize, block, number=10000))
+    report('debitize (64 bits)', best_time(legacy_debitize, block_bits, number=10000),
+        best_time(crypto.debitize, block_bits, number=10000))
+    print()
+
+
+#######################################################################
+# DES round function
+#######################################################################
+
+def bench_f(n_rounds: int=10000):
+    round_keys = crypto.DES.key_generation(crypto.bitize(urandom(8)))
+    R = crypto.bitize(urandom(4))
+    key = round_keys[0]
+    assert (crypto.DES.f_sp(R, key) == crypto.DES.f(R, key))
+    print(f'# DES f per round, over {n_rounds} rounds')
+    report('f (sbox -> sp)', best_time(crypto.DES.f, R, key, number=n_rounds),
+        best_time(crypto.DES.f_sp, R, key, number=n_rounds))
+    print()
+
+
+#######################################################################
+# alphabetic encoding
+#######################################################################
+
+def bench_alpha(n_bytes: int=(1 << 16)):
+    messages = {
+        'text': (b'The quick brown fox jumps over the lazy dog. ZQ HELLO World! ' * (n_bytes // 62)),
+        'random': urandom(n_bytes),
+    }
+    # build the tables before timing
+    rsa.to_alpha.decode_alpha(rsa.to_alpha.encode_alpha(b'.'))
+    print(f'# alphabetic encoding of {n_bytes} bytes')
+    for name, msg in messages.items():
+        alpha = rsa.to_alpha.encode_alpha(msg)
+        assert (alpha == bytes(rsa.to_alpha.ords2alpha(msg)))
+        assert (rsa.to_alpha.decode_alpha(alpha) == rsa.ords2str(rsa.to_alpha.alpha2ords(alpha)))
+        report(f'encode ({name})', best_time(lambda: bytes(rsa.to_alpha.ords2alpha(msg))),
+            best_time(rsa.to_alpha.encode_alpha, msg))
+        report(f'decode ({name})', best_time(lambda: rsa.ords2str(rsa.to_alpha.alpha2ords(alpha))),
+            best_time(rsa.to_alpha.decode_alpha, alpha))
+    print()
+
+
+#######################################################################
+# RSA codec
+#######################################################################
+
+def legacy_rsa_encode(n: int, e: int, msg: str) -> str:
+    # the original block by block generator pipeline
+    alpha_msg = tuple(rsa.to_alpha.ords2alpha(rsa.str2ords(msg)))
+    pad_alpha_msg = rsa.pad_block_msg(alpha_msg)
+    outgraphs_acc = []
+    for msg_block in rsa.splitModIndex(pad_alpha_msg, (rsa.BLOCK_SIZE*rsa.INGRAPH_LEN)):
+        outgraphs = rsa.codec_block(n, e, msg_block, rsa.INGRAPH_LEN, rsa.OUTGRAPH_LEN)
+        outgraphs_acc.extend(rsa.ords2str(outgraphs))
+    return ''.join(outgraphs_acc)
+
+def legacy_rsa_decode(n: int, d: int, msg: str) -> str:
+    outgraphs = tuple(rsa.codec_block(n, d, rsa.str2ords(msg), rsa.OUTGRAPH_LEN, rsa.INGRAPH_LEN))
+    try:
+        outgraphs = outgraphs[:rsa.tupleindex(outgraphs, rsa.PAD_PREFIX)]
+    except ValueError:
+        pass
+    return rsa.ords2str(rsa.to_alpha.alpha2ords(outgraphs))
+
+def bench_rsa(number: int=200):
+    n, e, d = rsa.selectKey()
+    PKs_str = rsa.key2str((n, e))
+    messages = {
+        'certificate': f'ID-Server||ID-CA||{PKs_str}',
+        'registration': f'{urandom(8).decode("Latin-1")}||ID-Client||127.0.0.1||5000||1700000000.123456',
+        '1 KiB': urandom(1024).decode('Latin-1'),
+        '64 KiB': urandom(1 << 16).decode('Latin-1'),
+        # character# 256 before a letter is the ending sequence, so
+        # decoding stops there
+        '64 KiB, ending early': (f'ID{chr(256)}X' + urandom(1 << 16).decode('Latin-1')),
+    }
+    print(f'# RSA codec, n = {n}')
+    for name, msg in messages.items():
+        # as many calls for each message as for 1 KiB messages
+        n_calls = max(1, ((number * 1024) // len(msg)) if (len(msg) > 1024) else number)
+        ciphertext = rsa.encode(n, e, msg)
+        assert (ciphertext == legacy_rsa_encode(n, e, msg))
+        assert (rsa.decode(n, d, ciphertext) == legacy_rsa_decode(n, d, ciphertext))
+        report(f'encode ({name})', best_time(legacy_rsa_encode, n, e, msg, number=n_calls),
+            best_time(rsa.encode, n, e, msg, number=n_calls))
+        report(f'decode ({name})', best_time(legacy_rsa_decode, n, d, ciphertext, number=n_calls),
+            best_time(rsa.decode, n, d, ciphertext, number=n_calls))
+    print()
+
+def bench_rsa_keys(key_bits: 'tuple[int]'=(1024, 2048, 3072), number: int=20):
+    print('# RSA private-key operations, plain exponent -> CRT')
+    for bits in key_bits:
+        start = time.perf_counter()
+        PK, SK = rsa.generate_key_pair(bits)
+        generate_time = (time.perf_counter() - start)
+        plain_SK = rsa.RsaKey(SK.n, SK.k)
+        ciphertext = rsa.encrypt(PK, urandom(8).decode('Latin-1'))
+        assert (rsa.decrypt(SK, ciphertext) == rsa.decrypt(plain_SK, ciphertext))
+        print(f'{bits} bit key pair generated in {generate_time:.3g} s')
+        report(f'decrypt ({bits} bits)', best_time(rsa.decrypt, plain_SK, ciphertext, number=number),
+            best_time(rsa.decrypt, SK, ciphertext, number=number))
+    print()
+
+
+def bench_rsa_parallel(key_bits: int=2048, n_blocks: int=64):
+    print(f'# RSA over the process pool, on {os.cpu_count()} CPUs')
+    PK, SK = rsa.generate_key_pair(key_bits)
+    byts = urandom(n_blocks * rsa.block_sizes(SK.n)[0])
+    serial = best_time(rsa.encode_bytes, SK, byts)
+    rsa.PARALLEL_MIN_BLOCKS = 8
+    # start the workers before timing
+    rsa.encode_bytes(SK, byts)
+    parallel = best_time(rsa.encode_bytes, SK, byts)
+    rsa.PARALLEL_MIN_BLOCKS = None
+    rsa.shutdown_pool()
+    report(f'sign {n_blocks} blocks ({key_bits} bits), serial -> parallel', serial, parallel)
+    print()
+
+
+
+#######################################################################
+# certificate verification
+#######################################################################
+
+def bench_certificate_cache(key_bits: int=2048, number: int=200):
+    import C_client
+    PKca, SKca = rsa.generate_key_pair(key_bits)
+    PKs, SKs = rsa.generate_key_pair(key_bits)
+    Cert_s = rsa.sign_message(SKca, f'{C_client.ID_s}||ID-CA||{rsa.key2str(PKs)}')
+    # in memory only, so the timing excludes saving
+    cache = C_client.CertificateCache(256)
+    def verify_uncached():
+        cache.clear()
+        return C_client.verify_certificate(Cert_s, PKca, cache)
+    print(f'# certificate verification, {key_bits} bit keys')
+    report('verify, uncached -> cached', best_time(verify_uncached, number=number),
+        best_time(C_client.verify_certificate, Cert_s, PKca, cache, number=number))
+    print()
+
+
+def bench_session_resumption(key_bits: int=2048, number: int=20):
+    import AS_TGS_server
+    import C_client
+    import run_node
+    from client import Client
+    from server import PoolServer
+    PKs, SKs = rsa.generate_key_pair(key_bits)
+    Cert_s = rsa.sign_message(run_node.SKca, f'{C_client.ID_s}||ID-CA||{rsa.key2str(PKs)}')
+    sealer_res = AS_TGS_server.TicketSealer()
+    server = PoolServer('127.0.0.1', 0,
+        (lambda client: AS_TGS_server.register_client(client, PKs, SKs, Cert_s, sealer_res)),
+        1, 16)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # in memory only, so the timing excludes saving
+    C_client.certificate_cache = C_client.CertificateCache(256)
+    store = C_client.ResumptionStore()
+    def register():
+        # the registration alone, without the memo service
+        client = Client('127.0.0.1', server.port)
+        try:
+            if (C_client.resume_session(client, store) is None):
+                C_client.request_server_public_key_certificate(client)
+                PKs_rx, Cert_s_rx = C_client.send_public_key_certificate(client)
+                DES_tmp2 = C_client.send_registration_information(client, Cert_s_rx, PKs_rx)
+                C_client.receive_session_key(client, DES_tmp2, store)
+        finally:
+            client.close()
+    def handshake():
+        store.clear()
+        register()
+    print(f'# client registration, {key_bits} bit server key')
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        # verify the certificate once, as a returning client has
+        handshake()
+        handshake_time = best_time(handshake, number=number)
+        resumption_time = best_time(register, number=number)
+    report('full handshake -> resumption', handshake_time, resumption_time)
+    server.close()
+    print()
+
+
+#######################################################################
+# V_server sessions
+#######################################################################
+
+def session_request(DES_v, i: int, TS: float, Lifetime: float) -> 'tuple[crypto.DES, bytes]':
+    '''
+    Creates the Ticket_v||Authenticator_c of client i, with a key and
+    client ID whose ticket and authenticator avoid the separator.
+    @return (DES_c_v, request)
+    '''
+    for k in range(1000):
+        K_c_v = f'{(i % 10000):04d}{k:04d}'
+        DES_c_v = crypto.DES(K_c_v.encode())
+        # vary the ID too, since it fills a ticket block on its own
+        ID_c = f'client{i}-{k}'
+        TS_k = (TS - (k / 1024))
+        Ticket_v = DES_v.encrypt(f'{K_c_v}||{ID_c}||addr||V||{TS_k}||{Lifetime}').decode('Latin-1')
+        Authenticator_c = DES_c_v.encrypt(f'{ID_c}||addr||{TS_k}').decode('Latin-1')
+        if ('|' not in (Ticket_v + Authenticator_c)):
+            return (DES_c_v, f'{Ticket_v}||{Authenticator_c}'.encode())
+
+def hold_sessions(port: int, n_sessions: int, K_v: bytes, pipe):
+    '''
+    Opens n_sessions authenticated sessions to the V_server on port,
+    reports the number opened through pipe, and holds them until told
+    to close.  Runs in its own process, so the sockets of both ends do
+    not share one file descriptor limit.
+    '''
+    import asyncio
+    from async_node import AsyncClient
+    DES_v = crypto.DES(K_v)
+    requests = [session_request(DES_v, i, time.time(), 3600.0) for i in range(n_sessions)]
+    async def run():
+        # a few handshakes at a time, as clients would arrive
+        handshakes = asyncio.Semaphore(256)
+        async def session(DES_c_v, request):
+            async with handshakes:
+                client = await AsyncClient.connect('127.0.0.1', port)
+                await client.send(request)
+                if ((await client.recv()) is None):
+                    await client.close()
+                    return None
+            return client
+        clients = await asyncio.gather(*(session(*request) for request in requests))
+        clients = [client for client in clients if (client is not None)]
+        pipe.send(len(clients))
+        await asyncio.get_running_loop().run_in_executor(None, pipe.recv)
+        for client in clients:
+            await client.close()
+    asyncio.run(run())
+
+def rss() -> int:
+    '''
+    @return the resident set size of this process [in bytes] (Linux)
+    '''
+    with open('/proc/self/status') as f:
+        for line in f:
+            if (line.startswith('VmRSS:')):
+                return (int(line.split()[1]) << 10)
+
+def bench_sessions(n_sessions: int=10000):
+    import asyncio
+    import multiprocessing
+    from async_node import AsyncServer, offload
+    from hmac import SimpleHmacEncoder
+    from V_server import SessionManager
+    print(f'# V_server holding {n_sessions} concurrent sessions')
+    K_v = b'8bytekey'
+    encoder = SimpleHmacEncoder(crypto.CharacterEncoder(), b'mac key')
+    manager = SessionManager('utf-8', crypto.DES(K_v), encoder, n_sessions)
+    async def run():
+        server = AsyncServer('127.0.0.1', 0, manager.serve, backlog=n_sessions)
+        await server.start()
+        rss_before = rss()
+        # spawned, since a forked child would inherit the running loop
+        context = multiprocessing.get_context('spawn')
+        pipe, child_pipe = context.Pipe()
+        clients = context.Process(target=hold_sessions,
+            args=(server.port, n_sessions, K_v, child_pipe))
+        start = time.perf_counter()
+        clients.start()
+        # so the pipe reports the end if the child fails
+        child_pipe.close()
+        n_opened = await offload(pipe.recv)
+        elapsed = (time.perf_counter() - start)
+        stats = manager.stats()
+        rss_held = rss()
+        pipe.send('close')
+        await offload(clients.join)
+        await server.close()
+        return (n_opened, stats['active'], elapsed, (rss_held - rss_before))
+    logging.disable(logging.WARNING)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        n_opened, n_active, elapsed, rss_sessions = asyncio.run(run())
+    logging.disable(logging.NOTSET)
+    print(f'sessions: opened {n_opened}, held at once {n_active},'
+        f' in {elapsed:.3g} s including client setup,'
+        f' server memory {(rss_sessions / max(n_active, 1) / 1024):.3g} KiB per session')
+    print()
+
+
+#######################################################################
+# AS/TGS ticket exchanges
+#######################################################################
+
+def run_ticket_exchanges(n_clients: int, max_workers: int, backlog: int, latency: float) -> 'tuple[float, int]':
+    '''
+    Runs the Kerberos AS and TGS exchanges of n_clients concurrent
+    clients against a PoolServer.  Each client waits latency seconds
+    before each request, as a remote client would.
+    @return the completed ticket exchanges per second, the number that
+        failed on the server, and the errors raised on the clients
+    '''
+    import AS_TGS_server
+    import C_client
+    from client import Client
+    from crypto import KeyManager
+    from server import PoolServer
+    charset = AS_TGS_server.ASTGS.charset
+    DES_c = crypto.DES.for_key(KeyManager.read_key(AS_TGS_server.config['kerberos_keys']['Kc_file']))
+    DES_tgs, DES_v = AS_TGS_server.kerberos_keys()
+    AD_c = '127.0.0.1:0'
+    server = PoolServer('127.0.0.1', 0,
+        (lambda client: AS_TGS_server.kerberosCallback(client, charset, DES_c, DES_tgs, DES_v, AD_c)),
+        max_workers, backlog)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    errors = []
+    def exchange():
+        client = Client('127.0.0.1', server.port)
+        try:
+            time.sleep(latency)
+            C_client.request_ticket_granting_ticket(client, charset)
+            DES_c_tgs, Ticket_tgs = C_client.receive_ticket_granting_ticket(client, DES_c)
+            time.sleep(latency)
+            C_client.request_with_authenticator(client, charset, C_client.ID_v, Ticket_tgs, DES_c_tgs, AD_c)
+            C_client.receive_from_ticket(client, DES_c_tgs, C_client.ID_tgs)
+        except Exception as e:
+            # random keys containing the separator are not parsed by
+            # the protocol, so count the failures rather than stop
+            errors.append(e)
+        finally:
+            client.close()
+    clients = [threading.Thread(target=exchange) for k in range(n_clients)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    # wait for the server to count the last exchange
+    while (server.n_completed + server.n_failed < n_clients):
+        time.sleep(0.001)
+    throughput = server.throughput()
+    server.close()
+    return (throughput, server.n_failed, errors)
+
+def bench_ticket_exchanges(n_clients: int=50, latency: float=0.01):
+    print(f'# AS/TGS ticket exchanges of {n_clients} concurrent clients, {latency} s latency')
+    # silence the protocol output
+    logging.disable(logging.INFO)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        import AS_TGS_server
+        one_at_a_time, failed1, errors1 = run_ticket_exchanges(n_clients, 1, AS_TGS_server.BACKLOG, latency)
+        pooled, failedN, errorsN = run_ticket_exchanges(n_clients, AS_TGS_server.MAX_WORKERS, AS_TGS_server.BACKLOG, latency)
+    logging.disable(logging.NOTSET)
+    print(f'exchanges per second: one at a time {one_at_a_time:.3g},'
+        f' pooled {pooled:.3g}, speedup {(pooled / one_at_a_time):.1f}x')
+    errors = (errors1 + errorsN)
+    print(f'failed: {(failed1 + failedN)} on the server, {len(errors)} on the clients'
+        f' of {(2 * n_clients)}', dict(Counter(type(e).__name__ for e in errors)))
+    print()
+
+
+if __name__ == '__main__':
+    bench_bit_conversion()
+    bench_f()
+    bench_alpha()
+    bench_rsa()
+    bench_rsa_keys()
+    bench_rsa_parallel()
+    bench_certificate_cache()
+    bench_session_resumption()
+    bench_ticket_exchanges()
+    bench_sessions()
+# end if __name__ == '__main__'
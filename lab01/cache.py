@@ -0,0 +1,143 @@
+# standard libraries
+import time
+from collections import OrderedDict
+from threading import Lock
+
+class LruCache:
+    '''
+    A size-bounded least-recently-used cache that counts its hits and
+    misses.  Safe to share between threads.
+    '''
+
+    def __init__(self, maxsize: int):
+        '''
+        Initializes an empty cache.
+        @param maxsize: int = maximum number of entries to keep
+        '''
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, key, default=None):
+        '''
+        Finds the value stored for key, marking it as recently used.
+        @param key = to look up
+        @param default = returned on a miss
+        @return the value stored for key, or default
+        '''
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        '''
+        Stores value for key, evicting the least recently used entry
+        if the cache is full.
+        '''
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while (len(self.entries) > self.maxsize):
+                self.entries.popitem(last=False)
+
+    def get_or_create(self, key, create: 'Callable[[object], object]'):
+        '''
+        Finds the value stored for key, or creates it with create(key)
+        and stores it on a miss.
+        '''
+        value = self.get(key, LruCache.MISSING)
+        if (value is LruCache.MISSING):
+            value = create(key)
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        '''
+        Removes all entries and resets the counters.
+        '''
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> 'dict[str, int]':
+        '''
+        @return the hit and miss counters and current size
+        '''
+        return { 'hits': self.hits, 'misses': self.misses,
+            'size': len(self.entries), 'maxsize': self.maxsize }
+
+    def __len__(self):
+        return len(self.entries)
+
+    # sentinel for entries not found
+    MISSING = object()
+# end class LruCache
+
+
+class ExpiringLruCache(LruCache):
+    '''
+    A size-bounded least-recently-used cache whose entries also expire
+    at a time given when each is stored.
+    '''
+
+    def __init__(self, maxsize: int, clock: 'Callable[[], float]'=time.time):
+        '''
+        Initializes an empty cache.
+        @param maxsize: int = maximum number of entries to keep
+        @param clock = returns the current time, as for expiry times
+        '''
+        super().__init__(maxsize)
+        self.clock = clock
+        # number of entries found expired
+        self.expired = 0
+
+    def get(self, key, default=None):
+        '''
+        Finds the value stored for key if it has not expired, marking it
+        as recently used.  Expired entries are removed.
+        @param key = to look up
+        @param default = returned on a miss
+        @return the value stored for key, or default
+        '''
+        with self.lock:
+            try:
+                value, expires_at = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if (self.clock() >= expires_at):
+                del self.entries[key]
+                self.expired += 1
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, expires_at: float=float('inf')):
+        '''
+        Stores value for key until expires_at, evicting the least
+        recently used entry if the cache is full.
+        '''
+        super().put(key, (value, expires_at))
+
+    def clear(self):
+        with self.lock:
+            self.expired = 0
+        super().clear()
+
+    def stats(self) -> 'dict[str, int]':
+        '''
+        @return the hit, miss and expiry counters and current size
+        '''
+        return dict(super().stats(), expired=self.expired)
+# end class ExpiringLruCache
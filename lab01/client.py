@@ -36,7 +36,8 @@ class Client:
         '''
         Receives a message from the socket.
         @param buffer_size: int? = size of the receiving buffer
-        @return the message received
+        @return the message received, or None if the peer closed the
+                connection
         '''
         # delegate to the node
         msg_bytes = self.node.recv(buffer_size)
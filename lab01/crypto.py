@@ -1,8 +1,20 @@
 
-from copy import deepcopy
 import random
 from os import urandom
 from typing import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+from operator import itemgetter
+from threading import Lock
+
+# local library cache
+from cache import LruCache
+
+# NumPy is optional, and only used by the batch mode of DES
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 DEBUG_MODE = False
 
@@ -35,40 +47,49 @@ class KeyManager:
         return rand_bytes
 
 
+# byte to bits table: entry v is the 8 bits of v, most significant first
+BYTE_BITS = tuple(bytes(((v >> (7 - i)) & 1) for i in range(8)) for v in range(256))
+# inputs of at most this many bytes are bitized by table lookup
+BITIZE_TABLE_MAX = 64
+# translations between binary digits and bit values
+DIGITS2BITS = bytes.maketrans(b'01', b'\0\1')
+BITS2DIGITS = bytes.maketrans(b'\0\1', b'01')
+
 def bitize(byts: bytes) -> 'list[int]':
     """
     bitize bytes
+    byts may be any bytes-like object or iterable of byte values.
+    Long inputs are converted in C throughout, except for building the
+    resulting list, one int per bit, which takes most of the time and
+    so bounds the speedup over a bit-by-bit loop (see bench.py).
     """
-    bits = []
-
-    # TODO: your code here
+    if (not(isinstance(byts, (bytes, bytearray)))):
+        byts = bytes(byts)
 
-    # for each byt
-    for byt in byts:
-        # loop through the bits
-        for i in range(8,0,-1):
-            # pop off less significant bits
-            shift = (byt >> (i - 1))
-            # store the new least significant bit
-            bits.append(shift & 1)
-        # end for i in range(8,0,-1)
-    # end for byt in byts
+    # short inputs: look up the bits of each byte
+    if (len(byts) <= BITIZE_TABLE_MAX):
+        return list(b''.join([BYTE_BITS[byt] for byt in byts]))
 
-    return bits
+    # long inputs: pack into an integer and write it in binary, 0
+    # padded to the full width
+    digits = format(int.from_bytes(byts, 'big'), f'0{(len(byts) << 3)}b').encode()
+    return list(digits.translate(DIGITS2BITS))
 
 def debitize(bits: Iterable[int]) -> bytes:
     """
     debbitize a list of bits
+    bits may be any iterable, even without len().
     """
-    # TODO: your code here
-    quo, rem = divmod(len(bits), 8)
+    # one byte per bit, without needing len(bits) in advance
+    bit_bytes = bytes(bits)
+    quo, rem = divmod(len(bit_bytes), 8)
     if rem != 0:
         raise ValueError('bits length is not a multiple of 8')
+    if (0==quo):
+        return b''
 
-    byts = [sum(b*2**(7-i) for (i, b) in enumerate(bits[8*k : 8*(k+1)])) for k in range(0, quo)]
-
-    # make sure to return as bytes, rather than list[int]
-    return bytes(byts)
+    # read the bits as a binary integer, and write it as bytes
+    return int(bit_bytes.translate(BITS2DIGITS), 2).to_bytes(quo, 'big')
 
 def bit2hex(bits: Iterable[int]) -> str:
     """
@@ -85,6 +106,7 @@ def hex2bit(hex_str: str) -> list:
 def permute(raw_seq: Iterable, table: Iterable[int], n: int = None, m: int = None) -> list[int]:
     """
     permute bits with a table
+    Compatibility wrapper around the compiled Permutation for table.
     @param raw_seq: Iterable = block before permutation
     @param table: Iterable[int] =
         table of indices to use in permutation
@@ -104,7 +126,7 @@ def permute(raw_seq: Iterable, table: Iterable[int], n: int = None, m: int = Non
     if (DEBUG_MODE):
         print('expected length:', n)
         print('actual length:', len(sliced_seq))
-    permutation = [sliced_seq[k] for k in table]
+    permutation = Permutation.for_table(table).apply(sliced_seq)
     return permutation[:m]
 # end def permute(n: int, m: int, raw_seq: Iterable, table: Iterable[int])
 
@@ -162,6 +184,167 @@ def needed_padding(i: int, divisor=8):
     return ((-i) % divisor)
 # end def needed_padding(i: int, divisor=8)
 
+def bits2int(bits: 'list[int]') -> int:
+    '''
+    Packs a list of bits (whose length is a multiple of 8) into an
+    integer, most significant bit first.
+    '''
+    return int.from_bytes(debitize(bits), 'big')
+
+def int2bits(packed: int, n: int) -> 'list[int]':
+    '''
+    Unpacks the n-bit integer packed into a list of bits, most
+    significant bit first.
+    @param packed: int = the integer to unpack
+    @param n: int = number of bits (a multiple of 8)
+    '''
+    return bitize(packed.to_bytes((n >> 3), 'big'))
+
+def byte_permutation_tables(table: 'list[int]', n: int) -> 'tuple[tuple[int]]':
+    '''
+    Compiles a permutation table into byte-indexed lookup tables for
+    packed integers.
+    Entry [i][v] is the output mask contributed by the value v of
+    input byte #i (most significant byte first), so that the
+    permutation is the OR of one lookup per input byte.
+    @param table: list[int] = table of indices to use in permutation
+    @param n: int = size of input block (a multiple of 8)
+    @return `tuple[tuple[int]]` of (n/8) tables of 256 masks each
+    '''
+    m = len(table)
+    # output mask for each input bit
+    bit_masks = [0] * n
+    for j, i_in in enumerate(table):
+        bit_masks[i_in] |= (1 << (m - 1 - j))
+    byte_tables = []
+    for i_byte in range(n >> 3):
+        byte_table = [0] * 256
+        for v in range(1, 256):
+            # lowest set bit in v, and its bit index in the block
+            low = (v & -v)
+            i_in = ((i_byte << 3) + 7 - (low.bit_length() - 1))
+            # reuse the masks of v without its lowest bit
+            byte_table[v] = (byte_table[v ^ low] | bit_masks[i_in])
+        byte_tables.append(tuple(byte_table))
+    return tuple(byte_tables)
+# end def byte_permutation_tables(table: 'list[int]', n: int)
+
+def permute_int(packed: int, byte_tables: 'tuple[tuple[int]]') -> int:
+    '''
+    Permutes a packed integer using the tables compiled by
+    byte_permutation_tables.
+    '''
+    permutation = 0
+    shift = (len(byte_tables) << 3)
+    for byte_table in byte_tables:
+        shift -= 8
+        permutation |= byte_table[(packed >> shift) & 0xFF]
+    return permutation
+# end def permute_int(packed: int, byte_tables: 'tuple[tuple[int]]')
+
+def sp_tables(S: 'list[list[list[int]]]', D_STRAIGHT: 'list[int]') -> 'tuple[tuple[int]]':
+    '''
+    Merges each S-box with the straight permutation.
+    Entry [i][c] is the 32-bit straight permutation of the nibble
+    S-box #i gives for the 6-bit chunk c, in place within the block.
+    '''
+    straight = byte_permutation_tables(D_STRAIGHT, 32)
+    tables = []
+    for i_S, S_box in enumerate(S):
+        shift = (28 - (i_S << 2))
+        # row is bits [0, 5], column is bits [1:5] of the chunk
+        tables.append(tuple(
+            permute_int((S_box[((c >> 4) & 2) | (c & 1)][(c >> 1) & 0xF] << shift), straight)
+                for c in range(64)))
+    return tuple(tables)
+# end def sp_tables(S: 'list[list[list[int]]]', D_STRAIGHT: 'list[int]')
+
+class Permutation:
+    '''
+    A permutation table compiled once for fast application to lists of
+    bits, packed integers and NumPy arrays.
+    '''
+
+    # compiled permutations by table, for permute
+    compiled = {}
+
+    def __init__(self, table: Iterable[int], n: int=None):
+        '''
+        Compiles the table.
+        @param table: Iterable[int] = table of indices to use in
+            permutation
+        @param n: int = size of input block (default the smallest
+            multiple of 8 covering the table)
+        '''
+        self.table = tuple(table)
+        if (n is None):
+            n = ((max(self.table) >> 3) + 1) << 3
+        self.n = n
+        self.m = len(self.table)
+        # picks out the table's indices in one call
+        self.getter = itemgetter(*self.table)
+        # byte-indexed tables for packed integers
+        self.byte_tables = byte_permutation_tables(self.table, n)
+        # NumPy copies, made on first use
+        self._numpy_table = None
+        self._numpy_byte_tables = None
+
+    @staticmethod
+    def for_table(table: Iterable[int]) -> 'Permutation':
+        '''
+        Finds the compiled permutation for table, compiling it only
+        the first time.
+        '''
+        key = tuple(table)
+        permutation = Permutation.compiled.get(key)
+        if (permutation is None):
+            permutation = Permutation(key)
+            Permutation.compiled[key] = permutation
+        return permutation
+
+    def apply(self, bits: 'list[int]') -> 'list[int]':
+        '''
+        Permutes a list of n bits.
+        @return list of m bits
+        '''
+        if (1==self.m):
+            return [self.getter(bits)]
+        return list(self.getter(bits))
+
+    def apply_int(self, packed: int) -> int:
+        '''
+        Permutes an n-bit integer by one lookup per byte.
+        @return m-bit integer
+        '''
+        return permute_int(packed, self.byte_tables)
+
+    def apply_numpy(self, bit_matrix: 'numpy.ndarray') -> 'numpy.ndarray':
+        '''
+        Permutes the last axis of an array of bits, such as an (N, n)
+        uint8 bit matrix, by fancy indexing.
+        @return array of shape (..., m)
+        '''
+        if (self._numpy_table is None):
+            self._numpy_table = numpy.array(self.table, dtype=numpy.intp)
+        return bit_matrix[..., self._numpy_table]
+
+    def apply_batch(self, packed: 'numpy.ndarray') -> 'numpy.ndarray':
+        '''
+        Permutes an (N,) uint64 array of n-bit packed integers by one
+        gather per byte.
+        @return (N,) uint64 array of m-bit packed integers
+        '''
+        if (self._numpy_byte_tables is None):
+            self._numpy_byte_tables = numpy.array(self.byte_tables, dtype=numpy.uint64)
+        u64 = numpy.uint64
+        permutation = numpy.zeros_like(packed)
+        shift = self.n
+        for byte_table in self._numpy_byte_tables:
+            shift -= 8
+            permutation |= byte_table[(packed >> u64(shift)) & u64(0xFF)]
+        return permutation
+# end class Permutation
+
 class CharacterEncoder:
     '''
     Class used to convert between strings and bytes.
@@ -188,10 +371,10 @@ class CharacterEncoder:
         '''
         Decodes the given byte arrays into a string using self's
         character encoding.
-        @param byts: bytes = to decode
+        @param byts: bytes = to decode (any bytes-like object)
         @return string decoded from the byte array
         '''
-        return byts.decode(self.encoding)
+        return str(byts, self.encoding)
 # end class CharacterEncoder
 
 # create a character encoder using UTF-8
@@ -331,6 +514,62 @@ class DES:
         18, 12, 29, 5, 21, 10, 3, 24
     ]
 
+    # engines implementing the block functions
+    # list-of-bits engine
+    ENGINE_BITS = 'bits'
+    # packed-integer engine
+    ENGINE_PACKED = 'packed'
+    # engine used unless another is selected
+    DEFAULT_ENGINE = ENGINE_PACKED
+
+    # implementations of f for the list-of-bits engine
+    # S-box row/column lookups, then the straight permutation
+    F_SBOX = 'sbox'
+    # combined SP table lookups
+    F_SP = 'sp'
+    # implementation used unless another is selected
+    DEFAULT_F = F_SP
+
+    # size of raw keys in bytes
+    KEY_SIZE = 8
+
+    # compiled permutations
+    IP_PERM = Permutation(IP, 64)
+    FP_PERM = Permutation(FP, 64)
+    KEY_DROP_PERM = Permutation(KEY_DROP, 64)
+    KEY_COMPRESSION_PERM = Permutation(KEY_COMPRESSION, 56)
+    D_EXPANSION_PERM = Permutation(D_EXPANSION, 32)
+    D_STRAIGHT_PERM = Permutation(D_STRAIGHT, 32)
+
+    # byte-indexed tables for the packed-integer engine
+    IP_BYTES = IP_PERM.byte_tables
+    FP_BYTES = FP_PERM.byte_tables
+    D_EXPANSION_BYTES = D_EXPANSION_PERM.byte_tables
+    # S-boxes merged with the straight permutation
+    SP = sp_tables(S, D_STRAIGHT)
+
+    # whether NumPy batch mode is available
+    BATCH_AVAILABLE = (numpy is not None)
+    # minimum number of blocks for crypt_bytes to use batch mode
+    BATCH_MIN_BLOCKS = 64
+
+    # minimum message size in bytes for crypt_bytes to spread the
+    # blocks over the process pool (None to disable)
+    PARALLEL_MIN_BYTES = None
+    # number of worker processes (None for the number of CPUs)
+    PARALLEL_WORKERS = None
+    # number of shards per worker, to balance the load
+    SHARDS_PER_WORKER = 4
+    # the process pool, kept warm across calls, and its number of
+    # workers
+    _pool = None
+    _pool_workers = None
+    _pool_lock = Lock()
+
+    # process-wide cache of DES instances by raw key
+    KEY_CACHE_SIZE = 256
+    key_cache = LruCache(KEY_CACHE_SIZE)
+
     @staticmethod
     def key_generation(key: 'list[int]', ShiftTable16=BIT_SHIFT) -> 'list[list[int]]':
         """
@@ -343,7 +582,7 @@ class DES:
         # split from the parity DROPPED key
         splitN = dropN//2
 
-        cipherKey = permute(n=n, m=dropN, raw_seq=key, table=DES.KEY_DROP)
+        cipherKey = DES.KEY_DROP_PERM.apply(key[:n])
         leftKey, rightKey = split(n=dropN, m=splitN, inBlockN=cipherKey)
 
         if (DEBUG_MODE):
@@ -360,7 +599,7 @@ class DES:
             rightKey = shiftLeft(n=splitN, blockN=rightKey, numOfShifts=ShiftTable16[i_round])
             # combine and permute
             preRoundKey = combine(n=splitN, m=dropN, leftBlockN=leftKey, rightBlockN=rightKey)
-            RoundKeys16x48[i_round] = permute(n=dropN, m=48, raw_seq=preRoundKey, table=DES.KEY_COMPRESSION)
+            RoundKeys16x48[i_round] = DES.KEY_COMPRESSION_PERM.apply(preRoundKey)
 
             # print the RoundKey generated if in debug mode
             if (DEBUG_MODE):
@@ -394,11 +633,10 @@ class DES:
         """
         # TODO: your code here
 
-        N = 32
         N_EXPAND = 48
 
         # expand the right block with the expansion D-box
-        expanded_R = permute(n=N, m=N_EXPAND, raw_seq=R, table=DES.D_EXPANSION)
+        expanded_R = DES.D_EXPANSION_PERM.apply(R)
         # whiten expanded_R by XORing with the key
         white_R = xor(expanded_R, key)
 
@@ -438,7 +676,7 @@ class DES:
 
         # perform the straight permutation
         # S-mixed R is now the original size
-        R_out = permute(n=N, m=N, raw_seq=S_R_bits, table=DES.D_STRAIGHT)
+        R_out = DES.D_STRAIGHT_PERM.apply(S_R_bits)
 
         if (DEBUG_MODE):
             print('S-mixed R [bytes]:', S_R_bytes)
@@ -447,6 +685,26 @@ class DES:
 
         return R_out
 
+    @staticmethod
+    def f_sp(R: 'list[int]', key: 'list[int]') -> 'list[int]':
+        """
+        f function using the SP tables, which combine each S-box's
+        row/column lookup with the straight permutation.
+        Each 6-bit chunk of the whitened R indexes its table directly,
+        so f is 8 lookups and ORs.
+        R: 32 bits = right block
+        key: 48 bits
+        return: 32 bits
+        """
+        # expand and whiten R as packed integers
+        white_R = (DES.D_EXPANSION_PERM.apply_int(bits2int(R)) ^ bits2int(key))
+        SP1, SP2, SP3, SP4, SP5, SP6, SP7, SP8 = DES.SP
+        R_out = (SP1[white_R >> 42] | SP2[(white_R >> 36) & 0x3F]
+            | SP3[(white_R >> 30) & 0x3F] | SP4[(white_R >> 24) & 0x3F]
+            | SP5[(white_R >> 18) & 0x3F] | SP6[(white_R >> 12) & 0x3F]
+            | SP7[(white_R >> 6) & 0x3F] | SP8[white_R & 0x3F])
+        return int2bits(R_out, 32)
+
     @staticmethod  
     def mixer(L: 'list[int]', R: 'list[int]', sub_key: 'list[int]') -> 'tuple[list[int]]':
         """
@@ -466,13 +724,53 @@ class DES:
         """
         return R, L
 
-    def __init__(self, raw_key: bytes) -> None:
+    def __init__(self, raw_key: bytes, engine: str=None, batch: bool=None, f_impl: str=None) -> None:
+        # select the engine
+        if (engine is None):
+            engine = DES.DEFAULT_ENGINE
+        if (engine not in (DES.ENGINE_BITS, DES.ENGINE_PACKED)):
+            raise ValueError(f'unknown DES engine: {engine}')
+        self.engine = engine
+        # select f for the list-of-bits engine
+        if (f_impl is None):
+            f_impl = DES.DEFAULT_F
+        if (DES.F_SBOX==f_impl):
+            self.f_round = DES.f
+        elif (DES.F_SP==f_impl):
+            self.f_round = DES.f_sp
+        else:
+            raise ValueError(f'unknown f implementation: {f_impl}')
+        # select batch mode for large messages with the packed engine
+        if (batch is None):
+            batch = DES.BATCH_AVAILABLE
+        if (batch and not(DES.BATCH_AVAILABLE)):
+            raise ImportError('DES batch mode requires NumPy')
+        self.batch = batch
+        # the arguments rebuilding this cipher in the workers of
+        # crypt_parallel, which keep their own schedule for each key
+        self.worker_args = (bytes(raw_key), engine, batch)
+
         # for encryption use
-        self.keys = DES.key_generation(key=bitize(raw_key))
-        
+        # stored immutably, so the schedule can be shared
+        self.keys = tuple(tuple(key) for key in DES.key_generation(key=bitize(raw_key)))
+
         # for decryption use
-        self.reverse_keys = deepcopy(self.keys)
-        self.reverse_keys.reverse()
+        self.reverse_keys = self.keys[::-1]
+
+        # round keys packed as 48-bit integers
+        self.packed_keys = tuple(bits2int(key) for key in self.keys)
+        self.reverse_packed_keys = self.packed_keys[::-1]
+
+    @staticmethod
+    def for_key(raw_key: bytes) -> 'DES':
+        '''
+        Finds the DES instance for raw_key in the process-wide key
+        schedule cache, scheduling the key only on a miss.
+        Instances use the default engine and batch mode.
+        @param raw_key: bytes = the key
+        @return the DES instance for raw_key
+        '''
+        return DES.key_cache.get_or_create(bytes(raw_key), DES)
 
     def enc_block(self, block: 'list[int]') -> 'list[int]':
         """
@@ -480,6 +778,8 @@ class DES:
         block: 64 bits.
         return: 64 bits.
         """
+        if (DES.ENGINE_PACKED==self.engine):
+            return int2bits(self.cry_int(bits2int(block), self.packed_keys), 64)
         return self.cry_block(block, self.keys)
 
     def dec_block(self, block: 'list[int]') -> 'list[int]':
@@ -489,8 +789,74 @@ class DES:
         return: 64 bits
         """
         # TODO: your code here
+        if (DES.ENGINE_PACKED==self.engine):
+            return int2bits(self.cry_int(bits2int(block), self.reverse_packed_keys), 64)
         return self.cry_block(block, self.reverse_keys)
 
+    def enc_int(self, block: int) -> int:
+        """
+        Encrypt a block packed as a 64-bit integer.
+        block: 64-bit integer.
+        return: 64-bit integer.
+        """
+        if (DES.ENGINE_PACKED==self.engine):
+            return self.cry_int(block, self.packed_keys)
+        return bits2int(self.enc_block(int2bits(block, 64)))
+
+    def dec_int(self, block: int) -> int:
+        """
+        similar to enc_int
+        block: 64-bit integer
+        return: 64-bit integer
+        """
+        if (DES.ENGINE_PACKED==self.engine):
+            return self.cry_int(block, self.reverse_packed_keys)
+        return bits2int(self.dec_block(int2bits(block, 64)))
+
+    @staticmethod
+    def cry_int(block: int, keys: 'tuple[int]') -> int:
+        """
+        Encrypt/decrypt a block packed as a 64-bit integer using the
+        packed-integer engine.
+        block: 64-bit integer.
+        keys: 16 * (48-bit integer key)
+        return: 64-bit integer.
+        """
+        # apply initial permutation, and split
+        block_IP = permute_int(block, DES.IP_BYTES)
+        leftBlock, rightBlock = DES.rounds_int((block_IP >> 32), (block_IP & 0xFFFFFFFF), keys)
+        # reverse the last swap, recombine and apply final permutation
+        return permute_int(((rightBlock << 32) | leftBlock), DES.FP_BYTES)
+    # end def cry_int(block: int, keys: 'tuple[int]')
+
+    @staticmethod
+    def rounds_int(leftBlock: int, rightBlock: int, keys: 'tuple[int]') -> 'tuple[int]':
+        """
+        Performs the rounds of the packed-integer engine, between the
+        initial and final permutations.
+        leftBlock, rightBlock: 32-bit integers.
+        keys: 48-bit integer key per round
+        return: (leftBlock, rightBlock) after the last round's swap.
+        """
+        # fetch the tables once
+        E0, E1, E2, E3 = DES.D_EXPANSION_BYTES
+        SP1, SP2, SP3, SP4, SP5, SP6, SP7, SP8 = DES.SP
+
+        for key in keys:
+            # expand and whiten the right block
+            white_R = key ^ (E0[rightBlock >> 24] | E1[(rightBlock >> 16) & 0xFF]
+                | E2[(rightBlock >> 8) & 0xFF] | E3[rightBlock & 0xFF])
+            # S-boxes and straight permutation by lookup
+            f_R_key = (SP1[white_R >> 42] | SP2[(white_R >> 36) & 0x3F]
+                | SP3[(white_R >> 30) & 0x3F] | SP4[(white_R >> 24) & 0x3F]
+                | SP5[(white_R >> 18) & 0x3F] | SP6[(white_R >> 12) & 0x3F]
+                | SP7[(white_R >> 6) & 0x3F] | SP8[white_R & 0x3F])
+            # mix and swap
+            leftBlock, rightBlock = rightBlock, (leftBlock ^ f_R_key)
+        # next key
+        return (leftBlock, rightBlock)
+    # end def rounds_int(leftBlock: int, rightBlock: int, keys: 'tuple[int]')
+
     def cry_block(self, block: 'list[int]', keys) -> 'list[int]':
         """
         Encrypt/decrypt a block of 64 bits (8 bytes).
@@ -502,14 +868,14 @@ class DES:
         HALF_N = N//2
 
         # apply initial permutation
-        block_IP = permute(n=N, m=N, raw_seq=block, table=DES.IP)
+        block_IP = DES.IP_PERM.apply(block)
         # split the block into left and right blocks
         leftBlock, rightBlock = split(n=N, m=HALF_N, inBlockN=block_IP)
 
         # perform rounds
         for k in range(N_ROUNDS):
             # mixer mixes f(R, K) into L
-            f_R_key = DES.f(rightBlock, keys[k])
+            f_R_key = self.f_round(rightBlock, keys[k])
             # swapper swaps L, R
             leftBlock, rightBlock = (rightBlock, xor(leftBlock, f_R_key))
         # next k
@@ -519,7 +885,7 @@ class DES:
         # recombine after rounds
         rounds_result = combine(n=HALF_N, m=N, leftBlockN=leftBlock, rightBlockN=rightBlock)
 
-        block_FP = permute(n=N, m=N, raw_seq=rounds_result, table=DES.FP)
+        block_FP = DES.FP_PERM.apply(rounds_result)
 
         if (DEBUG_MODE):
             print("Before IP:", ''.join(str(i) for i in block))
@@ -542,15 +908,31 @@ class DES:
         # encrypt these bytes, giving cypher
         cypher = self.crypt_bytes(msg_bytes, self.enc_block)
         return cypher
+
+    def encrypt_into(self, msg_str: str, encode: 'Callable[[object, str], bytes]'=utf8_encoder.encode) -> bytearray:
+        '''
+        Encrypts the whole message as encrypt, but into a bytearray.
+        If encode gives a block-aligned bytearray (such as
+        SimpleHmacEncoder.encode), it is encrypted in place and
+        returned, so the message is not copied.
+        @return the ciphertext, as a bytearray that the caller owns
+        '''
+        # convert message to bytes
+        msg_bytes = encode(msg_str)
+        # encrypt in place if possible
+        if (isinstance(msg_bytes, bytearray) and (0==needed_padding(len(msg_bytes)))):
+            return self.crypt_into(msg_bytes, self.enc_block, msg_bytes)
+        return self.crypt_into(msg_bytes, self.enc_block)
     
     def decrypt(self, msg_bytes: bytes, decode: 'Callable[[object, bytes], str]'=utf8_encoder.decode) -> str:
         """
         Decrypt the whole message.
         Similar to encrypt.
+        msg_bytes may be any bytes-like object.
         """
         # TODO: your code here
         # decrypt bytes, giving plaintext bytes
-        plaintext_bytes = self.crypt_bytes(msg_bytes, self.dec_block)
+        plaintext_bytes = self.crypt_into(msg_bytes, self.dec_block)
         # convert to string
         plaintext_string = decode(plaintext_bytes)
         return plaintext_string
@@ -562,27 +944,300 @@ class DES:
         Handle block division here.
         *Inputs are guaranteed to have a length divisible by 8.
         """
-        # pad if number of bytes if needed
-        msg_bytes_pad = bytearray(needed_padding(len(msg_bytes)))
-        padded_msg_bytes = msg_bytes + msg_bytes_pad
+        return bytes(self.crypt_into(msg_bytes, callback))
+
+    def crypt_into(self, msg_bytes: bytes, callback: 'Callable[[DES, list[int]], list[int]]', out: bytearray=None) -> bytearray:
+        """
+        Transforms the blocks in msg_bytes, zero padded to a multiple of
+        8 bytes, using callback, and writes them into out.
+        @param msg_bytes: bytes = any bytes-like object
+        @param callback = self.enc_block, self.dec_block, or another
+            function on 64-bit lists
+        @param out: bytearray = where to write the result, of the
+            padded length (default a new bytearray).  May be msg_bytes
+            itself if it is block-aligned, to transform in place.
+        @return out
+        """
+        view = memoryview(msg_bytes).cast('B')
+        n_padded = (len(view) + needed_padding(len(view)))
+        if (out is None):
+            out = bytearray(n_padded)
         if (DEBUG_MODE):
-            print('original length:', len(msg_bytes))
-            print('padding created:', len(msg_bytes_pad))
-            print('new length:', len(padded_msg_bytes))
-        # initialize the bits of the bytes to return
-        cry_all_bits = []
+            print('original length:', len(view))
+            print('padding created:', (n_padded - len(view)))
+            print('new length:', n_padded)
+        # the packed-integer engine skips bits entirely
+        if (DES.ENGINE_PACKED==self.engine):
+            packed_keys = self.packed_keys_for(callback)
+            if (packed_keys is not None):
+                if ((DES.PARALLEL_MIN_BYTES is not None)
+                        and (n_padded >= DES.PARALLEL_MIN_BYTES)):
+                    return self.crypt_parallel(view, (callback==self.dec_block), out)
+                return self.crypt_blocks(view, packed_keys, out)
         # loop through each 8-byte segment (64-bit block), encrypting it
-        for k in range(0, len(padded_msg_bytes), 8):
-            # get the segment
-            msg_block = padded_msg_bytes[k:(k + 8)]
-            # convert to bits
-            msg_bits = bitize(msg_block)
+        for k in range(0, n_padded, 8):
+            # get the segment, and convert to bits
+            msg_bits = bitize(view[k:(k + 8)])
+            # pad if number of bits if needed
+            msg_bits.extend([0] * needed_padding(len(msg_bits), 64))
             # encrypt the bits
             cry_bits = callback(msg_bits)
-            # append to bits to return
-            cry_all_bits.extend(cry_bits)
+            # convert back to bytes
+            out[k:(k + 8)] = debitize(cry_bits)
+        # next k
+        return out
+
+    def packed_keys_for(self, callback: 'Callable[[DES, list[int]], list[int]]') -> 'tuple[int]':
+        '''
+        Finds the packed round keys equivalent to the given block
+        callback.
+        @return packed round keys if callback is self.enc_block or
+            self.dec_block, otherwise None
+        '''
+        if (callback==self.enc_block):
+            return self.packed_keys
+        if (callback==self.dec_block):
+            return self.reverse_packed_keys
+        return None
+
+    def crypt_blocks(self, view: memoryview, packed_keys: 'tuple[int]', out: bytearray) -> bytearray:
+        '''
+        Transforms the blocks in view, zero padded to a multiple of 8
+        bytes, with the packed round keys into out, in batch mode if
+        enabled and the message is long enough.
+        @return out
+        '''
+        n_padded = (len(view) + needed_padding(len(view)))
+        if (self.batch and ((n_padded >> 3) >= DES.BATCH_MIN_BLOCKS)):
+            # batch mode needs whole blocks, so pad within out
+            if (n_padded != len(view)):
+                out[:len(view)] = view
+                out[len(view):n_padded] = bytes(n_padded - len(view))
+                view = memoryview(out)[:n_padded]
+            out[:n_padded] = DES.crypt_batch(view, packed_keys)
+            return out
+        return self.crypt_packed(view, packed_keys, out)
+
+    def crypt_parallel(self, view: memoryview, decrypt: bool, out: bytearray) -> bytearray:
+        '''
+        Splits view into block-aligned shards, and transforms them in
+        the process pool into out.
+        Only the cipher class and worker_args are sent to the workers,
+        which schedule the key once, and keep it in their own cache.
+        @param decrypt: bool = whether to decrypt rather than encrypt
+        @return out
+        '''
+        pool = DES.pool()
+        n_shards = (DES._pool_workers * DES.SHARDS_PER_WORKER)
+        n_blocks = -(-len(view) // 8)
+        shard_size = (-(-n_blocks // n_shards) << 3)
+        offsets = range(0, len(view), shard_size)
+        shards = [bytes(view[k:(k + shard_size)]) for k in offsets]
+        n = len(shards)
+        # map keeps the shards in order
+        cry_shards = pool.map(crypt_shard,
+            ([type(self)] * n), ([self.worker_args] * n), ([decrypt] * n), shards)
+        for k, cry_shard in zip(offsets, cry_shards):
+            out[k:(k + len(cry_shard))] = cry_shard
+        return out
+
+    @staticmethod
+    def pool() -> ProcessPoolExecutor:
+        '''
+        Starts the process pool on first use, with PARALLEL_WORKERS
+        workers, or one for each CPU.
+        '''
+        with DES._pool_lock:
+            if (DES._pool is None):
+                DES._pool_workers = (DES.PARALLEL_WORKERS or cpu_count() or 1)
+                DES._pool = ProcessPoolExecutor(max_workers=DES._pool_workers)
+            return DES._pool
+
+    @staticmethod
+    def shutdown_pool():
+        '''
+        Stops the process pool, if started.
+        '''
+        with DES._pool_lock:
+            if (DES._pool is not None):
+                DES._pool.shutdown()
+                DES._pool = None
+
+    def crypt_packed(self, view: memoryview, packed_keys: 'tuple[int]', out: bytearray) -> bytearray:
+        '''
+        Transforms each 8-byte block in view as a 64-bit integer using
+        the given packed round keys, writing into out.  The last
+        block is zero padded if incomplete.
+        @return out
+        '''
+        from_bytes = int.from_bytes
+        cry_int = self.cry_int
+        n_whole = (len(view) & ~7)
+        # loop through each 8-byte segment (64-bit block)
+        for k in range(0, n_whole, 8):
+            msg_block = from_bytes(view[k:(k + 8)], 'big')
+            out[k:(k + 8)] = cry_int(msg_block, packed_keys).to_bytes(8, 'big')
         # next k
-        # convert back to bytes
-        cry_all_bytes = bytes(debitize(cry_all_bits))
-        return cry_all_bytes
+        # pad the last block
+        if (n_whole < len(view)):
+            n_pad = needed_padding(len(view))
+            msg_block = (from_bytes(view[n_whole:], 'big') << (n_pad << 3))
+            out[n_whole:(n_whole + 8)] = cry_int(msg_block, packed_keys).to_bytes(8, 'big')
+        return out
+
+    def encrypt_many(self, msg_bytes: bytes) -> bytes:
+        '''
+        Encrypts msg_bytes, padded to a multiple of 8 bytes, with all
+        blocks processed at once in NumPy batch mode.
+        '''
+        return DES.crypt_batch(DES.padded(msg_bytes), self.packed_keys)
+
+    def decrypt_many(self, msg_bytes: bytes) -> bytes:
+        '''
+        similar to encrypt_many
+        '''
+        return DES.crypt_batch(DES.padded(msg_bytes), self.reverse_packed_keys)
+
+    @staticmethod
+    def padded(msg_bytes: bytes) -> bytes:
+        '''
+        Zero pads msg_bytes to a multiple of 8 bytes, copying only if
+        needed.
+        '''
+        n_pad = needed_padding(len(msg_bytes))
+        if (0==n_pad):
+            return msg_bytes
+        padded_msg_bytes = bytearray(len(msg_bytes) + n_pad)
+        padded_msg_bytes[:len(msg_bytes)] = msg_bytes
+        return padded_msg_bytes
+
+    @staticmethod
+    def crypt_batch(padded_msg_bytes: bytes, packed_keys: 'tuple[int]') -> bytes:
+        '''
+        Transforms all 8-byte blocks in padded_msg_bytes at once as an
+        (N,) uint64 array, running every round on all N blocks with
+        gathers from the packed-integer engine's tables.
+        *Input length must be divisible by 8.
+        '''
+        if (not(DES.BATCH_AVAILABLE)):
+            raise ImportError('DES batch mode requires NumPy')
+        SP = DES.batch_sp_tables()
+        u64 = numpy.uint64
+        # load the big-endian blocks
+        blocks = numpy.frombuffer(padded_msg_bytes, dtype='>u8').astype(u64)
+
+        # apply initial permutation, and split
+        block_IP = DES.IP_PERM.apply_batch(blocks)
+        leftBlock, rightBlock = (block_IP >> u64(32)), (block_IP & u64(0xFFFFFFFF))
+
+        # perform rounds on all blocks
+        for key in packed_keys:
+            white_R = (DES.D_EXPANSION_PERM.apply_batch(rightBlock) ^ u64(key))
+            f_R_key = numpy.zeros_like(white_R)
+            for i_S in range(8):
+                chunk = ((white_R >> u64(42 - 6*i_S)) & u64(0x3F))
+                f_R_key |= SP[i_S][chunk]
+            leftBlock, rightBlock = rightBlock, (leftBlock ^ f_R_key)
+        # next key
+
+        # reverse the last swap, recombine and apply final permutation
+        block_FP = DES.FP_PERM.apply_batch(((rightBlock << u64(32)) | leftBlock))
+        return block_FP.astype('>u8').tobytes()
+    # end def crypt_batch(padded_msg_bytes: bytes, packed_keys: 'tuple[int]')
+
+    # NumPy copy of the SP tables
+    _batch_sp_tables = None
+
+    @staticmethod
+    def batch_sp_tables() -> 'numpy.ndarray':
+        '''
+        Converts the SP tables to an (8, 64) NumPy array on first use.
+        '''
+        if (DES._batch_sp_tables is None):
+            DES._batch_sp_tables = numpy.array(DES.SP, dtype=numpy.uint64)
+        return DES._batch_sp_tables
 # end class DES
+
+
+class TripleDES(DES):
+    '''
+    Triple DES in encrypt-decrypt-encrypt (EDE) mode, with 2 or 3 keys.
+
+    Uses the packed-integer engine on the cached DES schedules of its
+    keys.  Since FP and IP cancel between the stages, each block is
+    permuted only once on entry and once on exit.
+    '''
+
+    # size of raw keys in bytes (3-key)
+    KEY_SIZE = 24
+
+    # process-wide cache of TripleDES instances by raw key
+    key_cache = LruCache(DES.KEY_CACHE_SIZE)
+
+    def __init__(self, raw_key: bytes, n_keys: int=None) -> None:
+        '''
+        Schedules the keys.
+        @param raw_key: bytes = K1||K2 (2-key), or K1||K2||K3 (3-key)
+        @param n_keys: int = number of 8-byte keys to use from
+            raw_key, 2 or 3 (default 3 if raw_key is long enough)
+        '''
+        if (n_keys is None):
+            n_keys = (3 if (len(raw_key) >= 24) else 2)
+        if ((n_keys not in (2, 3)) or (len(raw_key) < (n_keys*8))):
+            raise ValueError(f'TripleDES needs {n_keys} keys of 8 bytes, but got {len(raw_key)} bytes')
+        self.engine = DES.ENGINE_PACKED
+        self.batch = False
+        self.n_keys = n_keys
+        self.worker_args = (bytes(raw_key[:(n_keys*8)]), n_keys)
+        # K3 = K1 for 2-key
+        i_K3 = (2 if (3==n_keys) else 0)
+        K1, K2, K3 = (DES.for_key(raw_key[(8*k):(8*(k + 1))]) for k in (0, 1, i_K3))
+        self.stages = (K1, K2, K3)
+        # encrypt with K1, decrypt with K2, encrypt with K3
+        self.packed_keys = (K1.packed_keys, K2.reverse_packed_keys, K3.packed_keys)
+        # decrypt with K3, encrypt with K2, decrypt with K1
+        self.reverse_packed_keys = (K3.reverse_packed_keys, K2.packed_keys, K1.reverse_packed_keys)
+
+    @staticmethod
+    def for_key(raw_key: bytes) -> 'TripleDES':
+        '''
+        Finds the TripleDES instance for raw_key in its key cache.
+        '''
+        return TripleDES.key_cache.get_or_create(bytes(raw_key), TripleDES)
+
+    @staticmethod
+    def cry_int(block: int, keys: 'tuple[tuple[int]]') -> int:
+        '''
+        Encrypt/decrypt a block packed as a 64-bit integer through the
+        three stages.
+        keys: 3 * 16 * (48-bit integer key)
+        '''
+        block_IP = permute_int(block, DES.IP_BYTES)
+        leftBlock, rightBlock = (block_IP >> 32), (block_IP & 0xFFFFFFFF)
+        for stage_keys in keys:
+            leftBlock, rightBlock = DES.rounds_int(leftBlock, rightBlock, stage_keys)
+            # reverse the last swap of the stage
+            leftBlock, rightBlock = rightBlock, leftBlock
+        return permute_int(((leftBlock << 32) | rightBlock), DES.FP_BYTES)
+    # end def cry_int(block: int, keys: 'tuple[tuple[int]]')
+# end class TripleDES
+
+
+# the ciphers of a worker process by (class, worker_args), so each key
+# is only scheduled once per worker
+worker_ciphers = LruCache(DES.KEY_CACHE_SIZE)
+
+def crypt_shard(cipher: 'type[DES]', worker_args: tuple, decrypt: bool, shard: bytes) -> bytes:
+    '''
+    Transforms a block-aligned shard in a worker process.
+    @param cipher: type[DES] = DES or TripleDES
+    @param worker_args: tuple = the arguments building the cipher,
+        with its key and settings
+    @param decrypt: bool = whether to decrypt rather than encrypt
+    @param shard: bytes = the blocks to transform
+    '''
+    des = worker_ciphers.get_or_create((cipher, worker_args), (lambda key: cipher(*worker_args)))
+    packed_keys = (des.reverse_packed_keys if decrypt else des.packed_keys)
+    out = bytearray(len(shard) + needed_padding(len(shard)))
+    return des.crypt_blocks(memoryview(shard), packed_keys, out)
+# end def crypt_shard(cipher: 'type[DES]', worker_args: tuple, decrypt: bool, shard: bytes)
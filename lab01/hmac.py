@@ -1,5 +1,15 @@
 # standard libraries
 from hashlib import sha256
+import importlib.util
+import os
+import sysconfig
+
+# this module shadows the standard hmac, so load its public compare_digest from the stdlib file
+_stdlib_hmac_spec = importlib.util.spec_from_file_location('_stdlib_hmac',
+    os.path.join(sysconfig.get_paths()['stdlib'], 'hmac.py'))
+_stdlib_hmac = importlib.util.module_from_spec(_stdlib_hmac_spec)
+_stdlib_hmac_spec.loader.exec_module(_stdlib_hmac)
+compare_digest = _stdlib_hmac.compare_digest
 
 # local library crypto
 from crypto import needed_padding
@@ -9,43 +19,70 @@ DEBUG_MODE = False
 # whether to fail HMAC in encode on purpose
 FAIL_ENCODE = False
 
+# size of a SHA-256 MAC in bytes
+MAC_SIZE = 32
+# size of a SHA-256 input block in bytes
+HASH_BLOCK_SIZE = 64
+
+# MAC modes
+# SHA-256(msg||key), understood by existing peers
+MODE_SIMPLE = 'simple'
+# RFC 2104 HMAC-SHA256
+MODE_RFC2104 = 'rfc2104'
+# RFC 2104 inner and outer pads
+IPAD = 0x36
+OPAD = 0x5C
+
 class SimpleHmacEncoder:
     '''
     Encoder that performs HMAC encoding and HMAC check on decoding.
     
     This is a simple implementation of HMAC appended to the end of the
-    entire message.
+    entire message.  In MODE_RFC2104, the MAC is standard HMAC-SHA256,
+    whose keyed inner and outer hash states are computed only once.
     '''
 
-    def __init__(self, _parent: object, _mac_key: bytes):
+    def __init__(self, _parent: object, _mac_key: bytes, _mode: str=MODE_SIMPLE):
         '''
         Initializes an encoder.
         @param _parent: object = backing encoder with encode and decode
             methods
         @param _mac_key: bytes = the mac key as bytes
+        @param _mode: str = MODE_SIMPLE or MODE_RFC2104
         '''
         self.parent = _parent
         self.mac_key = _mac_key
+        if (_mode not in (MODE_SIMPLE, MODE_RFC2104)):
+            raise ValueError(f'unknown MAC mode: {_mode}')
+        self.mode = _mode
+        # precompute the keyed hash states once per key
+        if (MODE_RFC2104==_mode):
+            self.inner, self.outer = keyed_hash_states(_mac_key)
 
     def encode(self, string: str) -> bytes:
         '''
         Encodes the given string using the backing encoder, then
         appends its HMAC.
+        The padding and HMAC are written into a single buffer, which
+        DES.encrypt can then encrypt in place.
         @param string: str = to encode
-        @return HMAC encoding of the string
+        @return HMAC encoding of the string, as a bytearray
         '''
         # delegate to parent encoder
         msg_bytes = self.parent.encode(string)
-        # pad message if needed
-        msg_bytes_pad = bytearray(needed_padding(len(msg_bytes)))
-        padded_msg_bytes = msg_bytes + msg_bytes_pad
-        # HMAC the result
-        msg_mac = self.hmac(padded_msg_bytes)
+        # allocate the padded message and its MAC at once
+        n_msg = len(msg_bytes)
+        n_padded = (n_msg + needed_padding(n_msg))
+        complete_msg = bytearray(n_padded + MAC_SIZE)
+        # the padding is already 0
+        complete_msg[:n_msg] = msg_bytes
+        # HMAC the padded message
+        msg_mac = self.hmac(memoryview(complete_msg)[:n_padded])
         # fail if configured to do so
         if (FAIL_ENCODE):
             msg_mac = self.hmac(b'')
         # append to padded message
-        complete_msg = (padded_msg_bytes + msg_mac)
+        complete_msg[n_padded:] = msg_mac
         if (DEBUG_MODE):
             print(f'msg_mac: {msg_mac}')
             print(f'complet: {complete_msg}')
@@ -56,12 +93,13 @@ class SimpleHmacEncoder:
         '''
         Separates the message from its HMAC, and decodes it using the
         backing encoder.
-        @param byts: bytes = to decode
+        @param byts: bytes = to decode (any bytes-like object)
         @return message string decoded from the byte array
         '''
-        # split byte array into message, theoretical MAC
+        # split byte array into message, theoretical MAC without copying
         # sha256 is always 256 bytes = 32 bytes
-        msg_bytes, theo_mac = (byts[:-32], byts[-32:])
+        view = memoryview(byts)
+        msg_bytes, theo_mac = (view[:-MAC_SIZE], bytes(view[-MAC_SIZE:]))
         # calculate the mac from the message
         calc_mac = self.hmac(msg_bytes)
 
@@ -72,8 +110,8 @@ class SimpleHmacEncoder:
             print(f'theo_mac: {theo_mac}')
             print(f'calc_mac: {calc_mac}')
 
-        # compare MACs
-        if (theo_mac != calc_mac):
+        # compare MACs in constant time
+        if (not(compare_digest(theo_mac, calc_mac))):
             # if different, throw an exception
             # but do NOT include the calculated MAC
             raise UnexpectedMac(f'Unexpected MAC: expected {theo_mac}')
@@ -84,18 +122,54 @@ class SimpleHmacEncoder:
 
     def hmac(self, msg_bytes: bytes) -> bytes:
         '''
-        Finds the hashed MAC of the given message in bytes.
+        Finds the hashed MAC of the given message in bytes, using the
+        encoder's mode.
+        @param msg_bytes: bytes = any bytes-like object
+        '''
+        if (MODE_RFC2104==self.mode):
+            return self.rfc2104_hmac(msg_bytes)
+        return self.simple_hmac(msg_bytes)
+
+    def simple_hmac(self, msg_bytes: bytes) -> bytes:
+        '''
+        Finds SHA-256(msg_bytes||mac_key).
+        @param msg_bytes: bytes = any bytes-like object
         '''
-        # append mac to msg_bytes
-        msg_mac = (msg_bytes + self.mac_key)
-        # hash msg_mac
+        # hash msg_bytes followed by the mac key, without joining them
         h0 = sha256()
-        h0.update(msg_mac)
+        h0.update(msg_bytes)
+        h0.update(self.mac_key)
         # return the result
         return h0.digest()
+
+    def rfc2104_hmac(self, msg_bytes: bytes) -> bytes:
+        '''
+        Finds HMAC-SHA256(mac_key, msg_bytes) from the precomputed
+        keyed hash states.
+        @param msg_bytes: bytes = any bytes-like object
+        '''
+        h_inner = self.inner.copy()
+        h_inner.update(msg_bytes)
+        h_outer = self.outer.copy()
+        h_outer.update(h_inner.digest())
+        return h_outer.digest()
     
 # end class SimpleHmacEncoder
 
+def keyed_hash_states(mac_key: bytes) -> 'tuple[sha256]':
+    '''
+    Computes the RFC 2104 inner and outer SHA-256 states, after hashing
+    (key XOR ipad) and (key XOR opad) respectively.
+    '''
+    # long keys are hashed first
+    if (len(mac_key) > HASH_BLOCK_SIZE):
+        mac_key = sha256(mac_key).digest()
+    # pad the key to the block size
+    mac_key = mac_key.ljust(HASH_BLOCK_SIZE, b'\0')
+    inner = sha256(bytes((k ^ IPAD) for k in mac_key))
+    outer = sha256(bytes((k ^ OPAD) for k in mac_key))
+    return (inner, outer)
+
 class UnexpectedMac(Exception):
     '''
     Thrown when a calculated MAC does not match the expected
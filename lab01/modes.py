@@ -0,0 +1,271 @@
+'''
+Streaming modes of operation on top of the DES block functions.
+
+Each cipher context accepts the message in chunks through update, which
+returns the output for every complete block so far, and finalize, which
+flushes the rest.  The messages are zero padded to a multiple of the
+block size, just as DES.crypt_bytes does.
+
+ECB is the default for wire compatibility with DES.encrypt and
+DES.decrypt.
+'''
+
+# standard libraries
+from abc import ABC, abstractmethod
+from os import urandom
+
+# local library crypto
+from crypto import DES, needed_padding
+
+# size of a DES block in bytes
+BLOCK_SIZE = 8
+
+# the modes of operation
+ECB = 'ECB'
+CBC = 'CBC'
+CTR = 'CTR'
+# mode used unless another is selected
+DEFAULT_MODE = ECB
+
+
+class BlockStream(ABC):
+    '''
+    Buffers chunks into whole blocks for a block transformation.
+    Subclasses implement crypt_blocks.
+    '''
+
+    def __init__(self, des: DES):
+        '''
+        Initializes the stream.
+        @param des: DES = the DES instance providing the block functions
+        '''
+        self.des = des
+        # bytes held until a block is complete
+        self.pending = bytearray()
+        self.finalized = False
+
+    def update(self, chunk: bytes) -> bytes:
+        '''
+        Transforms every complete block available after adding chunk.
+        @param chunk: bytes = next part of the message
+        @return the transformed complete blocks
+        '''
+        if (self.finalized):
+            raise ValueError('cipher context already finalized')
+        self.pending += chunk
+        n_complete = (len(self.pending) - (len(self.pending) % BLOCK_SIZE))
+        out = self.crypt_blocks(memoryview(self.pending)[:n_complete])
+        del self.pending[:n_complete]
+        return out
+
+    def finalize(self) -> bytes:
+        '''
+        Pads and transforms any remaining bytes, and closes the stream.
+        @return the transformed final block, if any
+        '''
+        if (self.finalized):
+            raise ValueError('cipher context already finalized')
+        self.pending += bytes(needed_padding(len(self.pending), BLOCK_SIZE))
+        out = self.crypt_blocks(memoryview(self.pending))
+        self.pending.clear()
+        self.finalized = True
+        return out
+
+    @abstractmethod
+    def crypt_blocks(self, blocks: memoryview) -> bytes:
+        '''
+        Transforms whole blocks in order.
+        '''
+# end class BlockStream
+
+
+class ChainedBlockStream(BlockStream):
+    '''
+    A block stream whose blocks depend on the previous ones, so they
+    are transformed one at a time.  Subclasses implement crypt_block.
+    '''
+
+    def crypt_blocks(self, blocks: memoryview) -> bytes:
+        out = bytearray(len(blocks))
+        for k in range(0, len(blocks), BLOCK_SIZE):
+            block = int.from_bytes(blocks[k:(k + BLOCK_SIZE)], 'big')
+            out[k:(k + BLOCK_SIZE)] = self.crypt_block(block).to_bytes(BLOCK_SIZE, 'big')
+        return bytes(out)
+
+    @abstractmethod
+    def crypt_block(self, block: int) -> int:
+        '''
+        Transforms the next block, packed as a 64-bit integer.
+        '''
+# end class ChainedBlockStream
+
+
+class EcbEncryptor(BlockStream):
+    '''
+    Electronic codebook encryption, the same as DES.encrypt.
+    '''
+
+    def crypt_blocks(self, blocks: memoryview) -> bytes:
+        # delegate to the whole-message path, which may use batch mode
+        return self.des.crypt_bytes(blocks, self.des.enc_block)
+
+
+class EcbDecryptor(BlockStream):
+    '''
+    Electronic codebook decryption, the same as DES.decrypt.
+    '''
+
+    def crypt_blocks(self, blocks: memoryview) -> bytes:
+        return self.des.crypt_bytes(blocks, self.des.dec_block)
+
+
+class CbcEncryptor(ChainedBlockStream):
+    '''
+    Cipher block chaining encryption.
+    '''
+
+    def __init__(self, des: DES, iv: bytes=None):
+        '''
+        @param iv: bytes = initialization vector (default random), to be
+            sent along with the ciphertext
+        '''
+        super().__init__(des)
+        if (iv is None):
+            iv = urandom(BLOCK_SIZE)
+        self.iv = check_iv(iv)
+        self.chain = int.from_bytes(self.iv, 'big')
+
+    def crypt_block(self, block: int) -> int:
+        self.chain = self.des.enc_int(block ^ self.chain)
+        return self.chain
+
+
+class CbcDecryptor(ChainedBlockStream):
+    '''
+    Cipher block chaining decryption.
+    '''
+
+    def __init__(self, des: DES, iv: bytes):
+        '''
+        @param iv: bytes = initialization vector used in encryption
+        @raise ValueError if iv is missing or not one block
+        '''
+        super().__init__(des)
+        self.iv = check_iv(iv)
+        self.chain = int.from_bytes(self.iv, 'big')
+
+    def crypt_block(self, block: int) -> int:
+        plain = (self.des.dec_int(block) ^ self.chain)
+        self.chain = block
+        return plain
+
+
+class CtrCipher:
+    '''
+    Counter mode, used for both encryption and decryption.
+
+    The keystream is the encryption of successive counter blocks, so it
+    does not depend on the message.  It can be precomputed, and whole
+    runs of blocks are encrypted at once (in batch mode if available).
+    Since the keystream is XORed in, no padding is needed.
+    '''
+
+    def __init__(self, des: DES, iv: bytes=None):
+        '''
+        @param iv: bytes = initial counter block (default random), to
+            be sent along with the ciphertext
+        '''
+        self.des = des
+        if (iv is None):
+            iv = urandom(BLOCK_SIZE)
+        self.iv = check_iv(iv)
+        # next counter block to encrypt into the keystream
+        self.counter = int.from_bytes(self.iv, 'big')
+        # keystream computed but not yet used
+        self.keystream = bytearray()
+        self.finalized = False
+
+    def precompute(self, n_bytes: int):
+        '''
+        Extends the unused keystream to at least n_bytes.
+        '''
+        n_missing = (n_bytes - len(self.keystream))
+        if (n_missing <= 0):
+            return
+        n_blocks = -(-n_missing // BLOCK_SIZE)
+        counters = b''.join(
+            ((self.counter + k) & 0xFFFFFFFFFFFFFFFF).to_bytes(BLOCK_SIZE, 'big')
+                for k in range(n_blocks))
+        self.counter = ((self.counter + n_blocks) & 0xFFFFFFFFFFFFFFFF)
+        # the counter blocks are independent, so encrypt them together
+        self.keystream += self.des.crypt_bytes(counters, self.des.enc_block)
+
+    def update(self, chunk: bytes) -> bytes:
+        '''
+        XORs chunk with the next bytes of the keystream.
+        @param chunk: bytes = next part of the message
+        @return the transformed chunk
+        '''
+        if (self.finalized):
+            raise ValueError('cipher context already finalized')
+        n = len(chunk)
+        self.precompute(n)
+        out = (int.from_bytes(chunk, 'big') ^ int.from_bytes(self.keystream[:n], 'big'))
+        del self.keystream[:n]
+        return out.to_bytes(n, 'big')
+
+    def finalize(self) -> bytes:
+        '''
+        Closes the stream.  Counter mode has nothing left to flush.
+        '''
+        if (self.finalized):
+            raise ValueError('cipher context already finalized')
+        self.finalized = True
+        self.keystream.clear()
+        return b''
+# end class CtrCipher
+
+
+def check_iv(iv: bytes) -> bytes:
+    '''
+    Checks an initialization vector or initial counter block.
+    @return iv as bytes
+    @raise ValueError if iv is missing or not one block
+    '''
+    if (iv is None):
+        raise ValueError('an initialization vector is needed to decrypt this mode')
+    if (BLOCK_SIZE != len(iv)):
+        raise ValueError(f'initialization vector must be {BLOCK_SIZE} bytes, but got {len(iv)}')
+    return bytes(iv)
+
+def encryptor(des: DES, mode: str=DEFAULT_MODE, iv: bytes=None):
+    '''
+    Creates a streaming encryption context.
+    @param des: DES = the DES instance providing the block functions
+    @param mode: str = one of ECB, CBC, CTR
+    @param iv: bytes = initialization vector or initial counter block
+        (ignored for ECB, random by default)
+    '''
+    if (ECB==mode):
+        return EcbEncryptor(des)
+    if (CBC==mode):
+        return CbcEncryptor(des, iv)
+    if (CTR==mode):
+        return CtrCipher(des, iv)
+    raise ValueError(f'unknown mode of operation: {mode}')
+
+def decryptor(des: DES, mode: str=DEFAULT_MODE, iv: bytes=None):
+    '''
+    Creates a streaming decryption context.
+    @param iv: bytes = the initialization vector or initial counter
+        block used to encrypt (ignored for ECB)
+    @raise ValueError if iv is missing for CBC or CTR
+    '''
+    if (ECB==mode):
+        return EcbDecryptor(des)
+    if (CBC==mode):
+        return CbcDecryptor(des, iv)
+    if (CTR==mode):
+        # a random counter would decrypt to garbage
+        return CtrCipher(des, check_iv(iv))
+    raise ValueError(f'unknown mode of operation: {mode}')
@@ -1,24 +1,49 @@
 
 # standard libraries
 import socket
+from struct import Struct
 
 class Node:
     '''
     A simple socket node.
+
+    Messages are framed by a length header, so each recv returns
+    exactly one message sent by the peer, up to MAX_FRAME bytes, and
+    never merges two.  Reads fill a reusable buffer, so several small
+    messages arriving together cost a single syscall.
     '''
 
-    def __init__(self, addr: str, port: int, connect_func: "Callable[[Node], NoneType]", buffer_size=1024):
+    # header preceding each message: its length, big-endian unsigned
+    HEADER = Struct('!I')
+    # largest message accepted [in bytes]; the buffer grows only as
+    # data arrives, so a header alone never allocates more than this
+    MAX_FRAME = (64 << 20)
+    # a receive buffer grown beyond this size [in bytes] shrinks back
+    # to buffer_size once drained, so a large message does not pin its
+    # memory for the life of the connection
+    RBUF_SHRINK_SIZE = (256 << 10)
+
+    def __init__(self, addr: str, port: int, connect_func: "Callable[[Node], NoneType]", buffer_size=1024, conn: socket.socket=None):
         '''
         Allocates space for the socket node and initializes it.
         @param addr: str = address whereat to listen (without port)
         @param port: int = port of address whereat to listen
         @param buffer_size: int = default buffer size for receiving
                 messages
+        @param conn: socket = an already connected socket to use
+                instead of connecting (then connect_func is ignored)
         '''
         # store address, port and buffer size
         self.addr = addr
         self.port = port
         self.buffer_size = buffer_size
+        # start with an empty receive buffer
+        self.clear_recv_buffer()
+
+        # if already connected, use that socket
+        if (conn is not None):
+            self.s = self.conn = conn
+            return
 
         # create the stream socket to serve
         # using IPv4 or string hostnames
@@ -28,29 +53,119 @@ class Node:
 
     def send(self, msg_bytes: bytes):
         '''
-        Sends the message given by `msg_bytes` through the socket.
+        Sends the message given by `msg_bytes` through the socket as
+        one frame.
         @param msg_bytes: bytes = message to send
+        @raise FrameTooLarge if it is longer than MAX_FRAME
         '''
-        # delegate to the socket
-        self.conn.send(msg_bytes)
+        check_frame_len(len(msg_bytes))
+        # join header and message, so both go out in one segment
+        frame = b''.join((Node.HEADER.pack(len(msg_bytes)), msg_bytes))
+        # delegate to the socket, sending until all is written
+        self.conn.sendall(frame)
 
     def recv(self, buffer_size=None) -> bytes:
         '''
-        Receives a message from the socket.
-        @param buffer_size: int? = size of the receiving buffer
-        @return the message received
+        Receives the next message from the socket, blocking until it
+        has arrived completely.
+        @param buffer_size: int? = minimum size of each read from the
+                socket (the buffer grows to fit larger messages)
+        @return the message received (possibly empty), or None if the
+                peer closed the connection
+        @raise FrameTooLarge if the peer announces a message longer
+                than MAX_FRAME
         '''
         # if no buffer_size given, use the default
         if buffer_size is None:
             buffer_size = self.buffer_size
-        # delegate to the socket
-        msg_bytes = self.conn.recv(buffer_size)
+        # read until the header is buffered
+        if (not(self.fill(Node.HEADER.size, buffer_size))):
+            return None
+        msg_len, = Node.HEADER.unpack_from(self.rbuf, self.rstart)
+        # refuse before reading any of it
+        check_frame_len(msg_len)
+        frame_len = (Node.HEADER.size + msg_len)
+        # read until the whole message is buffered
+        if (not(self.fill(frame_len, buffer_size))):
+            raise ConnectionResetError('connection closed mid-message')
+        # copy the message out, since the buffer is reused
+        msg_start = (self.rstart + Node.HEADER.size)
+        msg_bytes = bytes(self.rbuf[msg_start:(msg_start + msg_len)])
+        self.rstart += frame_len
+        self.shrink_recv_buffer()
         # return the message
         return msg_bytes
 
+    def shrink_recv_buffer(self):
+        '''
+        Replaces a receive buffer grown beyond RBUF_SHRINK_SIZE by one
+        of buffer_size, if the unread bytes fit in it.
+        '''
+        n_unread = (self.rend - self.rstart)
+        if ((len(self.rbuf) <= max(Node.RBUF_SHRINK_SIZE, self.buffer_size))
+                or (n_unread > self.buffer_size)):
+            return
+        rbuf = bytearray(self.buffer_size)
+        rbuf[:n_unread] = self.rbuf[self.rstart:self.rend]
+        self.rbuf = rbuf
+        self.rstart, self.rend = 0, n_unread
+
+    def fill(self, n_bytes: int, buffer_size: int) -> bool:
+        '''
+        Reads from the socket until at least n_bytes are buffered.
+        @param n_bytes: int = number of unread bytes needed
+        @param buffer_size: int = minimum size of each read
+        @return whether they are buffered, False if the peer closed the
+                connection first
+        '''
+        while ((self.rend - self.rstart) < n_bytes):
+            n_buffered = (self.rend - self.rstart)
+            # move the unread bytes to the front
+            if (self.rstart > 0):
+                self.rbuf[:n_buffered] = self.rbuf[self.rstart:self.rend]
+                self.rstart, self.rend = 0, n_buffered
+            # grow the buffer for a full read, and at most double it
+            # towards the message, so its length is never trusted ahead
+            # of the data
+            capacity = max((n_buffered + buffer_size), min(n_bytes, (2 * n_buffered)))
+            if (len(self.rbuf) < capacity):
+                self.rbuf.extend(bytes(capacity - len(self.rbuf)))
+            # read as much as is available into the free space
+            with memoryview(self.rbuf) as view:
+                n_read = self.conn.recv_into(view[self.rend:])
+            if (n_read == 0):
+                return False
+            self.rend += n_read
+        # while ((self.rend - self.rstart) < n_bytes)
+        return True
+
+    def clear_recv_buffer(self):
+        '''
+        Discards any buffered bytes, as for a new connection.
+        '''
+        self.rbuf = bytearray(self.buffer_size)
+        # unread bytes are at self.rbuf[self.rstart:self.rend]
+        self.rstart = 0
+        self.rend = 0
+
     def close(self):
         '''
         Closes the backing socket.
         '''
         self.conn.close()
 # end class Node
+
+
+def check_frame_len(msg_len: int):
+    '''
+    @raise FrameTooLarge if msg_len is beyond Node.MAX_FRAME
+    '''
+    if (msg_len > Node.MAX_FRAME):
+        raise FrameTooLarge(f'frame of {msg_len} bytes exceeds {Node.MAX_FRAME}')
+
+
+class FrameTooLarge(ConnectionError):
+    '''
+    Thrown when a message is longer than Node.MAX_FRAME.  On receipt,
+    the stream can no longer be followed, so the connection is broken.
+    '''
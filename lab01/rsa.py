@@ -1,5 +1,9 @@
 import random
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from os import urandom, cpu_count
 from math import gcd
+from threading import Lock
 from collections import deque
 from itertools import chain
 import to_alpha
@@ -39,12 +43,32 @@ OUTGRAPH_LEN = 4
 
 # prepadding sequence, ZQKGZ, or character# 256
 PAD_PREFIX = (90, 81, 75, 71, 90)
+PAD_PREFIX_BYTES = bytes(PAD_PREFIX)
 # the ending of the padding to complete block size
 PAD_ENDING = tuple(range(ordA, (ordA + (BLOCK_SIZE*INGRAPH_LEN))))
 
 # number of rounds used for encoding
 N_CODEC_ROUNDS = 18
 
+# number of ciphertext letters decoded at a time while looking for the
+# ending sequence, in whole blocks
+DECODE_CHUNK_LEN = (64*BLOCK_SIZE*OUTGRAPH_LEN)
+
+# minimum number of blocks for the byte scheme to spread the blocks
+# over the process pool (None to disable)
+# The multigraph scheme stays serial: its multigraphs are too cheap to
+# pay for pickling, and its memo would not be shared by the workers.
+PARALLEL_MIN_BLOCKS = None
+# number of worker processes (None for the number of CPUs)
+PARALLEL_WORKERS = None
+# number of shards per worker, to balance the load
+SHARDS_PER_WORKER = 4
+# the process pool, kept warm across calls (None until first use), and
+# its number of workers
+process_pool = None
+process_pool_workers = None
+process_pool_lock = Lock()
+
 def main():
     # select the key
     n, e, d = selectKey()
@@ -66,54 +90,144 @@ def encode(n: int, e: int, msg: str) -> str:
     if (DEBUG_MODE):
         print()
         print('encode:')
-    # convert the mesage to ordinals
-    msg_ords = str2ords(msg)
-    # encode the message to alphabetic
-    alpha_msg = tuple(to_alpha.ords2alpha(msg_ords))
+    # encode the message to alphabetic, all at once
+    try:
+        alpha_msg = to_alpha.encode_alpha(msg)
+    except ValueError:
+        # characters whose escape letters do not fit in bytes
+        alpha_msg = tuple(to_alpha.ords2alpha(str2ords(msg)))
     # pad the message as necessary
     pad_alpha_msg = pad_block_msg(alpha_msg)
     if (DEBUG_MODE):
         print({'padded message in alpha': ords2str(pad_alpha_msg), 'len': len(pad_alpha_msg)})
-    # split message into blocks
-    msg_blocks = splitModIndex(pad_alpha_msg, (BLOCK_SIZE*INGRAPH_LEN))
-
-    # stores incoming output multigraphs
-    outgraphs_acc = []
-    for msg_block in msg_blocks:
-        # encode the current block
-        outgraphs = codec_block(n, e, msg_block, INGRAPH_LEN, OUTGRAPH_LEN)
-        # convert to ASCII strings
-        outgraph_chrs = ords2str(outgraphs)
-        # accumulate the output
-        outgraphs_acc.extend(outgraph_chrs)
-    # join the output into a string and return it
-    ciphertext = ''.join(outgraphs_acc)
+    # the blocks are whole multigraphs, so encode all multigraphs of
+    # all blocks at once
+    outgraphs = codec_multigraphs(n, e, pad_alpha_msg, INGRAPH_LEN, OUTGRAPH_LEN)
+    # the output is all letters, so convert it as ASCII
+    ciphertext = outgraphs.decode('ascii')
     return ciphertext
 
 def decode(n: int, d: int, msg: str) -> str:
     if (DEBUG_MODE):
         print()
         print('decode:')
-    # convert to ordinals
-    msg_ords = str2ords(msg)
-    # perform the decoding on the blocks
-    outgraphs = tuple(codec_block(n, d, msg_ords, OUTGRAPH_LEN, INGRAPH_LEN))
-    if (DEBUG_MODE):
-        print({'outgraphs from decode block': outgraphs})
-    # if there is an ending sequence, look for it and terminate the message there
+    # the ciphertext is all letters, so convert it as Latin-1
     try:
-        i_terminate = tupleindex(outgraphs, PAD_PREFIX)
-        outgraphs = outgraphs[:i_terminate]
-        if (DEBUG_MODE):
-            print({'outgraphs after terminate': outgraphs})
-    except ValueError as e:
-        pass
-    # convert from alpha to ords
-    plaintext_ords = (to_alpha.alpha2ords(outgraphs))
+        msg_ords = msg.encode('Latin-1')
+    except UnicodeEncodeError:
+        msg_ords = tuple(str2ords(msg))
+    # the output for each distinct multigraph, shared by all chunks
+    memo = {}
+    # the output not yet converted to the string, holding back any
+    # partial terminator at its end
+    outgraphs = bytearray()
+    decoder = to_alpha.AlphaDecoder()
+    plaintext_acc = []
+    # decode a chunk at a time, so the decoding stops at the first
+    # ending sequence, ZQKGZ, if there is one
+    for i_chunk in range(0, len(msg_ords), DECODE_CHUNK_LEN):
+        outgraphs += codec_multigraphs(n, d, msg_ords[i_chunk:(i_chunk + DECODE_CHUNK_LEN)],
+            OUTGRAPH_LEN, INGRAPH_LEN, memo)
+        # only the held back letters were searched before
+        i_terminate = outgraphs.find(PAD_PREFIX_BYTES)
+        if (i_terminate >= 0):
+            del outgraphs[i_terminate:]
+            break
+        # the last letters may begin the ending sequence
+        n_hold = (len(PAD_PREFIX_BYTES) - 1)
+        plaintext_acc.append(decoder.update(outgraphs[:-n_hold]))
+        del outgraphs[:-n_hold]
+    # end for i_chunk in range(0, len(msg_ords), DECODE_CHUNK_LEN)
+    if (DEBUG_MODE):
+        print({'outgraphs after terminate': outgraphs})
+    # convert the rest from alpha to the string
+    plaintext_acc.append(decoder.update(outgraphs))
+    plaintext_acc.append(decoder.finalize())
     # join the output into a string and return it
-    plaintext_str = ords2str(plaintext_ords)
+    plaintext_str = ''.join(plaintext_acc)
     return plaintext_str
 
+def split_shards(msg: 'Sequence', unit_len: int, n_workers: int) -> 'list[Sequence]':
+    '''
+    Splits msg into a few shards for each worker in the process pool,
+    each a whole number of units.
+    @param unit_len: int = size of the units that must not be split
+    @param n_workers: int = number of workers in the process pool
+    '''
+    n_shards = (n_workers * SHARDS_PER_WORKER)
+    shard_len = (-(-len(msg) // (n_shards * unit_len)) * unit_len)
+    return [msg[k:(k + shard_len)] for k in range(0, len(msg), max(shard_len, 1))]
+
+def pool() -> ProcessPoolExecutor:
+    '''
+    Starts the process pool on first use, with PARALLEL_WORKERS
+    workers, or one for each CPU.
+    '''
+    global process_pool, process_pool_workers
+    with process_pool_lock:
+        if (process_pool is None):
+            process_pool_workers = (PARALLEL_WORKERS or cpu_count() or 1)
+            process_pool = ProcessPoolExecutor(max_workers=process_pool_workers)
+        return process_pool
+
+def shutdown_pool():
+    '''
+    Stops the process pool, if started.
+    '''
+    global process_pool
+    with process_pool_lock:
+        if (process_pool is not None):
+            process_pool.shutdown()
+            process_pool = None
+
+def codec_multigraphs(n: int, k: int, letters: 'Sequence[int]', ingraph_len: int, outgraph_len: int, memo: dict=None) -> bytes:
+    '''
+    Encodes or decodes all multigraphs of a message in one pass, with
+    the same output as codec_block.
+    @param n: int = the modulus
+    @param k: int = the exponent (public or private key)
+    @param letters = letter ordinals, split into multigraphs of
+        ingraph_len letters
+    @param outgraph_len: int = minimum letters per output multigraph
+    @param memo: dict = the output for each input multigraph, to share
+        between calls with the same key
+    @return the ordinals of the output letters
+    '''
+    # codec_multigraph only uses the low N_CODEC_ROUNDS bits of k
+    k &= ((1 << N_CODEC_ROUNDS) - 1)
+    # the output for each distinct input multigraph
+    outgraphs = ({} if (memo is None) else memo)
+    outgraphs_acc = []
+    for i in range(0, len(letters), ingraph_len):
+        ingraph = letters[i:(i + ingraph_len)]
+        outgraph = outgraphs.get(ingraph)
+        if (outgraph is None):
+            # find the multigraph code, as in polysubs
+            code = 0
+            for c in ingraph:
+                code = ((code * lenAZ) + (c - ordA))
+            outgraph = outgraphs[ingraph] = code2letters(pow(code, k, n), outgraph_len)
+        outgraphs_acc.append(outgraph)
+    return b''.join(outgraphs_acc)
+
+def code2letters(code: int, min_len: int) -> bytes:
+    '''
+    Converts a multigraph code to its letters, as in polyunsubs.
+    @param code: int = the multigraph code
+    @param min_len: int = minimum number of letters
+    @return the ordinals of the letters
+    '''
+    # letters in ascending order of significance
+    letters = bytearray()
+    while (code):
+        code, r = divmod(code, lenAZ)
+        letters.append(r + ordA)
+    # pad with zeros, or 'A'
+    if (len(letters) < min_len):
+        letters.extend(bytes([ordA]) * (min_len - len(letters)))
+    letters.reverse()
+    return bytes(letters)
+
 def codec_block(n: int, k: int, block, ingraph_len, outgraph_len) -> str:
     # split block into letter codes
     letter_codes = tuple((c - ordA) for c in block)
@@ -220,14 +334,15 @@ def pad_block_msg(block_msg):
     if (0==r):
         return block_msg
 
-    # add the sequence to mark the end of the string
-    padded = (block_msg + PAD_PREFIX)
+    # add the sequence to mark the end of the string (as the same
+    # type, bytes or tuple)
+    padded = (block_msg + type(block_msg)(PAD_PREFIX))
 
     # update the modulus
     msg_len = len(padded)
     _, r = divmod(msg_len, (BLOCK_SIZE*INGRAPH_LEN))
     # add the padding endding
-    padded = (padded + PAD_ENDING[r:])
+    padded = (padded + type(padded)(PAD_ENDING[r:]))
 
     return padded
 
@@ -336,21 +451,374 @@ def tupleindex(a_tuple, subtuple):
             return k
     raise ValueError('subtuple not found')
 
-# named tuple to store public key data
-RsaKey = namedtuple('RsaKey', tuple('nk'))
+# named tuple to store the Chinese remainder theorem form of a private
+# key: the primes, the exponent modulo each prime less 1, and the
+# inverse of q modulo p
+RsaCrt = namedtuple('RsaCrt', ('p', 'q', 'dp', 'dq', 'qinv'))
+
+class RsaKey(namedtuple('RsaKey', tuple('nk'))):
+    '''
+    Named tuple to store key data, (n, k).  A private key may also carry
+    its CRT form in the crt attribute, which is used for the private-key
+    operations.  Unpacking still gives only (n, k), as legacy encode and
+    decode take.
+    '''
+
+    def __new__(cls, n: int, k: int, crt: RsaCrt=None):
+        self = super().__new__(cls, n, k)
+        self.crt = crt
+        return self
+# end class RsaKey
 
 # functions used to convert between strings, keys
 def str2key(string):
-    return RsaKey(*ints(string.split(',')))
+    # a private key may be followed by its CRT form
+    n, k, *crt = ints(string.split(','))
+    return RsaKey(n, k, (RsaCrt(*crt) if (crt) else None))
 
 def ints(strs):
     return tuple(int(k) for k in strs)
 
 def split_key_pair(pair):
-    return (RsaKey(*pair[:2]), RsaKey(*pair[::2]))
+    # pair is (n, e, d), optionally followed by the primes (p, q)
+    n, e, d, *pq = pair
+    return (RsaKey(n, e), RsaKey(n, d, (crt_form(d, *pq) if (pq) else None)))
 
 def key2str(rsaKey):
-    return (','.join(str(f) for f in rsaKey))
+    fields = (rsaKey if (getattr(rsaKey, 'crt', None) is None)
+        else chain(rsaKey, rsaKey.crt))
+    return (','.join(str(f) for f in fields))
+
+
+#######################################################################
+# real-size keys
+#######################################################################
+
+# the usual public exponent, a Fermat prime
+PUBLIC_EXPONENT = 65537
+# number of Miller-Rabin rounds, each with a random base; a composite
+# passes each with probability at most 1/4
+MILLER_RABIN_ROUNDS = 40
+# small primes for trial division before Miller-Rabin
+SMALL_PRIMES = tuple(k for k in range(3, 1000)
+    if all((k % j) for j in range(3, (int(k**0.5) + 1), 2)))
+# the largest modulus for the alphabetic multigraph scheme, whose
+# output multigraphs hold codes below 26^OUTGRAPH_LEN
+LEGACY_MAX_N = (lenAZ**OUTGRAPH_LEN)
+# the byte scheme pads each block with EME-OAEP (RFC 8017, 7.1) using
+# SHA-256 and an empty label, so equal messages encrypt differently
+OAEP_HASH_SIZE = sha256().digest_size
+OAEP_LABEL_HASH = sha256(b'').digest()
+# bytes of each block taken by the padding
+OAEP_OVERHEAD = (2*OAEP_HASH_SIZE + 2)
+# signatures are EMSA-PKCS1-v1_5 (RFC 8017, 9.2) of the SHA-256 digest
+# of the whole message; this DER DigestInfo header precedes the digest
+SHA256_DIGEST_INFO = bytes.fromhex('3031300d060960864801650304020105000420')
+# separates the hexadecimal message from its signature in sign_message
+SIGNATURE_SEPARATOR = '.'
+
+# random numbers for key generation come from the operating system
+system_random = random.SystemRandom()
+
+def is_probable_prime(m: int, rounds: int=MILLER_RABIN_ROUNDS) -> bool:
+    '''
+    Tests m for primality by trial division by small primes, then the
+    Miller-Rabin test with random bases.
+    @param m: int = the number to test
+    @param rounds: int = number of Miller-Rabin rounds
+    @return False if m is composite, True if m is prime with
+        probability at least 1 - 4^-rounds
+    '''
+    if (m < 2):
+        return False
+    if (0==(m & 1)):
+        return (2==m)
+    for p in SMALL_PRIMES:
+        if (0==(m % p)):
+            return (p==m)
+    # write m - 1 = 2^s * t for odd t
+    s = ((m - 1) & -(m - 1)).bit_length() - 1
+    t = ((m - 1) >> s)
+    for _ in range(rounds):
+        x = pow(system_random.randrange(2, (m - 1)), t, m)
+        if (x in (1, (m - 1))):
+            continue
+        for _ in range(s - 1):
+            x = pow(x, 2, m)
+            if ((m - 1)==x):
+                break
+        else:
+            # no square root of 1 reached -1, so the base is a witness
+            return False
+    return True
+
+def random_prime(bits: int) -> int:
+    '''
+    Finds a random probable prime of exactly the given number of bits,
+    with the top 2 bits set, so the product of 2 such primes has twice
+    the bits.
+    @param bits: int = the size of the prime
+    '''
+    top = (0b11 << (bits - 2))
+    while True:
+        candidate = (system_random.getrandbits(bits) | top | 1)
+        if (is_probable_prime(candidate)):
+            return candidate
+
+def modinv(a: int, m: int) -> int:
+    '''
+    Finds the inverse of a modulo m.
+    @raise ValueError if a and m are not coprime
+    '''
+    return pow(a, -1, m)
+
+def crt_form(d: int, p: int, q: int) -> RsaCrt:
+    '''
+    Finds the CRT form of the private exponent d for the modulus p*q.
+    '''
+    return RsaCrt(p, q, (d % (p - 1)), (d % (q - 1)), modinv(q, p))
+
+def generate_key_pair(bits: int, e: int=PUBLIC_EXPONENT) -> 'tuple[RsaKey, RsaKey]':
+    '''
+    Generates a key pair with a modulus of the given number of bits from
+    2 random probable primes.  The private key carries its CRT form.
+    @param bits: int = size of the modulus, e.g. 1024 to 3072
+    @param e: int = the public exponent
+    @return (public key, private key)
+    '''
+    while True:
+        p = random_prime(bits - (bits // 2))
+        q = random_prime(bits // 2)
+        # e must be invertible modulo both p - 1 and q - 1
+        if ((p==q) or (1 != gcd(e, (p - 1))) or (1 != gcd(e, (q - 1)))):
+            continue
+        n = (p*q)
+        d = modinv(e, ((p - 1)*(q - 1)))
+        return (RsaKey(n, e), RsaKey(n, d, crt_form(d, p, q)))
+    # end while True
+
+def key_pow(key: RsaKey, x: int) -> int:
+    '''
+    Raises x to the key exponent modulo n.  If the key carries its CRT
+    form, the exponentiation is done modulo each prime with the half
+    size exponents, and the results are recombined (Garner's formula).
+    '''
+    crt = getattr(key, 'crt', None)
+    if (crt is None):
+        return pow(x, key.k, key.n)
+    mp = pow(x, crt.dp, crt.p)
+    mq = pow(x, crt.dq, crt.q)
+    h = ((crt.qinv * (mp - mq)) % crt.p)
+    return (mq + (h * crt.q))
+
+def block_sizes(n: int) -> 'tuple[int, int]':
+    '''
+    Finds the byte block sizes for the modulus n.
+    @return the number of message bytes in each block, after the OAEP
+        padding, and the size of ciphertext blocks, which hold any
+        number below n
+    '''
+    out_size = ((n.bit_length() + 7) // 8)
+    return ((out_size - OAEP_OVERHEAD), out_size)
+
+def mgf1(seed: bytes, length: int) -> bytes:
+    '''
+    The mask generation function MGF1 with SHA-256 (RFC 8017, B.2.1).
+    @return length bytes of mask
+    '''
+    n_hashes = -(-length // OAEP_HASH_SIZE)
+    return b''.join(sha256(seed + k.to_bytes(4, 'big')).digest()
+        for k in range(n_hashes))[:length]
+
+def xor_bytes(a: bytes, b: bytes) -> bytes:
+    '''
+    @return a XOR b, for a and b of the same length
+    '''
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
+
+def oaep_pad(block: bytes, k: int) -> bytes:
+    '''
+    Pads a block with EME-OAEP under a random seed (RFC 8017, 7.1.1).
+    @param block: bytes = at most k - OAEP_OVERHEAD bytes
+    @param k: int = size of the padded block
+    @return the padded block, whose leading 0 byte keeps it below n
+    '''
+    db = b''.join((OAEP_LABEL_HASH, bytes(k - len(block) - OAEP_OVERHEAD), b'\x01', block))
+    seed = urandom(OAEP_HASH_SIZE)
+    masked_db = xor_bytes(db, mgf1(seed, len(db)))
+    masked_seed = xor_bytes(seed, mgf1(masked_db, OAEP_HASH_SIZE))
+    return b''.join((b'\0', masked_seed, masked_db))
+
+def oaep_unpad(padded: bytes) -> bytes:
+    '''
+    Removes the EME-OAEP padding of a block (RFC 8017, 7.1.2).
+    @return the block
+    @raise ValueError if the padding is wrong, with one message for
+        every cause
+    '''
+    masked_seed = padded[1:(1 + OAEP_HASH_SIZE)]
+    masked_db = padded[(1 + OAEP_HASH_SIZE):]
+    seed = xor_bytes(masked_seed, mgf1(masked_db, OAEP_HASH_SIZE))
+    db = xor_bytes(masked_db, mgf1(seed, len(masked_db)))
+    # the label hash, then 0 bytes up to a 1 byte
+    separator = db.find(b'\x01', OAEP_HASH_SIZE)
+    if ((0 != padded[0]) or (db[:OAEP_HASH_SIZE] != OAEP_LABEL_HASH) or (separator < 0)
+            or any(db[OAEP_HASH_SIZE:separator])):
+        raise ValueError('block does not decode with this key')
+    return db[(separator + 1):]
+
+def encode_bytes(key: RsaKey, msg: bytes) -> bytes:
+    '''
+    Encodes msg with the key in byte blocks, each padded with OAEP, so
+    the ciphertext is randomized.  The blocks are not tied together, so
+    this is no signature: use sign with a private key.
+    @param key: RsaKey = public key to encrypt
+    @param msg: bytes = the message
+    @return the ciphertext
+    '''
+    in_size, out_size = block_sizes(key.n)
+    if (in_size < 1):
+        raise ValueError(f'modulus {key.n} is too small for OAEP blocks')
+    # at least one block, so the empty message is padded too
+    padded = b''.join(oaep_pad(msg[k:(k + in_size)], out_size)
+        for k in range(0, max(len(msg), 1), in_size))
+    return crypt_blocks(key, padded, out_size, out_size)
+
+def decode_bytes(key: RsaKey, msg: bytes) -> bytes:
+    '''
+    Decodes a ciphertext from encode_bytes with the key.
+    @param key: RsaKey = private key to decrypt
+    @param msg: bytes = the ciphertext
+    @return the message
+    @raise ValueError if msg was not encoded with the other key
+    '''
+    in_size, out_size = block_sizes(key.n)
+    if ((0==len(msg)) or (len(msg) % out_size)):
+        raise ValueError('ciphertext is not a whole number of blocks')
+    try:
+        padded = crypt_blocks(key, msg, out_size, out_size)
+    except OverflowError as e:
+        raise ValueError('block does not decode with this key') from e
+    return b''.join(oaep_unpad(padded[k:(k + out_size)])
+        for k in range(0, len(padded), out_size))
+
+def crypt_blocks(key: RsaKey, msg: bytes, in_size: int, out_size: int) -> bytes:
+    '''
+    Transforms each block of msg with key_pow, as key_pow_blocks, in
+    the process pool if there are at least PARALLEL_MIN_BLOCKS blocks.
+    '''
+    if ((PARALLEL_MIN_BLOCKS is None) or ((len(msg) // in_size) < PARALLEL_MIN_BLOCKS)):
+        return key_pow_blocks(key, msg, in_size, out_size)
+    executor = pool()
+    shards = split_shards(msg, in_size, process_pool_workers)
+    m = len(shards)
+    # map keeps the shards in order
+    return b''.join(executor.map(key_pow_blocks,
+        ([key] * m), shards, ([in_size] * m), ([out_size] * m)))
+
+def key_pow_blocks(key: RsaKey, msg: bytes, in_size: int, out_size: int) -> bytes:
+    '''
+    Transforms each block of msg with key_pow.
+    @param in_size: int = size of the blocks of msg
+    @param out_size: int = size of the output blocks
+    @raise OverflowError if an output does not fit out_size
+    '''
+    return b''.join(
+        key_pow(key, int.from_bytes(msg[k:(k + in_size)], 'big')).to_bytes(out_size, 'big')
+            for k in range(0, len(msg), in_size))
+
+def encrypt(key: RsaKey, msg: str) -> str:
+    '''
+    Encodes msg with the key, in the scheme fitting its modulus: the
+    alphabetic multigraphs of encode for legacy keys, or OAEP padded
+    byte blocks of the UTF-8 message otherwise.  Either ciphertext has
+    no '|', so it can be sent among other fields.  Only the byte scheme
+    is randomized: the legacy scheme is textbook RSA on toy keys, so
+    neither hides equal messages nor resists forgery.  Neither is a
+    signature: use sign_message.
+    @param key: RsaKey = public key to encrypt
+    @param msg: str = the message
+    @return the ciphertext, in letters or hexadecimal
+    '''
+    if (key.n <= LEGACY_MAX_N):
+        return encode(key.n, key.k, msg)
+    return encode_bytes(key, msg.encode('utf-8')).hex()
+
+def decrypt(key: RsaKey, msg: str) -> str:
+    '''
+    Decodes a ciphertext from encrypt with the key.
+    @param key: RsaKey = private key to decrypt
+    @param msg: str = the ciphertext
+    @return the message
+    '''
+    if (key.n <= LEGACY_MAX_N):
+        return decode(key.n, key.k, msg)
+    return decode_bytes(key, bytes.fromhex(msg)).decode('utf-8')
+
+def pkcs1_v15_digest(msg: bytes, size: int) -> bytes:
+    '''
+    Encodes the SHA-256 digest of msg as EMSA-PKCS1-v1_5.
+    @param size: int = size of the modulus in bytes
+    @return 0x00 0x01 0xFF..0xFF 0x00 DigestInfo digest, of size bytes
+    @raise ValueError if the modulus is too small
+    '''
+    digest_info = (SHA256_DIGEST_INFO + sha256(msg).digest())
+    # at least 8 bytes of 0xFF
+    n_ff = (size - len(digest_info) - 3)
+    if (n_ff < 8):
+        raise ValueError(f'a modulus of {size} bytes is too small for SHA-256 signatures')
+    return b''.join((b'\0\x01', (b'\xff' * n_ff), b'\0', digest_info))
+
+def sign(key: RsaKey, msg: bytes) -> bytes:
+    '''
+    Signs the SHA-256 digest of the whole message (RSASSA-PKCS1-v1_5).
+    @param key: RsaKey = private key
+    @param msg: bytes = the message
+    @return the signature, of the size of the modulus
+    '''
+    size = block_sizes(key.n)[1]
+    encoded = int.from_bytes(pkcs1_v15_digest(msg, size), 'big')
+    return key_pow(key, encoded).to_bytes(size, 'big')
+
+def verify(key: RsaKey, msg: bytes, signature: bytes):
+    '''
+    Verifies a signature from sign.
+    @param key: RsaKey = public key
+    @param msg: bytes = the message as signed
+    @param signature: bytes = the signature
+    @raise ValueError if the signature is not of msg by the other key
+    '''
+    size = block_sizes(key.n)[1]
+    s = int.from_bytes(signature, 'big')
+    if ((size != len(signature)) or (s >= key.n)
+            or (key_pow(key, s).to_bytes(size, 'big') != pkcs1_v15_digest(msg, size))):
+        raise ValueError('signature does not verify with this key')
+
+def sign_message(key: RsaKey, msg: str) -> str:
+    '''
+    Signs msg, and joins it to the signature.  Both are in
+    hexadecimal, so the result has no '|', and can be sent among other
+    fields.
+    @param key: RsaKey = private key
+    @param msg: str = the message
+    @return the message and its signature
+    '''
+    msg_bytes = msg.encode('utf-8')
+    return f'{msg_bytes.hex()}{SIGNATURE_SEPARATOR}{sign(key, msg_bytes).hex()}'
+
+def verify_message(key: RsaKey, signed_msg: str) -> str:
+    '''
+    Verifies a message signed by sign_message.
+    @param key: RsaKey = public key
+    @param signed_msg: str = the message and its signature
+    @return the message
+    @raise ValueError if signed_msg is malformed, or its signature is
+        not of the message by the other key
+    '''
+    msg_hex, _, signature_hex = signed_msg.partition(SIGNATURE_SEPARATOR)
+    msg_bytes = bytes.fromhex(msg_hex)
+    verify(key, msg_bytes, bytes.fromhex(signature_hex))
+    return msg_bytes.decode('utf-8')
 
 # run the REPL test
 if __name__ == '__main__':
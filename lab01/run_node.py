@@ -2,6 +2,8 @@
 # standard libraries
 import json
 import logging
+import os
+import tempfile
 import traceback
 from sys import stderr
 from _thread import start_new_thread
@@ -11,7 +13,7 @@ import csv
 
 
 # local library crypto
-from crypto import KeyManager, DES, CharacterEncoder, bit2hex
+from crypto import KeyManager, DES, TripleDES, CharacterEncoder, bit2hex
 from node import Node
 from hmac import SimpleHmacEncoder, UnexpectedMac
 
@@ -46,11 +48,55 @@ ENC_FILE, MAC_FILE, CA_FILE = (
     config['node'][key] for key in 'enc_key_file, mac_key_file, ca_key_file'.split(', '))
 # load string that ends the input stream
 SENTINEL = config['node']['sentinel']
+# load the MAC mode, simple or rfc2104
+HMAC_MODE = config['node']['hmac_mode']
 
-# get the certificate authority public key
-with open(CA_FILE, newline='') as csvfile:
-    inr = csv.reader(csvfile, delimiter=',')
-    ca_key = rsa.ints(tuple(inr)[0])
+# ciphers available for session keys
+SESSION_CIPHERS = {'DES': DES, 'TripleDES': TripleDES}
+# load the cipher used for session keys
+SessionCipher = SESSION_CIPHERS[config['node']['session_cipher']]
+
+# load the size above which DES uses the process pool, and its size
+DES.PARALLEL_MIN_BYTES, DES.PARALLEL_WORKERS = (
+    config['node'][key] for key in 'des_parallel_min_bytes, des_parallel_workers'.split(', '))
+# likewise for RSA, in blocks of the byte scheme
+rsa.PARALLEL_MIN_BLOCKS, rsa.PARALLEL_WORKERS = (
+    config['node'][key] for key in 'rsa_parallel_min_blocks, rsa_parallel_workers'.split(', '))
+
+# load the size of the certificate authority modulus
+CA_KEY_BITS = config['node']['ca_key_bits']
+
+
+def load_ca_key(ca_file: str, key_bits: int) -> 'tuple[int]':
+    '''
+    Reads the certificate authority key pair, generating it on the
+    first run, so the private key is never part of the repository.
+    @param ca_file: str = the key file, holding n,e,d,p,q
+    @param key_bits: int = size of the modulus if generated
+    @return (n, e, d, p, q), or (n, e, d) for a legacy key file
+    '''
+    if (not(os.path.exists(ca_file))):
+        PK, SK = rsa.generate_key_pair(key_bits)
+        # write a private temporary file, and link it into place, so
+        # nodes starting together all use the first key created
+        with tempfile.NamedTemporaryFile('w', dir=(os.path.dirname(ca_file) or '.'),
+                prefix=f'{os.path.basename(ca_file)}.', suffix='.tmp', delete=False) as f:
+            f.write(','.join(str(k) for k in (SK.n, PK.k, SK.k, SK.crt.p, SK.crt.q)))
+        try:
+            os.link(f.name, ca_file)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(f.name)
+    # end if (not(os.path.exists(ca_file)))
+    with open(ca_file, newline='') as csvfile:
+        inr = csv.reader(csvfile, delimiter=',')
+        return rsa.ints(tuple(inr)[0])
+# end def load_ca_key(ca_file: str, key_bits: int)
+
+
+# get the certificate authority key pair
+ca_key = load_ca_key(CA_FILE, CA_KEY_BITS)
 PKca, SKca = rsa.split_key_pair(ca_key)
 
 # Python uses Latin-1 for Pickles, so it's good enough to encode keys
@@ -63,9 +109,11 @@ def receiveThread(node, des, decode, prompt):
         try:
             # read in from the node
             msg_bytes = node.recv()
-            # if empty message, skip
-            if (len(msg_bytes) <= 0):
-                continue
+            # if no message, the peer closed the connection
+            if (msg_bytes is None):
+                print(file=stderr)
+                logging.info('Connection closed by peer.')
+                break
             # ignore any illegal bytes
             msg_bytes = bytes(b for b in msg_bytes if b in range(256))
             # decrypt the message
@@ -91,6 +139,11 @@ def receiveThread(node, des, decode, prompt):
             # print new prompt
             print(file=stderr)
             print(file=stderr, end=prompt, flush=True)
+        except ConnectionError as e:
+            # the stream is broken, so stop
+            print(file=stderr)
+            logging.error(e)
+            break
         except Exception as e:
             tb = traceback.format_exc()
             # don't repeat the trackback
@@ -124,9 +177,9 @@ def main(connecting_status: str, node_init: 'Callable[[addr, port], Node]', addr
     node = node_init(addr, port)
     # read in the key word for encryption
     enc_key = KeyManager.read_key(ENC_FILE)
-    # generate the DES key for encryption
+    # find the DES key for encryption
     # and reverse key for decryption
-    des = DES(enc_key)
+    des = DES.for_key(enc_key)
     # encrypt and send user input, decrypt messages received
     run_node(node, des, charset, prompt)
     # close the node
@@ -148,7 +201,7 @@ def run_node(node: Node, des: DES, charset: str, prompt: str):
     # use the given charset
     charEncoder = CharacterEncoder(charset)
     # and use HMAC charset
-    serverEncoder = SimpleHmacEncoder(charEncoder, mac_key)
+    serverEncoder = SimpleHmacEncoder(charEncoder, mac_key, HMAC_MODE)
     # fetch decode
     decode = serverEncoder.decode
 
@@ -165,7 +218,7 @@ def run_node(node: Node, des: DES, charset: str, prompt: str):
         
         # TODO: your code here
         # encryption
-        cyp_bytes = des.encrypt(msg_string, encode=serverEncoder.encode)
+        cyp_bytes = des.encrypt_into(msg_string, encode=serverEncoder.encode)
         # send the message
         logging.info(f'Sending cypher: {cyp_bytes}')
         node.send(cyp_bytes)
@@ -174,10 +227,10 @@ def run_node(node: Node, des: DES, charset: str, prompt: str):
 
 
 def recv_blocking(node: Node) -> bytes:
-    # initialize empty to start the loop
-    msg_bytes = bytes()
-    # read in from node until bytes are read
-    while (not(msg_bytes)):
-        msg_bytes = node.recv()
+    # recv blocks until a whole message is read
+    msg_bytes = node.recv()
+    # so None means the peer closed the connection
+    if (msg_bytes is None):
+        raise ConnectionResetError('connection closed by peer')
     return msg_bytes
 # end def recv_blocking(node: Node) -> bytes
\ No newline at end of file
@@ -1,3 +1,12 @@
+# standard libraries
+import logging
+import socket
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from sys import stderr
+from threading import BoundedSemaphore, Lock
+
 from node import Node
 
 class Server:
@@ -36,6 +45,8 @@ class Server:
     def acceptNextConnectionOnNode(node: Node):
         # store the connected socket and update the address
         node.conn, node.addr = node.s.accept()
+        # drop anything left over from the previous connection
+        node.clear_recv_buffer()
 
     def send(self, msg_bytes: bytes):
         '''
@@ -49,7 +60,8 @@ class Server:
         '''
         Receives a message from the socket.
         @param buffer_size: int? = size of the receiving buffer
-        @return the message received
+        @return the message received, or None if the peer closed the
+                connection
         '''
         # delegate to the node
         msg_bytes = self.node.recv(buffer_size)
@@ -64,3 +76,119 @@ class Server:
 # end class Server
 
 
+
+
+class PoolServer:
+    '''
+    A socket server that accepts connections continuously and serves
+    each on a bounded pool of worker threads, so one slow client does
+    not hold up the others.
+    '''
+
+    def __init__(self, addr: str, port: int, handler: 'Callable[[Node], NoneType]', max_workers: int, backlog: int, buffer_size=1024):
+        '''
+        Allocates space for the socket server and starts listening.
+        Call serve_forever to accept connections.
+        @param addr: str = address whereat to listen (without port)
+        @param port: int = port of address whereat to listen (0 for any,
+                then self.port is the one chosen)
+        @param handler = called on a worker with the Node of each
+                connection; the node is closed after it returns
+        @param max_workers: int = maximum number of connections served
+                at once
+        @param backlog: int = maximum number of connections accepted
+                and waiting for a worker (more wait unaccepted)
+        @param buffer_size: int = default buffer size for receiving
+                messages
+        '''
+        self.handler = handler
+        self.buffer_size = buffer_size
+        # create the listening node
+        self.node = Node(addr, port,
+            (lambda node: PoolServer.bindListen(node, backlog)), buffer_size)
+        self.port = self.node.s.getsockname()[1]
+        # the workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        # a slot for each connection being served or waiting
+        self.slots = BoundedSemaphore(max_workers + backlog)
+        # count the exchanges for throughput
+        self.lock = Lock()
+        self.n_completed = 0
+        self.n_failed = 0
+        # the throughput is measured from the first connection accepted
+        self.start_time = None
+
+    @staticmethod
+    def bindListen(node: Node, backlog: int):
+        # bind it to the address whereat to listen
+        node.s.bind((node.addr, node.port))
+        # start listening, with room for the backlog in the kernel too
+        node.s.listen(backlog)
+
+    def serve_forever(self):
+        '''
+        Accepts connections until the server is closed, submitting each
+        to the workers.
+        '''
+        while True:
+            # wait for a free slot before accepting
+            self.slots.acquire()
+            try:
+                conn, addr = self.node.s.accept()
+            except OSError:
+                # the listening socket was closed
+                self.slots.release()
+                return
+            if (self.start_time is None):
+                self.start_time = time.perf_counter()
+            client = Node(addr[0], addr[1], None, self.buffer_size, conn)
+            self.executor.submit(self.serve_connection, client)
+        # end while True
+
+    def serve_connection(self, client: Node):
+        '''
+        Serves one connection with the handler, and counts it.
+        '''
+        try:
+            self.handler(client)
+            with self.lock:
+                self.n_completed += 1
+            logging.info(f'{self.n_completed} exchanges completed,'
+                f' {self.throughput():.3g} per second')
+        except Exception:
+            with self.lock:
+                self.n_failed += 1
+            print(file=stderr)
+            logging.error(traceback.format_exc())
+        finally:
+            client.close()
+            self.slots.release()
+
+    def throughput(self) -> float:
+        '''
+        @return the completed exchanges per second since the first
+            connection was accepted, or 0.0 before then
+        '''
+        if (self.start_time is None):
+            return 0.0
+        return (self.n_completed / (time.perf_counter() - self.start_time))
+
+    def stats(self) -> 'dict[str, float]':
+        '''
+        @return the completed and failed exchange counts and throughput
+        '''
+        return { 'completed': self.n_completed, 'failed': self.n_failed,
+            'per_second': self.throughput() }
+
+    def close(self):
+        '''
+        Stops accepting connections, and lets the workers finish.
+        '''
+        # shutting down wakes a thread blocked in accept
+        try:
+            self.node.s.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.node.s.close()
+        self.executor.shutdown(wait=False)
+# end class PoolServer
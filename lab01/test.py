@@ -1,6 +1,33 @@
 
 
-from crypto import bit2hex, hex2bit, bitize, debitize, permute, DES
+from crypto import bit2hex, hex2bit, bitize, debitize, permute, DES, TripleDES, CharacterEncoder, crypt_shard, worker_ciphers
+from hashlib import sha256
+import hmac
+from hmac import SimpleHmacEncoder, UnexpectedMac
+import modes
+import asyncio
+import socket
+from node import Node, FrameTooLarge
+from client import Client
+from server import PoolServer
+import threading
+from CertificateAuthority import KeyPairPool
+import rsa
+import to_alpha
+import itertools
+import time
+import contextlib
+import io
+from V_server import SessionManager
+from ticket import TICKET_EXPIRED, parse_ticket, ticket_cache, ReplayCache, ReplayedAuthenticator, check_authenticator
+from cache import ExpiringLruCache
+from async_node import AsyncServer, AsyncClient, offload
+import C_client
+import AS_TGS_server
+import run_node
+import os
+import tempfile
+import pickle
 
 # data used for tests
 byts = bytes.fromhex("0002000000000001")
@@ -26,6 +53,27 @@ def test_debitize():
     
     print("debitize tested")
 
+def test_bit_conversion() -> None:
+    long_byts = bytes(range(256)) * 4
+    long_bits = [((byt >> (7 - i)) & 1) for byt in long_byts for i in range(8)]
+    # both the table and the integer paths of bitize
+    for data, data_bits in ((byts, bits), (long_byts, long_bits)):
+        assert bitize(data) == data_bits
+        assert bitize(bytearray(data)) == data_bits
+        assert bitize(list(data)) == data_bits
+        # debitize accepts iterables without len()
+        assert debitize(iter(data_bits)) == data
+        assert debitize(b for b in data_bits) == data
+    assert bitize(b"") == []
+    assert debitize([]) == b""
+    assert bit2hex(hex2bit("00ff10")) == "00ff10"
+    try:
+        debitize([1, 0, 1])
+        assert False
+    except ValueError:
+        pass
+    print("bit_conversion tested")
+
 def test_permute():
 
     result_bits = permute(bits, DES.IP)
@@ -37,6 +85,20 @@ def test_permute():
 
     print("permute tested")
 
+def test_permutation() -> None:
+    from crypto import Permutation
+    for table, n in ((DES.IP, 64), (DES.KEY_DROP, 64), (DES.KEY_COMPRESSION, 56), (DES.D_EXPANSION, 32)):
+        permutation = Permutation(table, n)
+        in_bits = hex2bit("0123456789ABCDEF")[:n]
+        out_bits = permute(in_bits, table)
+        assert permutation.apply(in_bits) == out_bits
+        assert permutation.apply_int(int.from_bytes(debitize(in_bits), 'big')) == int.from_bytes(debitize(out_bits), 'big')
+        if (DES.BATCH_AVAILABLE):
+            import numpy
+            assert permutation.apply_numpy(numpy.array([in_bits] * 2, dtype=numpy.uint8)).tolist() == [out_bits] * 2
+    assert permute(bits, DES.IP) == DES.IP_PERM.apply(bits) == permuted_bits
+    print("permutation tested")
+
 def test_key_gen() -> None:
     key = bytes.fromhex('AABB09182736CCDD')
     key = bitize(key)
@@ -87,18 +149,802 @@ def test_decrypt() -> None:
     assert result == "Hello World     "
     print("decrypt tested")
 
+def test_engines() -> None:
+    key = bytes.fromhex("AABB09182736CCDD")
+    plaintext = bytes.fromhex("123456ABCD132536")
+    msg = "Hello World     "
+    for engine in (DES.ENGINE_BITS, DES.ENGINE_PACKED):
+        des = DES(key, engine)
+        assert bit2hex(des.enc_block(bitize(plaintext))).upper() == "C0B7A8D05F3A829C"
+        assert bit2hex(des.dec_block(hex2bit("C0B7A8D05F3A829C"))).upper() == "123456ABCD132536"
+        assert des.encrypt(msg).hex() == "d1a87d37f5b6bfe101ae4d6a4e1204d4"
+        assert des.decrypt(des.encrypt(msg)) == msg
+    print("engines tested")
+
+def test_f_impls() -> None:
+    key = bytes.fromhex("AABB09182736CCDD")
+    round_keys = DES.key_generation(bitize(key))
+    for k, R_hex in enumerate(("00000000", "FFFFFFFF", "0123ABCD", "89ABCDEF")):
+        R = hex2bit(R_hex)
+        assert DES.f_sp(R, round_keys[k]) == DES.f(R, round_keys[k])
+    for f_impl in (DES.F_SBOX, DES.F_SP):
+        des = DES(key, DES.ENGINE_BITS, f_impl=f_impl)
+        assert bit2hex(des.enc_block(hex2bit("123456ABCD132536"))).upper() == "C0B7A8D05F3A829C"
+    print("f_impls tested")
+
+def test_batch() -> None:
+    # batch mode is only available with NumPy
+    if (not(DES.BATCH_AVAILABLE)):
+        print("batch skipped")
+        return
+    key = bytes.fromhex("AABB09182736CCDD")
+    msg = bytes(range(256)) * 5
+    scalar = DES(key, batch=False)
+    batch = DES(key, batch=True)
+    cipher = scalar.crypt_bytes(msg, scalar.enc_block)
+    assert batch.crypt_bytes(msg, batch.enc_block) == cipher
+    assert batch.encrypt_many(msg) == cipher
+    assert batch.decrypt_many(cipher) == msg
+    assert batch.encrypt_many(b"Hello World     ").hex() == "d1a87d37f5b6bfe101ae4d6a4e1204d4"
+    print("batch tested")
+
+def test_for_key() -> None:
+    key = bytes.fromhex("AABB09182736CCDD")
+    DES.key_cache.clear()
+    des = DES.for_key(key)
+    assert DES.for_key(bytearray(key)) is des
+    assert DES.key_cache.stats()['hits'] == 1
+    assert DES.key_cache.stats()['misses'] == 1
+    assert des.encrypt("Hello World     ").hex() == "d1a87d37f5b6bfe101ae4d6a4e1204d4"
+    # the cache is bounded
+    for k in range(DES.KEY_CACHE_SIZE + 1):
+        DES.for_key(k.to_bytes(8, 'big'))
+    assert len(DES.key_cache) == DES.KEY_CACHE_SIZE
+    assert DES.for_key(key) is not des
+    print("for_key tested")
+
+def test_modes() -> None:
+    des = DES(bytes.fromhex("AABB09182736CCDD"))
+    msg = bytes(range(100))
+    iv = bytes.fromhex("0001020304050607")
+    def stream(context, data):
+        # feed the data in uneven chunks
+        return b''.join(context.update(data[k:(k + 7)]) for k in range(0, len(data), 7)) + context.finalize()
+    # ECB is the same as crypt_bytes
+    ecb = stream(modes.encryptor(des), msg)
+    assert ecb == des.crypt_bytes(msg, des.enc_block)
+    assert stream(modes.decryptor(des), ecb) == msg + bytes(4)
+    # CBC chains each block into the next
+    cbc = stream(modes.encryptor(des, modes.CBC, iv), msg)
+    chain = int.from_bytes(iv, 'big')
+    padded = msg + bytes(4)
+    for k in range(0, len(padded), 8):
+        chain = des.enc_int(int.from_bytes(padded[k:(k + 8)], 'big') ^ chain)
+        assert cbc[k:(k + 8)] == chain.to_bytes(8, 'big')
+    assert stream(modes.decryptor(des, modes.CBC, iv), cbc) == padded
+    # CTR needs no padding
+    ctr = stream(modes.encryptor(des, modes.CTR, iv), msg)
+    assert len(ctr) == len(msg)
+    assert ctr[:8] == bytes(a ^ b for a, b in zip(msg, des.crypt_bytes(iv, des.enc_block)))
+    assert stream(modes.decryptor(des, modes.CTR, iv), ctr) == msg
+    # decryption needs the iv of a chained mode, of one block
+    for mode, bad_iv in ((modes.CBC, None), (modes.CTR, None), (modes.CBC, iv[:4])):
+        try:
+            modes.decryptor(des, mode, bad_iv)
+            assert False
+        except ValueError:
+            pass
+    # the base streams are abstract
+    for base in (modes.BlockStream, modes.ChainedBlockStream):
+        try:
+            base(des)
+            assert False
+        except TypeError:
+            pass
+    print("modes tested")
+
+def test_triple_des() -> None:
+    K1, K2, K3 = (bytes.fromhex(k) for k in ("AABB09182736CCDD", "0123456789ABCDEF", "FEDCBA9876543210"))
+    msg = bytes(range(40))
+    def ede(keys):
+        des1, des2, des3 = (DES(k) for k in keys)
+        stage1 = des1.crypt_bytes(msg, des1.enc_block)
+        stage2 = des2.crypt_bytes(stage1, des2.dec_block)
+        return des3.crypt_bytes(stage2, des3.enc_block)
+    for raw_key, keys in (((K1 + K2 + K3), (K1, K2, K3)), ((K1 + K2), (K1, K2, K1))):
+        tdes = TripleDES(raw_key)
+        cipher = tdes.crypt_bytes(msg, tdes.enc_block)
+        assert cipher == ede(keys)
+        assert tdes.crypt_bytes(cipher, tdes.dec_block) == msg
+    # with K1 = K2 = K3, triple DES is single DES
+    assert TripleDES(K1*3).encrypt("Hello World     ").hex() == "d1a87d37f5b6bfe101ae4d6a4e1204d4"
+    print("triple_des tested")
+
+def test_parallel() -> None:
+    msg = bytes(range(256)) * 40
+    key = bytes.fromhex("AABB09182736CCDD0123456789ABCDEF")
+    DES.PARALLEL_WORKERS = 2
+    for des in (DES(key[:8]), DES(key[:8], batch=False), TripleDES(key)):
+        DES.PARALLEL_MIN_BYTES = None
+        cipher = des.crypt_bytes(msg, des.enc_block)
+        DES.PARALLEL_MIN_BYTES = 1024
+        try:
+            assert des.crypt_bytes(msg, des.enc_block) == cipher
+            assert des.crypt_bytes(cipher, des.dec_block) == msg
+        finally:
+            DES.PARALLEL_MIN_BYTES = None
+        # workers rebuild the cipher once from its key and settings
+        worker_ciphers.clear()
+        for k in range(2):
+            assert crypt_shard(type(des), des.worker_args, False, msg[:2048]) == cipher[:2048]
+        assert (worker_ciphers.misses, worker_ciphers.hits) == (1, 1)
+        assert len(pickle.dumps(des.worker_args)) < 100
+    assert DES._pool_workers == 2
+    DES.shutdown_pool()
+    DES.PARALLEL_WORKERS = None
+    print("parallel tested")
+
+def test_zero_copy() -> None:
+    des = DES(bytes.fromhex("AABB09182736CCDD"))
+    msg = "Hello World"
+    padded = b"Hello World\0\0\0\0\0"
+    cipher = des.crypt_bytes(padded, des.enc_block)
+    # unaligned input is padded on the fly, for each buffer type
+    for byts in (msg.encode(), bytearray(msg.encode()), memoryview(msg.encode())):
+        assert des.crypt_bytes(byts, des.enc_block) == cipher
+    # aligned bytearrays are encrypted in place
+    buffer = bytearray(padded)
+    assert des.crypt_into(buffer, des.enc_block, buffer) is buffer
+    assert buffer == cipher
+    # the HMAC encoder hands over its buffer for encryption in place
+    encoder = SimpleHmacEncoder(CharacterEncoder(), b"mac key")
+    complete_msg = des.encrypt_into(msg, encode=encoder.encode)
+    assert isinstance(complete_msg, bytearray)
+    assert complete_msg[:16] == cipher
+    # encrypt always gives bytes
+    for encode in (encoder.encode, CharacterEncoder().encode):
+        assert type(des.encrypt(msg, encode=encode)) is bytes
+    assert type(des.encrypt_into(msg)) is bytearray
+    assert des.decrypt(memoryview(complete_msg), decode=encoder.decode) == padded.decode()
+    print("zero_copy tested")
+
+def test_hmac_modes() -> None:
+    # RFC 4231 test case 1
+    encoder = SimpleHmacEncoder(CharacterEncoder(), bytes([0x0b]*20), hmac.MODE_RFC2104)
+    assert encoder.hmac(b"Hi There").hex() == "b0344c61d8db38535ca8afceaf0bf12b881dc200c9833da726e9376c2e32cff7"
+    # RFC 4231 test case 6, with a key longer than the block size
+    encoder = SimpleHmacEncoder(CharacterEncoder(), bytes([0xaa]*131), hmac.MODE_RFC2104)
+    assert encoder.hmac(b"Test Using Larger Than Block-Size Key - Hash Key First").hex() == "60e431591ee0b67f0d8a26aacbf5b77f8e0bc6213728c5140546040f0ee37f54"
+    # the simple mode is unchanged
+    encoder = SimpleHmacEncoder(CharacterEncoder(), b"key")
+    assert encoder.hmac(b"msg") == sha256(b"msgkey").digest()
+    # both modes round trip, and reject each other
+    simple, rfc = (SimpleHmacEncoder(CharacterEncoder(), b"key", mode) for mode in (hmac.MODE_SIMPLE, hmac.MODE_RFC2104))
+    for encoder, other in ((simple, rfc), (rfc, simple)):
+        complete_msg = encoder.encode("Hello World     ")
+        assert encoder.decode(complete_msg) == "Hello World     "
+        try:
+            other.decode(complete_msg)
+            assert False
+        except UnexpectedMac:
+            pass
+    # MACs compare as whole digests
+    assert hmac.compare_digest(b"mac", bytearray(b"mac"))
+    assert not hmac.compare_digest(b"mac", b"ma")
+    assert not hmac.compare_digest(b"mac", b"mad")
+    print("hmac_modes tested")
+
+def test_framing() -> None:
+    sender, receiver = (Node("", 0, None, 16, conn) for conn in socket.socketpair())
+    # a message larger than the buffer (but not the socket buffer),
+    # and several sent back to back
+    large = bytes(range(256)) * 100
+    small = [f"message {i}".encode() for i in range(5)]
+    sender.send(large)
+    for msg in small:
+        sender.send(msg)
+    sender.send(b"")
+    assert receiver.recv() == large
+    assert [receiver.recv() for msg in small] == small
+    # an empty message is not the end of stream
+    assert receiver.recv() == b""
+    sender.close()
+    assert receiver.recv() is None
+    receiver.close()
+    # a header announcing more than MAX_FRAME is refused before any
+    # allocation, and so is sending it
+    sender, receiver = (Node("", 0, None, 16, conn) for conn in socket.socketpair())
+    sender.conn.sendall(Node.HEADER.pack(0xFFFFFFFF))
+    try:
+        receiver.recv()
+        assert False
+    except FrameTooLarge:
+        pass
+    assert len(receiver.rbuf) <= 32
+    try:
+        sender.send(bytes(Node.MAX_FRAME + 1))
+        assert False
+    except FrameTooLarge:
+        pass
+    sender.close()
+    receiver.close()
+    # the buffer grows only as the message arrives, not to its header
+    sender, receiver = (Node("", 0, None, 16, conn) for conn in socket.socketpair())
+    sender.conn.sendall(Node.HEADER.pack(Node.MAX_FRAME) + large[:100])
+    sender.close()
+    try:
+        receiver.recv()
+        assert False
+    except ConnectionResetError:
+        pass
+    assert len(receiver.rbuf) <= 256
+    receiver.close()
+    # the buffer shrinks back once a large message is drained
+    sender, receiver = (Node("", 0, None, 16, conn) for conn in socket.socketpair())
+    huge = bytes(range(256)) * (4 * Node.RBUF_SHRINK_SIZE // 256)
+    sending = threading.Thread(target=(lambda: [sender.send(msg) for msg in (huge, b"next")]))
+    sending.start()
+    assert receiver.recv() == huge
+    sending.join()
+    assert len(receiver.rbuf) <= max(16, len(b"next") + Node.HEADER.size)
+    assert receiver.recv() == b"next"
+    assert len(receiver.rbuf) == 16
+    sender.close()
+    receiver.close()
+    print("framing tested")
+
+def test_pool_server() -> None:
+    # echo one message per connection, in upper case
+    server = PoolServer("127.0.0.1", 0, (lambda client: client.send(client.recv().upper())), 4, 16)
+    # the throughput clock starts at the first connection
+    assert server.throughput() == 0.0 and server.start_time is None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    responses = [None] * 20
+    def request(i):
+        client = Client("127.0.0.1", server.port)
+        client.send(f"message {i}".encode())
+        responses[i] = client.recv()
+        client.close()
+    clients = [threading.Thread(target=request, args=(i,)) for i in range(20)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    assert responses == [f"MESSAGE {i}".encode() for i in range(20)]
+    assert server.start_time is not None
+    server.close()
+    print("pool_server tested")
+
+def test_key_pool() -> None:
+    pool = KeyPairPool(4)
+    # wait for the pool to fill
+    while pool.metrics()["depth"] < 4:
+        time.sleep(0.001)
+    for k in range(6):
+        PKs, SKs, PKs_str, SKs_str = pool.take()
+        assert (PKs_str, SKs_str) == (rsa.key2str(PKs), rsa.key2str(SKs))
+        # both halves share the modulus
+        assert PKs.n == SKs.n
+    metrics = pool.metrics()
+    assert metrics["taken"] == 6
+    assert metrics["generated"] >= 4
+    # close stops the refill thread, even while the pool is full
+    while pool.metrics()["depth"] < 4:
+        time.sleep(0.001)
+    pool.close()
+    assert not pool.refill_thread.is_alive()
+    n_generated = pool.metrics()["generated"]
+    pool.take()
+    time.sleep(0.05)
+    assert pool.metrics()["generated"] == n_generated
+    print("key_pool tested")
+
+def test_sessions() -> None:
+    DES_v = DES(b"8bytekey")
+    encoder = SimpleHmacEncoder(CharacterEncoder(), b"mac key")
+    manager = SessionManager("utf-8", DES_v, encoder, 100)
+    def service_request(i, TS, Lifetime):
+        # find a key and time stamp whose ticket and authenticator avoid
+        # the separator
+        for k in range(1000):
+            K_c_v = f"{i:04d}{k:04d}"
+            DES_c_v = DES(K_c_v.encode())
+            TS_k = (TS - (k / 1024))
+            Ticket_v = DES_v.encrypt(f"{K_c_v}||client{i}||addr||V||{TS_k}||{Lifetime}").decode("Latin-1")
+            Authenticator_c = DES_c_v.encrypt(f"client{i}||addr||{TS_k}").decode("Latin-1")
+            if ("|" not in (Ticket_v + Authenticator_c)):
+                return (DES_c_v, TS_k, f"{Ticket_v}||{Authenticator_c}".encode())
+    async def session(server, i):
+        DES_c_v, TS, request = service_request(i, time.time(), 60.0)
+        client = await AsyncClient.connect("127.0.0.1", server.port)
+        await client.send(request)
+        assert float(DES_c_v.decrypt(await client.recv_blocking()).rstrip("\0")) == TS + 1
+        await client.send(DES_c_v.encrypt(f"hello {i}", encode=encoder.encode))
+        # a message with the wrong MAC is counted, not delivered
+        await client.send(DES_c_v.encrypt(f"hello {i}", encode=SimpleHmacEncoder(CharacterEncoder(), b"other").encode))
+        return (client, DES_c_v)
+    async def expired(server):
+        DES_c_v, TS, request = service_request(99, 0.0, 60.0)
+        client = await AsyncClient.connect("127.0.0.1", server.port)
+        await client.send(request)
+        assert DES_c_v.decrypt(await client.recv_blocking()) == TICKET_EXPIRED
+        await client.close()
+    async def garbage(server, request):
+        # a malformed request is rejected, and the connection closed
+        client = await AsyncClient.connect("127.0.0.1", server.port)
+        await client.send(request)
+        assert await client.recv() is None
+        await client.close()
+    async def run():
+        server = AsyncServer("127.0.0.1", 0, manager.serve)
+        await server.start()
+        clients = await asyncio.gather(*(session(server, i) for i in range(20)))
+        await expired(server)
+        for request in (b"garbage", b"\xff\xfe||\xff\xfe\xfd\xfc\xfb\xfa\xf9\xf8"):
+            await garbage(server, request)
+        # wait for the messages to be received
+        while sum(session.n_bad_macs for session in manager.sessions.values()) < 20:
+            await asyncio.sleep(0.01)
+        stats = manager.stats()
+        await manager.broadcast("to all")
+        for client, DES_c_v in clients:
+            assert DES_c_v.decrypt(await client.recv_blocking(), decode=encoder.decode).rstrip("\0") == "to all"
+            await client.close()
+        while manager.sessions:
+            await asyncio.sleep(0.01)
+        await server.close()
+        return stats
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        stats = asyncio.run(run())
+    assert (stats["active"], stats["accepted"], stats["rejected"]) == (20, 20, 3)
+    assert all((session["received"], session["bad_macs"]) == (2, 1) for session in stats["sessions"].values())
+    assert all(f"client{i}: hello {i}" in out.getvalue() for i in range(20))
+    # handshakes in progress count towards the limit, so concurrent
+    # clients cannot exceed it
+    capped = SessionManager("utf-8", DES_v, encoder, 3)
+    async def handshake(server, i):
+        client = await AsyncClient.connect("127.0.0.1", server.port)
+        # let every connection reach the manager before any request
+        await asyncio.sleep(0.2)
+        DES_c_v, TS, request = service_request(i, time.time(), 60.0)
+        try:
+            await client.send(request)
+            return (await client.recv()) is not None
+        except ConnectionError:
+            return False
+        finally:
+            await client.close()
+    async def run_capped():
+        server = AsyncServer("127.0.0.1", 0, capped.serve)
+        await server.start()
+        accepted = await asyncio.gather(*(handshake(server, i) for i in range(20, 28)))
+        await server.close()
+        return accepted
+    with contextlib.redirect_stdout(io.StringIO()):
+        accepted = asyncio.run(run_capped())
+    assert (sum(accepted), capped.n_accepted, capped.n_rejected) == (3, 3, 5)
+    print("sessions tested")
+
+def test_ticket_cache() -> None:
+    # entries expire at their given time
+    now = [0.0]
+    cache = ExpiringLruCache(2, (lambda: now[0]))
+    cache.put("a", 1, 10.0)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    now[0] = 10.0
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.stats()["expired"] == 1
+    # a valid ticket is verified once, then found in the cache
+    DES_v = DES(b"8bytekey")
+    ticket_cache.clear()
+    def request(TS):
+        Ticket_v = DES_v.encrypt(f"K_c_v123||client||addr||V||{TS}||60.0").decode("Latin-1")
+        return f"{Ticket_v}||authenticator".encode("utf-8")
+    msg_bytes = request(time.time())
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = [parse_ticket(msg_bytes, "utf-8", DES_v) for k in range(3)]
+        expired = parse_ticket(request(0.0), "utf-8", DES_v)
+    assert all(result == results[0] for result in results)
+    assert results[0][1:4] == ("authenticator", DES.for_key(b"K_c_v123"), "client")
+    assert results[0][4]
+    assert not expired[-1]
+    # the expired ticket is not cached
+    assert (ticket_cache.hits, len(ticket_cache)) == (2, 1)
+    print("ticket_cache tested")
+
+def test_replay_cache() -> None:
+    now = [1000.0]
+    cache = ReplayCache(10.0, 3, (lambda: now[0]))
+    assert cache.add("client", 1000.0, b"a")
+    assert cache.seen(b"a")
+    assert not cache.seen(b"b")
+    # a duplicate is refused
+    assert not cache.add("client", 1000.0, b"a")
+    # so is a time stamp outside the skew
+    assert not cache.add("client", 989.0, b"b")
+    # and anything beyond the cap
+    assert cache.add("client", 1001.0, b"b")
+    assert cache.add("client", 1002.0, b"c")
+    assert not cache.add("client", 1003.0, b"d")
+    # once older than the skew, the buckets are dropped
+    now[0] = 1020.0
+    assert cache.add("client", 1020.0, b"d")
+    assert cache.stats() == { "size": 1, "maxsize": 3, "buckets": 1,
+        "replays": 2, "stale": 1, "full": 1 }
+    # the same ID_c and TS under another ciphertext is a replay too
+    assert not cache.add("client", 1020.0, b"e")
+    assert not cache.seen(b"e")
+    # an authenticator is accepted once, then refused before decryption
+    DES_c_v = DES(b"K_c_v123")
+    Authenticator_c = DES_c_v.encrypt(f"client||addr||{time.time()}").decode("Latin-1")
+    assert check_authenticator(DES_c_v, Authenticator_c)[0] == "client"
+    try:
+        check_authenticator(DES_c_v, Authenticator_c)
+        assert False
+    except ReplayedAuthenticator:
+        pass
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            parse_ticket(f"ticket||{Authenticator_c}".encode("utf-8"), "utf-8", DES_c_v)
+        assert False
+    except ReplayedAuthenticator:
+        pass
+    # padding with 0 bytes, which decryption ignores, is still a replay
+    for padded in (f"{Authenticator_c}\0", f"{Authenticator_c}\0\0\0"):
+        try:
+            check_authenticator(DES_c_v, padded)
+            assert False
+        except ReplayedAuthenticator:
+            pass
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                parse_ticket(f"ticket||{padded}".encode("utf-8"), "utf-8", DES_c_v)
+            assert False
+        except ReplayedAuthenticator:
+            pass
+    print("replay_cache tested")
+
+def test_rsa_codec() -> None:
+    n, e, d = 56317, 59, 7571
+    msg = "ID-Server||ID-CA||56317,59"
+    ciphertext = rsa.encode(n, e, msg)
+    # the same as block by block with codec_block
+    padded = rsa.pad_block_msg(tuple(rsa.to_alpha.ords2alpha(rsa.str2ords(msg))))
+    assert ciphertext == rsa.ords2str(rsa.codec_block(n, e, padded, rsa.INGRAPH_LEN, rsa.OUTGRAPH_LEN))
+    assert rsa.decode(n, d, ciphertext) == msg
+    for letters in ((), tuple(b"ABCDEFGHIJ"), tuple(b"ZZZZYYYYX")):
+        assert tuple(rsa.codec_multigraphs(n, d, letters, 4, 3)) == tuple(rsa.codec_block(n, d, letters, 4, 3))
+    # messages over several decoding chunks, padded or not, and ending
+    # early at character# 256 before a letter, as the first ZQKGZ
+    for msg in (("ID-Server||" * 150), ("IDSERVER" * 150), ("ID" + chr(256) + "X" + "ZQKGZ" * 300)):
+        ciphertext = rsa.encode(n, e, msg)
+        assert len(ciphertext) > rsa.DECODE_CHUNK_LEN
+        outgraphs = tuple(rsa.codec_block(n, d, rsa.str2ords(ciphertext), rsa.OUTGRAPH_LEN, rsa.INGRAPH_LEN))
+        try:
+            outgraphs = outgraphs[:rsa.tupleindex(outgraphs, rsa.PAD_PREFIX)]
+        except ValueError:
+            pass
+        assert rsa.decode(n, d, ciphertext) == rsa.ords2str(rsa.to_alpha.alpha2ords(outgraphs))
+    assert rsa.decode(n, d, ciphertext) == "ID"
+    print("rsa_codec tested")
+
+def test_alpha_codec() -> None:
+    def chunked(codec, msg, i):
+        return codec.update(msg[:i]) + codec.update(msg[i:]) + codec.finalize()
+    # every short message over the letters and characters that matter,
+    # whole and split anywhere
+    for length in range(6):
+        for chars in itertools.product("ZQA .\xff", repeat=length):
+            msg = "".join(chars)
+            alpha = bytes(to_alpha.ords2alpha(map(ord, msg)))
+            assert to_alpha.encode_alpha(msg) == to_alpha.encode_alpha(msg.encode("Latin-1")) == alpha
+            assert to_alpha.decode_alpha(alpha) == "".join(map(chr, to_alpha.alpha2ords(alpha)))
+            for i in range(length + 1):
+                assert chunked(to_alpha.AlphaEncoder(), msg, i) == alpha
+        for letters in itertools.product("ZQAY", repeat=length):
+            alpha = "".join(letters).encode("ascii")
+            msg = "".join(map(chr, to_alpha.alpha2ords(alpha)))
+            assert to_alpha.decode_alpha(alpha) == msg
+            for i in range(length + 1):
+                assert chunked(to_alpha.AlphaDecoder(), alpha, i) == msg
+    # characters beyond Latin-1
+    msg = "caf\u00e9 \u0151 ZQ \u0270\u0281" + chr(to_alpha.MAX_ESCAPE_ORD)
+    assert to_alpha.encode_alpha(msg) == bytes(to_alpha.ords2alpha(map(ord, msg)))
+    try:
+        to_alpha.encode_alpha(chr(to_alpha.MAX_ESCAPE_ORD + 1))
+        assert False
+    except ValueError:
+        pass
+    print("alpha_codec tested")
+
+def test_rsa_parallel() -> None:
+    n, e, d = 56317, 59, 7571
+    msg = "".join(map(chr, range(256))) * 20
+    PK, SK = rsa.generate_key_pair(1024)
+    byts = bytes(range(256)) * 10
+    ciphertext = rsa.encode(n, e, msg)
+    plaintext = rsa.decode(n, d, ciphertext)
+    byte_ciphertext = rsa.encode_bytes(SK, byts)
+    rsa.PARALLEL_MIN_BLOCKS, rsa.PARALLEL_WORKERS = 8, 2
+    try:
+        # the multigraph scheme stays serial
+        assert rsa.encode(n, e, msg) == ciphertext
+        assert rsa.decode(n, d, ciphertext) == plaintext
+        # OAEP randomizes the byte scheme, so compare through decoding
+        parallel_ciphertext = rsa.encode_bytes(SK, byts)
+        assert len(parallel_ciphertext) == len(byte_ciphertext)
+        assert rsa.decode_bytes(PK, parallel_ciphertext) == byts
+        assert rsa.decode_bytes(PK, byte_ciphertext) == byts
+        assert rsa.process_pool_workers == 2
+    finally:
+        rsa.PARALLEL_MIN_BLOCKS, rsa.PARALLEL_WORKERS = None, None
+        rsa.shutdown_pool()
+    print("rsa_parallel tested")
+
+def test_certificate_cache() -> None:
+    PKca, SKca = rsa.generate_key_pair(1024)
+    PKs, SKs = rsa.generate_key_pair(1024)
+    Cert_s = rsa.sign_message(SKca, f"{C_client.ID_s}||ID-CA||{rsa.key2str(PKs)}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "cert_cache.json")
+        cache = C_client.CertificateCache(2, path)
+        certificate = C_client.verify_certificate(Cert_s, PKca, cache)
+        assert certificate == (C_client.ID_s, "ID-CA", PKs)
+        # verified once, then found in the cache
+        assert C_client.verify_certificate(Cert_s, PKca, cache) == certificate
+        assert (cache.hits, cache.misses) == (1, 1)
+        # the CA key is part of the key
+        try:
+            C_client.verify_certificate(Cert_s, PKs, cache)
+            assert False
+        except ValueError:
+            pass
+        # reloaded after a restart, and bounded
+        for i in range(3):
+            cache.put((f"certificate {i}", rsa.key2str(PKca)), ("ID", "ID-CA", PKs))
+        cache.save()
+        # saved privately, leaving no temporary file
+        assert (os.stat(path).st_mode & 0o777) == 0o600
+        assert os.listdir(tmp_dir) == ["cert_cache.json"]
+        reloaded = C_client.CertificateCache(2, path)
+        assert len(reloaded) == 2
+        assert reloaded.get((Cert_s, rsa.key2str(PKca))) is None
+        assert reloaded.get(("certificate 2", rsa.key2str(PKca))) == ("ID", "ID-CA", PKs)
+        # an unreadable file starts empty
+        with open(path, "w") as f:
+            f.write("not json")
+        assert len(C_client.CertificateCache(2, path)) == 0
+    print("certificate_cache tested")
+
+def test_ca_key() -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "ca_key.txt")
+        # generated privately on the first run, then reused
+        n, e, d, p, q = run_node.load_ca_key(path, 1024)
+        assert n.bit_length() == 1024 and n == p * q
+        assert (os.stat(path).st_mode & 0o777) == 0o600
+        assert run_node.load_ca_key(path, 1024) == (n, e, d, p, q)
+        assert os.listdir(tmp_dir) == ["ca_key.txt"]
+    print("ca_key tested")
+
+def test_session_resumption() -> None:
+    PKs, SKs = rsa.generate_key_pair(1024)
+    Cert_s = rsa.sign_message(run_node.SKca, f"{C_client.ID_s}||ID-CA||{rsa.key2str(PKs)}")
+    sealer_res = AS_TGS_server.TicketSealer()
+    sessions = []
+    def register(client):
+        DES_sess = AS_TGS_server.register_client(client, PKs, SKs, Cert_s, sealer_res)
+        assert AS_TGS_server.receive_service_data_request(client, DES_sess) == AS_TGS_server.MEMO_REQ
+        AS_TGS_server.send_service_data(client, DES_sess)
+    def request(store):
+        client = Client("127.0.0.1", server.port)
+        try:
+            DES_sess = C_client.requestClientRegistrationService(client, store)
+        finally:
+            client.close()
+        sessions.append(DES_sess)
+        return store.get()
+    server = PoolServer("127.0.0.1", 0, register, 2, 4)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # keep verified certificates off the disk
+    certificate_cache = C_client.certificate_cache
+    C_client.certificate_cache = C_client.CertificateCache(1)
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir, contextlib.redirect_stdout(io.StringIO()):
+            path = os.path.join(tmp_dir, "resumption_ticket.json")
+            store = C_client.ResumptionStore(path)
+            # the full handshake issues a ticket
+            first = request(store)
+            assert first is not None and first.expiry > time.time()
+            # the session key is saved privately, leaving no temporary file
+            assert (os.stat(path).st_mode & 0o777) == 0o600
+            assert os.listdir(tmp_dir) == ["resumption_ticket.json"]
+            # which resumes the session, after a restart, with a new key
+            resumed = request(C_client.ResumptionStore(path))
+            assert resumed.K_sess != first.K_sess
+            assert resumed.Ticket_res != first.Ticket_res
+            assert AS_TGS_server.open_resumption_ticket(sealer_res, resumed.Ticket_res)[:2] == (resumed.K_sess, C_client.ID_pki)
+            # blocks of another client's ticket spliced into one's own,
+            # or any altered ticket, are refused before decryption
+            K_attacker = bytes(32)
+            attacker = AS_TGS_server.create_resumption_ticket(sealer_res, K_attacker, "attacker", resumed.expiry)
+            for n in range(16, len(resumed.Ticket_res), 16):
+                for tampered in ((attacker[:n] + resumed.Ticket_res[n:]),
+                        (resumed.Ticket_res[:n] + f"{(int(resumed.Ticket_res[n], 16) ^ 1):x}" + resumed.Ticket_res[(n + 1):])):
+                    try:
+                        AS_TGS_server.open_resumption_ticket(sealer_res, tampered)
+                        assert False
+                    except UnexpectedMac:
+                        pass
+            # a ticket sealed by another server, or expired, or whose
+            # key is wrong, or spliced falls back to the full handshake
+            forged = [C_client.ResumptionTicket(AS_TGS_server.create_resumption_ticket(AS_TGS_server.TicketSealer(), resumed.K_sess, C_client.ID_pki, resumed.expiry), resumed.K_sess, resumed.expiry),
+                C_client.ResumptionTicket(AS_TGS_server.create_resumption_ticket(sealer_res, resumed.K_sess, C_client.ID_pki, time.time()), resumed.K_sess, resumed.expiry),
+                resumed._replace(K_sess=first.K_sess),
+                C_client.ResumptionTicket((attacker[:128] + resumed.Ticket_res[128:]), K_attacker, resumed.expiry)]
+            for ticket in forged:
+                store = C_client.ResumptionStore()
+                store.put(ticket)
+                renewed = request(store)
+                assert renewed is not None and renewed.Ticket_res != ticket.Ticket_res
+            # the session keys work throughout
+            assert len(sessions) == 6
+            # an expired ticket is not presented
+            store = C_client.ResumptionStore(clock=(lambda: resumed.expiry))
+            store.put(resumed)
+            assert store.get() is None
+    finally:
+        C_client.certificate_cache = certificate_cache
+        server.close()
+    print("session_resumption tested")
+
+def test_rsa_keys() -> None:
+    assert [m for m in range(200) if rsa.is_probable_prime(m)] == [m for m in range(2, 200)
+        if all(m % j for j in range(2, m))]
+    # a Carmichael number and a product of 2 large primes
+    assert not rsa.is_probable_prime(561)
+    assert not rsa.is_probable_prime(rsa.random_prime(64) * rsa.random_prime(64))
+    PK, SK = rsa.generate_key_pair(1024)
+    assert PK.n == SK.n and PK.n.bit_length() == 1024
+    assert (PK.k * SK.k) % ((SK.crt.p - 1) * (SK.crt.q - 1)) == 1
+    # CRT gives the same result as the plain exponent
+    x = 0x1234567890ABCDEF
+    y = rsa.key_pow(PK, x)
+    assert rsa.key_pow(SK, y) == rsa.key_pow(rsa.RsaKey(SK.n, SK.k), y) == x
+    # keys still unpack as (n, k), and keep CRT through strings
+    n, k = SK
+    assert rsa.str2key(rsa.key2str(SK)).crt == SK.crt
+    assert rsa.str2key(rsa.key2str(PK)).crt is None
+    for msg in ("", "ID-Server||ID-CA||" + rsa.key2str(PK), "\0\xff\u20ac" * 100):
+        ciphertext = rsa.encrypt(PK, msg)
+        assert "|" not in ciphertext
+        assert rsa.decrypt(SK, ciphertext) == msg
+        signed_msg = rsa.sign_message(SK, msg)
+        assert "|" not in signed_msg
+        assert rsa.verify_message(PK, signed_msg) == msg
+    # a signature covers the digest of the whole message, so neither
+    # splicing 2 signed messages, nor dropping a part of one, verifies
+    PK2, SK2 = rsa.generate_key_pair(1024)
+    cert1, cert2 = (rsa.sign_message(SK, f"ID-Server||ID-CA||{rsa.key2str(PKk)}") for PKk in (PK, PK2))
+    body1, signature1 = cert1.split(".")
+    body2, signature2 = cert2.split(".")
+    for forged in ((body1[:200] + body2[200:] + "." + signature1),
+            (body1[:200] + body2[200:] + "." + signature2),
+            (body1[:200] + body1[400:] + "." + signature1),
+            (body1 + "." + signature2), (body1 + "." + rsa.sign(SK2, bytes.fromhex(body1)).hex()),
+            (body1 + "." + signature1[2:]), body1, "not hex.00"):
+        try:
+            rsa.verify_message(PK, forged)
+            assert False
+        except ValueError:
+            pass
+    # a modulus too small for the digest cannot sign
+    try:
+        rsa.sign(rsa.generate_key_pair(384)[1], b"")
+        assert False
+    except ValueError:
+        pass
+    # OAEP pads each block with a random seed, and refuses a tampered block
+    ciphertext = rsa.encode_bytes(PK, b"yes")
+    assert rsa.encode_bytes(PK, b"yes") != ciphertext
+    tampered = bytearray(ciphertext)
+    tampered[-1] ^= 1
+    for wrong in (bytes(tampered), rsa.encode_bytes(SK, b"yes"), b"", ciphertext[1:]):
+        try:
+            rsa.decode_bytes(SK, wrong)
+            assert False
+        except ValueError:
+            pass
+    # a modulus below the OAEP overhead has no room for a message
+    try:
+        rsa.encode_bytes(rsa.generate_key_pair(512)[0], b"")
+        assert False
+    except ValueError:
+        pass
+    # legacy keys keep the alphabetic scheme
+    PKl, SKl = rsa.split_key_pair((56317, 59, 7571))
+    assert rsa.encrypt(PKl, "legacy") == rsa.encode(56317, 59, "legacy")
+    print("rsa_keys tested")
+
+def test_async_node() -> None:
+    des = DES(b"8bytekey")
+    async def handler(node):
+        # echo each decrypted message back encrypted, in upper case
+        msg_bytes = await node.recv()
+        plaintext = await offload(des.decrypt, msg_bytes)
+        await node.send(await offload(des.encrypt, plaintext.upper()))
+    async def client(server, i):
+        client = await AsyncClient.connect("127.0.0.1", server.port)
+        await client.send(des.encrypt(f"message {i:08d}"))
+        response = des.decrypt(await client.recv_blocking())
+        await client.close()
+        return response
+    async def run():
+        server = AsyncServer("127.0.0.1", 0, handler)
+        await server.start()
+        responses = await asyncio.gather(*(client(server, i) for i in range(2000)))
+        await server.close()
+        return responses
+    responses = asyncio.run(run())
+    assert responses == [f"MESSAGE {i:08d}" for i in range(2000)]
+    # closing the server ends the connections still open
+    async def wait_forever(node):
+        assert await node.recv() is None
+    async def run_idle():
+        server = AsyncServer("127.0.0.1", 0, wait_forever)
+        await server.start()
+        clients = [await AsyncClient.connect("127.0.0.1", server.port) for i in range(3)]
+        while server.n_active < 3:
+            await asyncio.sleep(0.001)
+        await asyncio.wait_for(server.close(), 5)
+        # the handlers returned, and the clients see EOF
+        while server.n_active:
+            await asyncio.sleep(0.001)
+        for client in clients:
+            assert await client.recv() is None
+            await client.close()
+    asyncio.run(run_idle())
+    print("async_node tested")
+
 print("Testing... \033[1;32m")
 
 # basic functions
 test_bitize()
 test_debitize()
+test_bit_conversion()
 test_permute()
+test_permutation()
 
 test_key_gen()
 test_enc_block()
 test_encrypt()
 test_dec_block()
 test_decrypt()
+test_engines()
+test_f_impls()
+test_batch()
+test_for_key()
+test_modes()
+test_triple_des()
+test_parallel()
+test_zero_copy()
+test_hmac_modes()
+test_alpha_codec()
+test_rsa_codec()
+test_rsa_keys()
+test_rsa_parallel()
+test_certificate_cache()
+test_ca_key()
+test_session_resumption()
+test_framing()
+test_pool_server()
+test_key_pool()
+test_ticket_cache()
+test_replay_cache()
+test_async_node()
+test_sessions()
 
 
 print("All tests passed!" + "\033[0m")
@@ -1,15 +1,27 @@
 import time
 from enum import Enum
 import logging
+from hashlib import sha256
+from threading import Lock
 
 # local library run_node
 import run_node
 from run_node import KEY_CHARSET
-from crypto import DES
+from cache import ExpiringLruCache
 
 # expired ticket message
 TICKET_EXPIRED = "This ticket has expired."
 
+# maximum number of verified tickets to remember
+TICKET_CACHE_SIZE = 4096
+# verified tickets, by (server key, ciphertext ticket), until they expire
+ticket_cache = ExpiringLruCache(TICKET_CACHE_SIZE)
+
+# allowed clock skew between client and server [in seconds]
+REPLAY_SKEW = 300.0
+# maximum number of authenticators to remember
+REPLAY_CACHE_SIZE = 100000
+
 
 class TicketValidity(Enum):
     VALID = True
@@ -29,6 +41,142 @@ class TicketValidity(Enum):
         # filter out any expired ticket
         return TicketValidity.valueOf(now - timestamp < lifetime)
 
+class ReplayedAuthenticator(Exception):
+    '''
+    Thrown when an authenticator has been seen before, or is outside
+    the allowed clock skew.
+    '''
+
+
+class ReplayCache:
+    '''
+    Remembers the authenticators seen within the allowed clock skew.
+    Entries are kept in buckets by time stamp, and whole buckets are
+    dropped once older than the skew, so memory stays flat however many
+    authenticators arrive.  Each authenticator is found both by the
+    digest of its ciphertext, before decryption, and by its decrypted
+    (ID_c, TS), so a ciphertext altered to decrypt the same is still
+    refused.
+    '''
+
+    # number of buckets spanning the skew
+    BUCKETS_PER_SKEW = 4
+
+    def __init__(self, skew: float, maxsize: int, clock: 'Callable[[], float]'=time.time):
+        '''
+        Initializes an empty replay cache.
+        @param skew: float = allowed clock skew [in seconds]
+        @param maxsize: int = hard cap on the number of authenticators;
+            beyond it, new ones are refused rather than risk a replay
+        @param clock = returns the current time
+        '''
+        self.skew = skew
+        self.maxsize = maxsize
+        self.clock = clock
+        self.bucket_width = (skew / ReplayCache.BUCKETS_PER_SKEW)
+        # {bucket index: {digest: (ID_c, TS), (ID_c, TS): digest}}
+        self.buckets = {}
+        self.size = 0
+        self.lock = Lock()
+        # counters of authenticators refused
+        self.n_replays = 0
+        self.n_stale = 0
+        self.n_full = 0
+
+    def seen(self, digest: bytes) -> bool:
+        '''
+        Checks for a digest already stored, before any decryption.
+        @param digest: bytes = digest of the ciphertext authenticator
+        @return whether it has been seen
+        '''
+        with self.lock:
+            if (any((digest in bucket) for bucket in self.buckets.values())):
+                self.n_replays += 1
+                return True
+            return False
+
+    def add(self, ID_c: str, TS: float, digest: bytes) -> bool:
+        '''
+        Stores a decrypted authenticator if it is fresh.
+        @param ID_c: str = client in the authenticator
+        @param TS: float = time stamp in the authenticator
+        @param digest: bytes = digest of the ciphertext authenticator
+        @return whether it was fresh: not seen, within the skew, and
+            with room in the cache
+        '''
+        with self.lock:
+            now = self.clock()
+            if (abs(now - TS) > self.skew):
+                self.n_stale += 1
+                return False
+            self.evict(now)
+            if (any(((digest in bucket) or ((ID_c, TS) in bucket))
+                    for bucket in self.buckets.values())):
+                self.n_replays += 1
+                return False
+            if (self.size >= self.maxsize):
+                self.n_full += 1
+                return False
+            bucket = self.buckets.setdefault(int(TS // self.bucket_width), {})
+            bucket[digest] = (ID_c, TS)
+            bucket[(ID_c, TS)] = digest
+            self.size += 1
+            return True
+
+    def evict(self, now: float):
+        '''
+        Drops the buckets whose time stamps are all older than the skew.
+        '''
+        oldest = int((now - self.skew) // self.bucket_width)
+        for index in [index for index in self.buckets if (index < oldest)]:
+            # 2 keys per authenticator
+            self.size -= (len(self.buckets.pop(index)) // 2)
+
+    def stats(self) -> 'dict[str, int]':
+        '''
+        @return the number stored and buckets, and counters of refusals
+        '''
+        return { 'size': self.size, 'maxsize': self.maxsize,
+            'buckets': len(self.buckets), 'replays': self.n_replays,
+            'stale': self.n_stale, 'full': self.n_full }
+# end class ReplayCache
+
+# authenticators seen within the clock skew
+replay_cache = ReplayCache(REPLAY_SKEW, REPLAY_CACHE_SIZE)
+
+
+def authenticator_digest(Authenticator_c: str) -> bytes:
+    '''
+    @return the digest identifying a ciphertext authenticator, without
+        the trailing 0 bytes that decryption ignores
+    '''
+    return sha256(Authenticator_c.encode(KEY_CHARSET).rstrip(b'\x00')).digest()
+
+def check_authenticator(DES_shared_c, Authenticator_c):
+    '''
+    Decrypts an authenticator, and records it in the replay cache.
+    @return (ID_c, AD_c, TS) in the authenticator
+    @raise ReplayedAuthenticator if it was seen before, or is stale
+    '''
+    # decrypt Authenticator_c
+    # 1st encode Authenticator_c to the key charset
+    # this includes 0 bytes
+    cipher_Authenticator_c_byts_untrim = Authenticator_c.encode(KEY_CHARSET)
+    # trim last 0 bytes
+    cipher_Authenticator_c_byts = bytes.rstrip(cipher_Authenticator_c_byts_untrim, b'\x00')
+    # decrypt Authenticator_c
+    plain_Authenticator_c = DES_shared_c.decrypt(cipher_Authenticator_c_byts)
+    # split Authenticator_c
+    ID_c, AD_c, TS_str = plain_Authenticator_c.split('||')
+    # parse the timestamp TS
+    TS = float(TS_str.rstrip('\0'))
+    # refuse it unless fresh
+    if (not(replay_cache.add(ID_c, TS, authenticator_digest(Authenticator_c)))):
+        raise ReplayedAuthenticator(f'authenticator from {ID_c} at {TS} was replayed or is stale')
+    return (ID_c, AD_c, TS)
+# end def check_authenticator(DES_shared_c, Authenticator_c)
+
+
 def receive_ticket(server, charset, des_server):
     # configure the logger
     logging.basicConfig(level=logging.INFO)
@@ -38,6 +186,30 @@ def receive_ticket(server, charset, des_server):
 
     # receive the message
     msg_bytes = run_node.recv_blocking(server)
+    # parse and validate it
+    next_server_ID, Authenticator_c, DES_shared_c, ID_c, Ticket_validity = (
+        parse_ticket(msg_bytes, charset, des_server))
+
+    # filter out any expired ticket
+    if (not(Ticket_validity)):
+        # encrypt an expiration message
+        cipher_expire = DES_shared_c.encrypt(TICKET_EXPIRED)
+        # send expiration message
+        server.send(cipher_expire)
+        # listen for a new message
+        return False
+    # end if (now - TS2 >= Lifetime2)
+
+    return (next_server_ID, Authenticator_c, DES_shared_c, ID_c)
+# end def receive_ticket(server, charset, des_server)
+
+def parse_ticket(msg_bytes, charset, des_server):
+    '''
+    Decrypts and validates the ticket in a message received by
+    receive_ticket.
+    @return (next_server_ID, Authenticator_c, DES_shared_c, ID_c,
+        Ticket_validity)
+    '''
     # decode the message
     msg_chars = msg_bytes.decode(charset)
     # log the message received
@@ -53,36 +225,50 @@ def receive_ticket(server, charset, des_server):
     # if > 3 fields, then [0] is next server
     next_server_ID = (message_split[0] if (len(message_split) >= 3) else '')
 
-    # decrypt the Ticket
+    # refuse a replayed authenticator before any decryption
+    if (replay_cache.seen(authenticator_digest(Authenticator_c))):
+        raise ReplayedAuthenticator('authenticator was replayed')
+
     # 1st encode the ticket to the key charset
     # this includes 0 bytes
     cipher_Ticket_byts_untrim = cipher_Ticket_chars.encode(KEY_CHARSET)
+    # a ticket verified before is valid until it expires
+    cache_key = (des_server.packed_keys, cipher_Ticket_byts_untrim)
+    verified = ticket_cache.get(cache_key)
+    if (verified is not None):
+        DES_shared_c, ID_c = verified
+        Ticket_validity = TicketValidity.VALID
+    else:
+        DES_shared_c, ID_c, Ticket_validity = verify_ticket(
+            cipher_Ticket_byts_untrim, des_server, cache_key)
+    # print the validity
+    print(f'The ticket is {Ticket_validity}')
+    print()
+
+    return (next_server_ID, Authenticator_c, DES_shared_c, ID_c, Ticket_validity)
+# end def parse_ticket(msg_bytes, charset, des_server)
+
+def verify_ticket(cipher_Ticket_byts_untrim, des_server, cache_key):
+    '''
+    Decrypts and validates a ticket, and caches it if valid.
+    @return (DES_shared_c, ID_c, Ticket_validity)
+    '''
     # trim last 0 bytes
     cipher_Ticket_byts = bytes.rstrip(cipher_Ticket_byts_untrim, b'\x00')
     # decrypt the ticket
     plain_Ticket = des_server.decrypt(cipher_Ticket_byts)
     # split the ticket
     K_shared_c, ID_c, AD_c, server_ID, TS_str, Lifetime_str = plain_Ticket.split('||')
-    # create DES for key shared between C, this server
-    DES_shared_c = DES(K_shared_c.encode(KEY_CHARSET))
+    # find the session cipher for key shared between C, this server
+    # tickets are reused, so their keys are cached
+    DES_shared_c = run_node.SessionCipher.for_key(K_shared_c.encode(KEY_CHARSET))
 
     # parse timestamps
     TS, Lifetime = (float(ts.rstrip('\0')) for ts in (TS_str, Lifetime_str))
     # validate Ticket by its TS
     Ticket_validity = TicketValidity.validate(TS, Lifetime)
-    # print the validity
-    print(f'The ticket is {Ticket_validity}')
-    print()
-
-    # filter out any expired ticket
-    if (not(Ticket_validity)):
-        # encrypt an expiration message
-        cipher_expire = DES_shared_c.encrypt(TICKET_EXPIRED)
-        # send expiration message
-        server.send(cipher_expire)
-        # listen for a new message
-        return False
-    # end if (now - TS2 >= Lifetime2)
-
-    return (next_server_ID, Authenticator_c, DES_shared_c, ID_c)
-# end def receive_ticket(server, charset, des_server)
+    # remember a valid ticket until it expires
+    if (Ticket_validity):
+        ticket_cache.put(cache_key, (DES_shared_c, ID_c), (TS + Lifetime))
+    return (DES_shared_c, ID_c, Ticket_validity)
+# end def verify_ticket(cipher_Ticket_byts_untrim, des_server, cache_key)
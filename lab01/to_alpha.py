@@ -17,6 +17,10 @@ At the first instance of Z, the string enters alphabetic mode.
 
 An intentional sequence of ZQ in the source will be marked up as
 ZQDPDGZ.
+
+ords2alpha and alpha2ords convert one ordinal at a time.  For whole
+messages, encode_alpha and decode_alpha, or AlphaEncoder and
+AlphaDecoder for messages in chunks, give the same output in bulk.
 '''
 
 DEBUG_MODE = False
@@ -143,3 +147,258 @@ def alpha2ords(alpha):
     if (prevZ):
         yield ordZ
 # end def alpha2ords(alpha)
+
+
+#######################################################################
+# bulk codec
+#######################################################################
+
+# standard libraries
+import re
+import sys
+from itertools import accumulate, chain
+
+# the largest ordinal whose escape letters fit in a byte
+MAX_ESCAPE_ORD = (((0xFF - ordA + 1) * (lenAZ - 1)) - 1)
+# the largest ordinal whose escape letters are in A-Y
+MAX_PLAIN_ESCAPE_ORD = ((lenAZ - 1)**2 - 1)
+# the 2 letters escaping each ordinal, as in ords2alpha
+ESCAPE_PAIRS = tuple(chr((o // (lenAZ - 1)) + ordA) + chr((o % (lenAZ - 1)) + ordA)
+    for o in range(MAX_ESCAPE_ORD + 1))
+
+# markers for entering and exiting escape mode, before they are
+# replaced with ZQ and Z; they cannot be confused with letters
+ESCAPE_OPEN = '\x00'
+ESCAPE_CLOSE = '\x01'
+# translation table giving each letter as is, and each other character
+# as its escape pair between markers
+ESCAPE_TABLE = [(chr(o) if (o in rangeAZ) else (ESCAPE_OPEN + ESCAPE_PAIRS[o] + ESCAPE_CLOSE))
+    for o in range(MAX_PLAIN_ESCAPE_ORD + 1)]
+# a literal ZQ in the source, possibly with escaped characters between
+LITERAL_ZQ = re.compile(f'Z({ESCAPE_OPEN}[A-Y]*{ESCAPE_CLOSE})?Q')
+# its escape, ZQDPDGZ
+ESCAPED_ZQ = r'Z\1QDPDGZ'
+LETTER = re.compile('[A-Z]')
+
+# sequences in alphabetic mode that are not sent as is: an escape, or
+# Z with the next character
+ALPHA_SEQUENCES = re.compile('ZQ([^Z]*)(Z?)|(Z.)', re.DOTALL)
+
+# the character for each pair of escape letters, indexed by the pair
+# as a native 16-bit integer (None until first use)
+escape_pair_chars = None
+
+
+def get_escape_pair_chars() -> 'list[str]':
+    '''
+    Builds the table of characters for each pair of escape letters on
+    first use.  Pairs that give a negative code map to None.
+    '''
+    global escape_pair_chars
+    if (escape_pair_chars is None):
+        # the first letter is the low byte in little endian
+        if ('little'==sys.byteorder):
+            pairs = ((first, second) for second in range(0x100) for first in range(0x100))
+        else:
+            pairs = ((first, second) for first in range(0x100) for second in range(0x100))
+        codes = ((((first - ordA) * (lenAZ - 1)) + (second - ordA)) for (first, second) in pairs)
+        escape_pair_chars = [(chr(code) if (code >= 0) else None) for code in codes]
+    return escape_pair_chars
+
+
+class AlphaEncoder:
+    '''
+    Encodes a message to alphabetic in chunks, with the same output as
+    ords2alpha.  Each chunk is translated at once through ESCAPE_TABLE,
+    then the markers of adjacent escapes are merged, and the markers
+    replaced with ZQ and Z.
+    '''
+
+    def __init__(self):
+        # flags that the last letter was Z
+        self.prevZ = False
+        # flags that currently in escape mode (c.f. alphabetic mode)
+        self.escape_mode = False
+        self.finalized = False
+
+    def update(self, chunk: 'bytes | str') -> bytes:
+        '''
+        Encodes the next part of the message.
+        @param chunk: bytes | str = the bytes, or characters, to encode
+        @return the letters encoded so far
+        @raise ValueError if a character is beyond MAX_ESCAPE_ORD, so
+            its escape letters do not fit in bytes
+        '''
+        if (self.finalized):
+            raise ValueError('encoder already finalized')
+        src = (chunk.decode('Latin-1') if isinstance(chunk, (bytes, bytearray, memoryview)) else chunk)
+        if (not(src)):
+            return b''
+        # escape letters beyond A-Y could be mistaken for markers of
+        # literal ZQ, so encode those one by one
+        if (max(src) > chr(MAX_PLAIN_ESCAPE_ORD)):
+            return self.update_ords(src)
+        text = src.translate(ESCAPE_TABLE).replace((ESCAPE_CLOSE + ESCAPE_OPEN), '')
+        # the letter and escape mode left by the previous chunk, as
+        # context for a literal ZQ across chunks
+        context = ('Z' if (self.prevZ) else '')
+        if (self.escape_mode):
+            context += ESCAPE_OPEN
+            if (ESCAPE_OPEN==text[0]):
+                # continue the escape
+                text = text[1:]
+            else:
+                text = (ESCAPE_CLOSE + text)
+        text = LITERAL_ZQ.sub(ESCAPED_ZQ, (context + text))[len(context):]
+        # stay in escape mode for the next chunk
+        self.escape_mode = (ESCAPE_CLOSE==text[-1])
+        if (self.escape_mode):
+            text = text[:-1]
+        self.prevZ = last_letter_is_Z(src, self.prevZ)
+        return text.replace(ESCAPE_OPEN, 'ZQ').replace(ESCAPE_CLOSE, 'Z').encode('ascii')
+
+    def update_ords(self, src: str) -> bytes:
+        '''
+        Encodes the characters one by one, as ords2alpha.
+        '''
+        out = []
+        for c in src:
+            o = ord(c)
+            if (o in rangeAZ):
+                if (self.escape_mode):
+                    out.append('Z')
+                    self.escape_mode = False
+                if ((ordQ==o) and self.prevZ):
+                    out.append('QDPDGZ')
+                    self.prevZ = False
+                    continue
+                out.append(c)
+                self.prevZ = (ordZ==o)
+                continue
+            if (not(self.escape_mode)):
+                out.append('ZQ')
+                self.escape_mode = True
+            if (o > MAX_ESCAPE_ORD):
+                raise ValueError(f'character beyond {MAX_ESCAPE_ORD} cannot be'
+                    ' encoded in bytes')
+            out.append(ESCAPE_PAIRS[o])
+        # end for c in src
+        return ''.join(out).encode('Latin-1')
+
+    def finalize(self) -> bytes:
+        '''
+        Closes the encoder.
+        @return Z to exit escape mode if necessary
+        '''
+        if (self.finalized):
+            raise ValueError('encoder already finalized')
+        self.finalized = True
+        return (b'Z' if (self.escape_mode) else b'')
+# end class AlphaEncoder
+
+
+def last_letter_is_Z(src: str, prevZ: bool) -> bool:
+    '''
+    Checks whether the last letter in src is Z.
+    @param prevZ: bool = the result if src has no letters
+    '''
+    i_Z = src.rfind('Z')
+    if (i_Z < 0):
+        return (prevZ if (LETTER.search(src) is None) else False)
+    return (LETTER.search(src, (i_Z + 1)) is None)
+
+
+class AlphaDecoder:
+    '''
+    Decodes an alphabetic message in chunks, with the same output as
+    alpha2ords, as characters.  Escape codes reach beyond Latin-1, so
+    the output is a string.  Each chunk is split at its escapes at once;
+    the letters of all escapes are decoded in pairs through a table, and
+    joined back between the letters sent as is.  The state is carried
+    across chunks, so a chunk may end within any escape sequence.
+    '''
+
+    def __init__(self):
+        # flags that previous character was Z
+        self.prevZ = False
+        # flags that currently in escape mode (c.f. alphabetic mode)
+        self.escape_mode = False
+        # an escape letter whose pair is pending
+        self.pending = ''
+        self.finalized = False
+
+    def update(self, chunk: 'bytes | str') -> str:
+        '''
+        Decodes the next part of the message.
+        @param chunk: bytes | str = the letters to decode
+        @return the characters decoded so far
+        '''
+        if (self.finalized):
+            raise ValueError('decoder already finalized')
+        text = (chunk if isinstance(chunk, str) else bytes(chunk).decode('Latin-1'))
+        if (not(text)):
+            return ''
+        # resume a held Z, or an escape, from the previous chunk
+        if (self.prevZ):
+            text = ('Z' + text)
+        elif (self.escape_mode):
+            text = ('ZQ' + text)
+        # split into the letters sent as is, and for each sequence
+        # between, the escape letters, the Z ending it, or Z with the
+        # next character
+        parts = ALPHA_SEQUENCES.split(text)
+        sent = parts[0::4]
+        escapes = [(letters or '') for letters in parts[1::4]]
+        end_Zs = parts[2::4]
+        Z_pairs = parts[3::4]
+        # an escape not ended by Z continues in the next chunk
+        self.escape_mode = (bool(escapes) and (end_Zs[-1]==''))
+        # any other Z left ends the chunk, so hold it
+        self.prevZ = sent[-1].endswith('Z')
+        if (self.prevZ):
+            sent[-1] = sent[-1][:-1]
+        # decode the letters of all escapes at once, in pairs that may
+        # span escapes
+        n_pending = len(self.pending)
+        letters = (self.pending + ''.join(escapes))
+        n_paired = (len(letters) & ~1)
+        self.pending = letters[n_paired:]
+        try:
+            decoded = ''.join(map(get_escape_pair_chars().__getitem__,
+                memoryview(letters[:n_paired].encode('Latin-1')).cast('H')))
+        except TypeError as e:
+            raise ValueError('escape letters give a negative code') from e
+        # each pair is decoded in the escape holding its second letter
+        bounds = [(n_letters // 2) for n_letters in
+            accumulate(map(len, escapes), initial=n_pending)]
+        decoded_escapes = map(decoded.__getitem__, map(slice, bounds, bounds[1:]))
+        return ''.join(chain(
+            filter(None, chain.from_iterable(zip(sent, decoded_escapes, Z_pairs))),
+            sent[-1:]))
+
+    def finalize(self) -> str:
+        '''
+        Closes the decoder.
+        @return a held Z, if any
+        '''
+        if (self.finalized):
+            raise ValueError('decoder already finalized')
+        self.finalized = True
+        return ('Z' if (self.prevZ) else '')
+# end class AlphaDecoder
+
+
+def encode_alpha(msg: 'bytes | str') -> bytes:
+    '''
+    Encodes a whole message to alphabetic, as ords2alpha.
+    @raise ValueError if a character is beyond MAX_ESCAPE_ORD
+    '''
+    encoder = AlphaEncoder()
+    return (encoder.update(msg) + encoder.finalize())
+
+def decode_alpha(alpha: 'bytes | str') -> str:
+    '''
+    Decodes a whole alphabetic message, as alpha2ords.
+    '''
+    decoder = AlphaDecoder()
+    return (decoder.update(alpha) + decoder.finalize())